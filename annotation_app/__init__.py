@@ -0,0 +1 @@
+# Data-access helpers used by streamlit_app.py
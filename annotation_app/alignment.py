@@ -0,0 +1,238 @@
+import threading
+
+import numpy as np
+
+# Token alignment suggestions learned from processed sentences and saved token mappings.
+#
+# Two sparse count matrices over (source token, translation token) pairs are kept:
+# sentence co-occurrences (each processed sentence pair counts every distinct pair of
+# its tokens once) and explicit mappings from token_mappings. A pair is stored as one
+# int64 key, source_id * KEY_BASE + translation_id, in a sorted array with a parallel
+# array of counts, so a sentence's whole source x translation grid is looked up with a
+# single np.searchsorted call. New counts go to a small dict first and are merged into
+# the arrays in bulk.
+
+KEY_BASE = 1 << 32
+
+# Processed sentence pairs, in rowid pages
+PROCESSED_SENTENCES_SQL = '''
+    SELECT rowid, edited_source, edited_translation
+    FROM annotation
+    WHERE rowid > ?
+    AND action = 'processed'
+    ORDER BY rowid
+    LIMIT ?
+'''
+
+# Saved token mappings, in rowid pages
+TOKEN_MAPPINGS_PAGE_SQL = '''
+    SELECT rowid, source_token, translation_token
+    FROM token_mappings
+    WHERE rowid > ?
+    ORDER BY rowid
+    LIMIT ?
+'''
+
+
+# Sparse counts keyed by pair key: a sorted key array plus pending increments
+class PairCounts:
+    def __init__(self, merge_every=20000):
+        self.merge_every = merge_every
+        self.keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self._pending = {}
+
+    def __len__(self):
+        return len(self.keys) + len(self._pending)
+
+    # Function to count every key in `keys` (an int64 array, repeats allowed) once
+    def add(self, keys):
+        if len(keys) >= self.merge_every:
+            self._merge(*np.unique(keys, return_counts=True))
+            return
+        for key in keys.tolist():
+            self._pending[key] = self._pending.get(key, 0) + 1
+        if len(self._pending) >= self.merge_every:
+            self.merge()
+
+    # Function to fold the pending increments into the sorted arrays
+    def merge(self):
+        if self._pending:
+            keys = np.fromiter(self._pending.keys(), dtype=np.int64, count=len(self._pending))
+            counts = np.fromiter(self._pending.values(), dtype=np.int64, count=len(self._pending))
+            self._pending = {}
+            self._merge(keys, counts)
+
+    def _merge(self, keys, counts):
+        all_keys = np.concatenate([self.keys, keys])
+        unique_keys, inverse = np.unique(all_keys, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts]),
+                                  minlength=len(unique_keys)).astype(np.int64)
+        self.keys = unique_keys
+
+    # Function to get the count of every key in `keys` (an int64 array)
+    def lookup(self, keys):
+        if len(self.keys):
+            positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            counts = np.where(self.keys[positions] == keys, self.counts[positions], 0)
+        else:
+            counts = np.zeros(len(keys), dtype=np.int64)
+        if self._pending:
+            counts = counts + np.fromiter((self._pending.get(key, 0) for key in keys.tolist()),
+                                          dtype=np.int64, count=len(keys))
+        return counts
+
+
+# Token -> id map with per-id counts that grow with the vocabulary: `counts` (sentences
+# containing the token) and `mapped` (saved mappings from the token)
+class Vocabulary:
+    def __init__(self):
+        self.ids = {}
+        self.counts = np.zeros(1024, dtype=np.int64)
+        self.mapped = np.zeros(1024, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Function to get ids for tokens, adding new tokens to the vocabulary
+    def add(self, tokens):
+        ids = [self.ids.setdefault(token, len(self.ids)) for token in tokens]
+        if len(self.ids) > len(self.counts):
+            growth = np.zeros(max(len(self.ids), len(self.counts)), dtype=np.int64)
+            self.counts = np.concatenate([self.counts, growth])
+            self.mapped = np.concatenate([self.mapped, growth])
+        return np.array(ids, dtype=np.int64)
+
+    # Function to get ids of the known tokens among `tokens`, with their positions
+    def known(self, tokens):
+        pairs = [(position, self.ids[token]) for position, token in enumerate(tokens) if token in self.ids]
+        return [position for position, _ in pairs], np.array([id_ for _, id_ in pairs], dtype=np.int64)
+
+
+def _distinct(tokens):
+    return list(dict.fromkeys(token.strip() for token in tokens if token.strip()))
+
+
+# Suggests source -> translation token alignments for a sentence.
+#
+# A pair's score mixes how often annotators mapped the source token to that
+# translation token (share of the source token's saved mappings) with how strongly the
+# two co-occur in processed sentences (Dice, or normalized PMI with method="pmi").
+# Suggestions are picked greedily, best score first, at most one per token on each side.
+class AlignmentModel:
+    def __init__(self, method="dice", min_count=2, mapping_weight=0.6, min_score=0.15, merge_every=20000):
+        if method not in ("dice", "pmi"):
+            raise ValueError(f"unknown association measure: {method}")
+        self.method = method
+        self.min_count = min_count
+        self.mapping_weight = mapping_weight
+        self.min_score = min_score
+        self.sentences = 0
+        self._source = Vocabulary()
+        self._translation = Vocabulary()
+        self._cooccurrence = PairCounts(merge_every)
+        self._mappings = PairCounts(merge_every)
+        self._lock = threading.RLock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sentences": self.sentences,
+                "source_vocabulary": len(self._source),
+                "translation_vocabulary": len(self._translation),
+                "cooccurring_pairs": len(self._cooccurrence),
+                "mapped_pairs": len(self._mappings),
+            }
+
+    # Function to count the token co-occurrences of processed (source, translation) sentence pairs
+    def add_sentences(self, sentence_pairs):
+        keys, source_ids, translation_ids = [], [], []
+        with self._lock:
+            for source_text, translation_text in sentence_pairs:
+                sources = self._source.add(_distinct((source_text or "").split()))
+                translations = self._translation.add(_distinct((translation_text or "").split()))
+                if not len(sources) or not len(translations):
+                    continue
+                keys.append(np.add.outer(sources * KEY_BASE, translations).ravel())
+                source_ids.append(sources)
+                translation_ids.append(translations)
+            if not keys:
+                return
+            self.sentences += len(keys)
+            np.add.at(self._source.counts, np.concatenate(source_ids), 1)
+            np.add.at(self._translation.counts, np.concatenate(translation_ids), 1)
+            self._cooccurrence.add(np.concatenate(keys))
+
+    # Function to count saved (source_token, translation_token) mappings
+    def add_mappings(self, mappings):
+        mappings = [(source.strip(), translation.strip()) for source, translation in mappings
+                    if source and translation]
+        if not mappings:
+            return
+        with self._lock:
+            sources = self._source.add([source for source, _ in mappings])
+            translations = self._translation.add([translation for _, translation in mappings])
+            np.add.at(self._source.mapped, sources, 1)
+            self._mappings.add(sources * KEY_BASE + translations)
+
+    # Function to learn from everything already in the database, one page per query
+    def load(self, conn, page_size=10000):
+        c = conn.cursor()
+        for sql, add in ((PROCESSED_SENTENCES_SQL, self.add_sentences),
+                         (TOKEN_MAPPINGS_PAGE_SQL, self.add_mappings)):
+            after = 0
+            while True:
+                c.execute(sql, (after, page_size))
+                rows = c.fetchall()
+                if not rows:
+                    break
+                add([row[1:] for row in rows])
+                after = rows[-1][0]
+        with self._lock:
+            self._cooccurrence.merge()
+            self._mappings.merge()
+        return self
+
+    def _association(self, cooccurrence, source_counts, translation_counts):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if self.method == "dice":
+                scores = 2 * cooccurrence / (source_counts + translation_counts)
+            else:
+                probability = cooccurrence / self.sentences
+                pmi = np.log(probability / ((source_counts / self.sentences) * (translation_counts / self.sentences)))
+                scores = np.clip(pmi / -np.log(probability), 0, 1)
+        return np.where(cooccurrence >= self.min_count, np.nan_to_num(scores), 0.0)
+
+    # Function to suggest alignments between the tokens of a source and a translation
+    # sentence; returns [(source_token, translation_token, score)], best first
+    def suggest(self, source_tokens, translation_tokens, limit=None):
+        source_tokens, translation_tokens = _distinct(source_tokens), _distinct(translation_tokens)
+        with self._lock:
+            source_positions, sources = self._source.known(source_tokens)
+            translation_positions, translations = self._translation.known(translation_tokens)
+            if not len(sources) or not len(translations):
+                return []
+            keys = np.add.outer(sources * KEY_BASE, translations).ravel()
+            shape = (len(sources), len(translations))
+            cooccurrence = self._cooccurrence.lookup(keys).reshape(shape).astype(float)
+            mapped = self._mappings.lookup(keys).reshape(shape).astype(float)
+            mapped_totals = self._source.mapped[sources].astype(float)
+            association = self._association(cooccurrence, self._source.counts[sources][:, None].astype(float),
+                                            self._translation.counts[translations][None, :].astype(float))
+
+        share = mapped / np.maximum(mapped_totals, 1)[:, None]
+        scores = self.mapping_weight * share + (1 - self.mapping_weight) * association
+        suggestions, used_sources, used_translations = [], set(), set()
+        for flat in np.argsort(-scores, axis=None, kind="stable"):
+            i, j = divmod(int(flat), shape[1])
+            if scores[i, j] < self.min_score:
+                break
+            if i in used_sources or j in used_translations:
+                continue
+            used_sources.add(i)
+            used_translations.add(j)
+            suggestions.append((source_tokens[source_positions[i]], translation_tokens[translation_positions[j]],
+                                round(float(scores[i, j]), 3)))
+            if limit is not None and len(suggestions) >= limit:
+                break
+        return suggestions
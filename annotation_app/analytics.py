@@ -0,0 +1,303 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from annotation_app.db_pool import connect_target, transaction
+from annotation_app.migrations import apply_migrations
+
+# Inter-annotator agreement and quality analytics.
+#
+#     python -m annotation_app.analytics <sqlite path | sqlitecloud:// url> [--rebuild] [--csv-dir reports/]
+#
+# Everything reported is derived from additive sufficient statistics kept in
+# quality_stats: per annotator pair and dialect, the confusion counts of
+# selected_translation and the shared/own token mappings; per dialect, the Fleiss
+# terms; per day, dialect and annotator, annotations by action and mapped tokens.
+#
+# A run only reads the rows touched since the previous one: every row (entity_id) with
+# a new annotation or token mapping. The row's statistics are computed twice, without
+# and with the new data, and the difference is added to quality_stats together with
+# the new high-water marks, in one transaction. Rows are read STATS_CHUNK at a time
+# into pandas and all statistics are computed with groupby/merge, never per row.
+
+STATS_CHUNK = 5000
+STATS_KEYS = ["metric", "dialect", "day", "annotator_a", "annotator_b", "category"]
+
+# Rows with a new annotation or token mapping between two high-water marks
+TOUCHED_ROWS_SQL = '''
+    SELECT entity_id FROM annotation WHERE rowid > ? AND rowid <= ?
+    UNION
+    SELECT entity_id FROM token_mappings WHERE rowid > ? AND rowid <= ?
+'''
+
+# Annotations of a range of rows, with the row's dialect
+ANNOTATIONS_RANGE_SQL = '''
+    SELECT a.rowid, a.entity_id, a.annotator_id, a.action, a.selected_translation,
+           substr(a.datestamp, 1, 10), o.dialect
+    FROM annotation a
+    LEFT JOIN original_data o ON o.entity_id = a.entity_id
+    WHERE a.entity_id BETWEEN ? AND ?
+    AND a.rowid <= ?
+'''
+
+# Token mappings of a range of rows
+MAPPINGS_RANGE_SQL = '''
+    SELECT rowid, entity_id, annotator_id, source_token, translation_token
+    FROM token_mappings
+    WHERE entity_id BETWEEN ? AND ?
+    AND rowid <= ?
+'''
+
+ADD_STATS_SQL = '''
+    INSERT INTO quality_stats (metric, dialect, day, annotator_a, annotator_b, category, value)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (metric, dialect, day, annotator_a, annotator_b, category) DO UPDATE SET
+        value = value + excluded.value
+'''
+
+SAVE_MARK_SQL = '''
+    INSERT INTO quality_marks (source, last_rowid) VALUES (?, ?)
+    ON CONFLICT (source) DO UPDATE SET last_rowid = excluded.last_rowid
+'''
+
+ANNOTATION_COLUMNS = ["rowid", "entity_id", "annotator_id", "action", "selected_translation", "day", "dialect"]
+MAPPING_COLUMNS = ["rowid", "entity_id", "annotator_id", "source_token", "translation_token"]
+
+
+def _frame(rows, columns):
+    return pd.DataFrame.from_records(rows, columns=columns)
+
+
+# Function to turn a grouped Series into quality_stats rows for `metric`;
+# `columns` names the stats column each index level goes to
+def _to_stats(series, metric, columns):
+    frame = series.rename("value").reset_index()
+    frame.columns = list(columns) + ["value"]
+    frame["metric"] = metric
+    for column in STATS_KEYS:
+        if column not in frame:
+            frame[column] = ""
+    frame[STATS_KEYS] = frame[STATS_KEYS].fillna("").astype(str)
+    return frame[STATS_KEYS + ["value"]]
+
+
+# Function to compute the sufficient statistics of a set of whole rows (all their
+# annotations and mappings); returns a quality_stats-shaped DataFrame
+def row_stats(annotations, mappings):
+    annotations = annotations.assign(dialect=annotations["dialect"].fillna(""), day=annotations["day"].fillna(""))
+    stats = [_to_stats(annotations.groupby(["dialect", "day", "annotator_id", "action"], dropna=False).size(),
+                       "annotations", ["dialect", "day", "annotator_a", "category"])]
+
+    # An annotator's latest processed annotation of a row is their answer for it
+    processed = (annotations[annotations["action"] == "processed"]
+                 .sort_values("rowid")
+                 .drop_duplicates(["entity_id", "annotator_id"], keep="last")
+                 [["entity_id", "annotator_id", "selected_translation", "day", "dialect"]])
+    processed = processed.assign(selected_translation=processed["selected_translation"].fillna(""))
+    if processed.empty:
+        return pd.concat(stats, ignore_index=True)
+
+    mappings = (mappings.drop_duplicates(["entity_id", "annotator_id", "source_token", "translation_token"])
+                .merge(processed[["entity_id", "annotator_id", "dialect"]], on=["entity_id", "annotator_id"]))
+    sizes = mappings.groupby(["entity_id", "annotator_id"]).size().rename("mapped")
+    processed = processed.merge(sizes, left_on=["entity_id", "annotator_id"], right_index=True, how="left")
+    processed["mapped"] = processed["mapped"].fillna(0)
+    stats.append(_to_stats(processed.groupby(["dialect", "day", "annotator_id"])["mapped"].sum(),
+                           "mapped_tokens", ["dialect", "day", "annotator_a"]))
+
+    # Fleiss' kappa terms over rows with at least two answers
+    answers = processed.groupby(["entity_id", "dialect", "selected_translation"]).size().rename("n").reset_index()
+    answers["squares"] = answers["n"] ** 2
+    per_row = answers.groupby("entity_id").agg(dialect=("dialect", "first"), raters=("n", "sum"),
+                                               squares=("squares", "sum"))
+    per_row = per_row[per_row["raters"] >= 2]
+    per_row["agreement"] = (per_row["squares"] - per_row["raters"]) / (per_row["raters"] * (per_row["raters"] - 1))
+    stats.append(_to_stats(per_row.groupby("dialect").size(), "fleiss_rows", ["dialect"]))
+    stats.append(_to_stats(per_row.groupby("dialect")["agreement"].sum(), "fleiss_agreement", ["dialect"]))
+    answers = answers[answers["entity_id"].isin(per_row.index)]
+    stats.append(_to_stats(answers.groupby(["dialect", "selected_translation"])["n"].sum(),
+                           "fleiss_ratings", ["dialect", "category"]))
+
+    # Annotator pairs that answered the same row: selected_translation confusion counts
+    # and, for token alignments, shared mappings and each side's mapping count
+    pairs = processed.merge(processed, on=["entity_id", "dialect"], suffixes=("_a", "_b"))
+    pairs = pairs[pairs["annotator_id_a"] < pairs["annotator_id_b"]]
+    pairs = pairs.assign(category=pairs["selected_translation_a"] + "|" + pairs["selected_translation_b"])
+    pair_keys = ["dialect", "annotator_id_a", "annotator_id_b"]
+    pair_columns = ["dialect", "annotator_a", "annotator_b"]
+    stats.append(_to_stats(pairs.groupby(pair_keys + ["category"]).size(), "confusion", pair_columns + ["category"]))
+    stats.append(_to_stats(pairs.groupby(pair_keys)["mapped_a"].sum(), "alignment_a", pair_columns))
+    stats.append(_to_stats(pairs.groupby(pair_keys)["mapped_b"].sum(), "alignment_b", pair_columns))
+    shared = mappings.merge(mappings, on=["entity_id", "dialect", "source_token", "translation_token"],
+                            suffixes=("_a", "_b"))
+    shared = shared[shared["annotator_id_a"] < shared["annotator_id_b"]]
+    stats.append(_to_stats(shared.groupby(pair_keys).size(), "alignment_shared", pair_columns))
+    return pd.concat(stats, ignore_index=True)
+
+
+# Function to add up quality_stats-shaped frames, dropping keys that sum to zero
+def _combine(frames):
+    combined = pd.concat(frames, ignore_index=True).groupby(STATS_KEYS, sort=False)["value"].sum().reset_index()
+    return combined[combined["value"] != 0]
+
+
+def _marks(conn):
+    c = conn.cursor()
+    c.execute("SELECT source, last_rowid FROM quality_marks")
+    marks = dict(c.fetchall())
+    return marks.get("annotation", 0), marks.get("token_mappings", 0)
+
+
+# Function to bring quality_stats up to date with the annotations and mappings written
+# since the last run (or recompute it from scratch with rebuild=True).
+# Returns how many rows were (re)analysed.
+def update_stats(conn, rebuild=False, chunk=STATS_CHUNK):
+    c = conn.cursor()
+    if rebuild:
+        with transaction(conn):
+            c.execute("DELETE FROM quality_stats")
+            c.execute("DELETE FROM quality_marks")
+    last_annotation, last_mapping = _marks(conn)
+    c.execute("SELECT COALESCE(MAX(rowid), 0) FROM annotation")
+    high_annotation = c.fetchone()[0]
+    c.execute("SELECT COALESCE(MAX(rowid), 0) FROM token_mappings")
+    high_mapping = c.fetchone()[0]
+    c.execute(TOUCHED_ROWS_SQL, (last_annotation, high_annotation, last_mapping, high_mapping))
+    touched = np.sort(np.fromiter((row[0] for row in c.fetchall() if row[0] is not None), dtype=np.int64))
+
+    deltas = []
+    for start in range(0, len(touched), chunk):
+        entity_ids = touched[start:start + chunk]
+        low, high = int(entity_ids[0]), int(entity_ids[-1])
+        c.execute(ANNOTATIONS_RANGE_SQL, (low, high, high_annotation))
+        annotations = _frame(c.fetchall(), ANNOTATION_COLUMNS)
+        c.execute(MAPPINGS_RANGE_SQL, (low, high, high_mapping))
+        mappings = _frame(c.fetchall(), MAPPING_COLUMNS)
+        annotations = annotations[annotations["entity_id"].isin(entity_ids)]
+        mappings = mappings[mappings["entity_id"].isin(entity_ids)]
+        after = row_stats(annotations, mappings)
+        before = row_stats(annotations[annotations["rowid"] <= last_annotation],
+                           mappings[mappings["rowid"] <= last_mapping])
+        deltas.append(_combine([after, before.assign(value=-before["value"])]))
+
+    with transaction(conn):
+        if deltas:
+            delta = _combine(deltas)
+            c.executemany(ADD_STATS_SQL, delta[STATS_KEYS + ["value"]].itertuples(index=False, name=None))
+            c.execute("DELETE FROM quality_stats WHERE abs(value) < 1e-9")
+        c.execute(SAVE_MARK_SQL, ("annotation", high_annotation))
+        c.execute(SAVE_MARK_SQL, ("token_mappings", high_mapping))
+    return len(touched)
+
+
+# Function to read quality_stats into a DataFrame
+def load_stats(conn):
+    c = conn.cursor()
+    c.execute(f"SELECT {', '.join(STATS_KEYS)}, value FROM quality_stats")
+    return _frame(c.fetchall(), STATS_KEYS + ["value"])
+
+
+def _metric(stats, metric, keys):
+    return stats[stats["metric"] == metric].groupby(keys)["value"].sum()
+
+
+# Function to get per annotator pair agreement: rows answered by both, observed agreement
+# and Cohen's kappa on selected_translation, and micro-averaged F1 of their token
+# alignments on those rows. With by_dialect=True there is one line per dialect too.
+def pair_agreement(stats, by_dialect=False):
+    keys = (["dialect"] if by_dialect else []) + ["annotator_a", "annotator_b"]
+    confusion = stats[stats["metric"] == "confusion"]
+    confusion = confusion.assign(choice_a=confusion["category"].str.split("|").str[0],
+                                 choice_b=confusion["category"].str.split("|").str[1])
+    rows = confusion.groupby(keys)["value"].sum().rename("rows")
+    agreed = confusion[confusion["choice_a"] == confusion["choice_b"]].groupby(keys)["value"].sum()
+    choices_a = confusion.groupby(keys + ["choice_a"])["value"].sum().rename_axis(keys + ["choice"])
+    choices_b = confusion.groupby(keys + ["choice_b"])["value"].sum().rename_axis(keys + ["choice"])
+    chance = (choices_a * choices_b).dropna().groupby(keys).sum()
+
+    report = rows.to_frame()
+    report["observed"] = agreed.reindex(report.index).fillna(0) / report["rows"]
+    expected = chance.reindex(report.index).fillna(0) / report["rows"] ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        report["cohen_kappa"] = np.where(expected < 1, (report["observed"] - expected) / (1 - expected), 1.0)
+    shared = _metric(stats, "alignment_shared", keys).reindex(report.index).fillna(0)
+    mapped = (_metric(stats, "alignment_a", keys).reindex(report.index).fillna(0)
+              + _metric(stats, "alignment_b", keys).reindex(report.index).fillna(0))
+    report["alignment_f1"] = np.where(mapped > 0, 2 * shared / mapped.where(mapped > 0, 1), np.nan)
+    return report.reset_index()
+
+
+# Function to get Fleiss' kappa on selected_translation per dialect (and "" for all
+# dialects together), over rows answered by at least two annotators
+def fleiss_kappa(stats):
+    overall = stats.assign(dialect="")
+    stats = pd.concat([stats, overall], ignore_index=True)
+    rows = _metric(stats, "fleiss_rows", ["dialect"]).rename("rows")
+    observed = _metric(stats, "fleiss_agreement", ["dialect"]) / rows
+    ratings = _metric(stats, "fleiss_ratings", ["dialect", "category"])
+    shares = ratings / ratings.groupby("dialect").transform("sum")
+    expected = (shares ** 2).groupby("dialect").sum().reindex(rows.index)
+    report = rows.to_frame()
+    report["observed"] = observed
+    with np.errstate(divide="ignore", invalid="ignore"):
+        report["fleiss_kappa"] = np.where(expected < 1, (observed - expected) / (1 - expected), 1.0)
+    return report.reset_index()
+
+
+# Function to get throughput and quality per day and dialect: annotations by action,
+# share of rejected rows and mapped tokens per processed row
+def daily_quality(stats, by_annotator=False):
+    keys = ["day", "dialect"] + (["annotator_a"] if by_annotator else [])
+    report = _metric(stats, "annotations", keys + ["category"]).unstack("category", fill_value=0)
+    report.columns.name = None
+    for action in ("processed", "reject", "skipped"):
+        if action not in report:
+            report[action] = 0
+    report["annotations"] = report.sum(axis=1)
+    report["reject_rate"] = report["reject"] / report["annotations"]
+    mapped = _metric(stats, "mapped_tokens", keys).reindex(report.index).fillna(0)
+    report["mappings_per_row"] = mapped / report["processed"].where(report["processed"] > 0)
+    report = report.reset_index().sort_values(keys).reset_index(drop=True)
+    if by_annotator:
+        report = report.rename(columns={"annotator_a": "annotator_id"})
+    return report
+
+
+# Command line entry point:
+#     python -m annotation_app.analytics <sqlite path | sqlitecloud:// url> [--rebuild] [--csv-dir reports/]
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Update and print inter-annotator agreement and quality reports.")
+    parser.add_argument("database", help="path to a SQLite file or a sqlitecloud:// connection string")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the statistics from scratch")
+    parser.add_argument("--by-dialect", action="store_true", help="break pair agreement down by dialect")
+    parser.add_argument("--csv-dir", help="also write each report as a CSV file into this directory")
+    args = parser.parse_args(argv)
+
+    conn = connect_target(args.database)
+    try:
+        apply_migrations(conn)
+        print(f"analysed {update_stats(conn, rebuild=args.rebuild):,} changed rows")
+        stats = load_stats(conn)
+    finally:
+        conn.close()
+
+    reports = {
+        "pair_agreement": pair_agreement(stats, by_dialect=args.by_dialect),
+        "fleiss_kappa": fleiss_kappa(stats),
+        "daily_quality": daily_quality(stats),
+    }
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        for name, report in reports.items():
+            print(f"\n{name}\n{report.round(3).to_string(index=False)}")
+    if args.csv_dir:
+        os.makedirs(args.csv_dir, exist_ok=True)
+        for name, report in reports.items():
+            report.to_csv(os.path.join(args.csv_dir, f"{name}.csv"), index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+from annotation_app.db_pool import transaction
+from annotation_app.progress import bump_progress
+from annotation_app.search import index_annotations
+
+# The write operations below never open or commit a transaction themselves, so they can
+# be combined freely: one row's writes in commit_processed_row(), or a whole batch of
+# journal entries in the write-behind worker (see write_behind.py).
+
+
+# Function to insert one annotation and count it in annotation_progress
+def insert_annotation(conn, entity_id, annotator_id, selected_translation, edited_source,
+                      edited_translation, action, datestamp):
+    conn.execute('''
+        INSERT INTO annotation (entity_id, selected_translation, edited_source, edited_translation, action, annotator_id, datestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (entity_id, selected_translation, edited_source, edited_translation, action, annotator_id, datestamp))
+    bump_progress(conn, annotator_id, datestamp[:10])
+
+
+# Function to set original_data.processed for a row ("yes", "reject", ...)
+def set_row_status(conn, entity_id, action):
+    conn.execute('UPDATE original_data SET processed = ? WHERE entity_id = ?', (action, entity_id))
+
+
+# Function to record a reject or skip in the annotation table, so the quality analytics
+# (see analytics.py) can count it per day and annotator. Unlike insert_annotation it
+# does not count towards the annotator's progress.
+def insert_action(conn, entity_id, annotator_id, action, datestamp):
+    conn.execute('''
+        INSERT INTO annotation (entity_id, action, annotator_id, datestamp)
+        VALUES (?, ?, ?, ?)
+    ''', (entity_id, action, annotator_id, datestamp))
+
+
+# Function to reject a row: mark it rejected and record who rejected it and when
+def reject_row(conn, entity_id, annotator_id, datestamp):
+    set_row_status(conn, entity_id, "reject")
+    insert_action(conn, entity_id, annotator_id, "reject", datestamp)
+
+
+# Function to skip a row for one annotator. The skip is recorded per annotator, so the
+# row is never offered to them again. With `lease_expires_at` (Unix time) the row is held
+# as 'skipped' by the annotator until then (see leases.LeasePolicy); without it the row
+# goes straight back to the pool for the other annotators.
+# With `datestamp` the skip is also recorded in the annotation table (insert_action).
+def skip_row(conn, entity_id, annotator_id, lease_expires_at=None, datestamp=None):
+    if lease_expires_at is None:
+        conn.execute('''
+            UPDATE original_data
+            SET processed = 'no', taken = 'no', taken_by = NULL, lease_expires_at = NULL
+            WHERE entity_id = ?
+        ''', (entity_id,))
+    else:
+        conn.execute('''
+            UPDATE original_data
+            SET processed = 'skipped', taken = 'yes', taken_by = ?, lease_expires_at = ?
+            WHERE entity_id = ?
+        ''', (annotator_id, lease_expires_at, entity_id))
+    conn.execute('''
+        INSERT OR IGNORE INTO skipped_rows (annotator_id, entity_id)
+        VALUES (?, ?)
+    ''', (annotator_id, entity_id))
+    if datestamp is not None:
+        insert_action(conn, entity_id, annotator_id, "skipped", datestamp)
+
+
+# Function to insert token mappings; `mappings` is a list of
+# (entity_id, source_token, translation_token) tuples, written with one executemany
+def insert_token_mappings(conn, annotator_id, mappings):
+    if not mappings:
+        return
+    conn.cursor().executemany('''
+        INSERT INTO token_mappings (entity_id, annotator_id, source_token, translation_token)
+        VALUES (?, ?, ?, ?)
+    ''', [(entity_id, annotator_id, source_token, translation_token)
+          for entity_id, source_token, translation_token in mappings])
+
+
+# Function to add token mappings to rows annotated earlier, keeping their search entries
+# (see search.py) in step
+def write_token_mappings(conn, annotator_id, mappings):
+    insert_token_mappings(conn, annotator_id, mappings)
+    index_annotations(conn, [mapping[0] for mapping in mappings], annotator_id)
+
+
+# Function to write everything produced by processing a row: the annotation (and its
+# progress counter), the row's processed flag, all token mappings and the search entry
+def write_processed_row(conn, entity_id, annotator_id, selected_translation, edited_source,
+                        edited_translation, datestamp, mappings):
+    insert_annotation(conn, entity_id, annotator_id, selected_translation, edited_source,
+                      edited_translation, "processed", datestamp)
+    set_row_status(conn, entity_id, "yes")
+    insert_token_mappings(conn, annotator_id, mappings)
+    index_annotations(conn, [entity_id], annotator_id)
+
+
+# Function to store a processed row in a single transaction: either all of it is
+# stored or, if any statement fails, none of it is
+def commit_processed_row(conn, entity_id, annotator_id, selected_translation, edited_source,
+                         edited_translation, datestamp, mappings):
+    with transaction(conn):
+        write_processed_row(conn, entity_id, annotator_id, selected_translation, edited_source,
+                            edited_translation, datestamp, mappings)
+
+
+# Named write operations, so a write can be run now or recorded in the write-behind
+# journal and replayed later with the same keyword arguments
+WRITE_OPERATIONS = {
+    "annotation": insert_annotation,
+    "processed_row": write_processed_row,
+    "reject_row": reject_row,
+    "row_status": set_row_status,
+    "skip_row": skip_row,
+    "token_mappings": write_token_mappings,
+}
@@ -0,0 +1,156 @@
+import argparse
+import sys
+from datetime import datetime
+
+from annotation_app.db_pool import connect_target, transaction
+from annotation_app.migrations import apply_migrations
+
+# Annotator assignments: each annotator's targets and the shards of the work pool they
+# claim from, kept in the annotators and annotator_shards tables.
+#
+#     python -m annotation_app.assignments <sqlite path | sqlitecloud:// url> list
+#     python -m annotation_app.assignments <sqlite path | sqlitecloud:// url> set <annotator id> \
+#         --daily-target 60 --work-days 42 --start-date 2024-09-24 --shard gulf --shard egy
+#
+# original_data.shard is a generated column (the row's dialect, '' when it has none)
+# indexed together with the row state, so each shard's pending rows are a separate
+# range of one index. An annotator with shards only claims rows from those shards; one
+# without shards claims from the whole pool.
+
+ASSIGNMENTS_SQL = '''
+    SELECT annotator_id, daily_target, work_days, start_date
+    FROM annotators
+    WHERE active = 1
+'''
+
+ANNOTATOR_SHARDS_SQL = "SELECT annotator_id, shard FROM annotator_shards ORDER BY annotator_id, shard"
+
+SAVE_ASSIGNMENT_SQL = '''
+    INSERT INTO annotators (annotator_id, daily_target, work_days, start_date, active)
+    VALUES (?, ?, ?, ?, 1)
+    ON CONFLICT (annotator_id) DO UPDATE SET
+        daily_target = excluded.daily_target,
+        work_days = excluded.work_days,
+        start_date = excluded.start_date,
+        active = 1
+'''
+
+# Free rows left in each shard
+SHARD_BACKLOG_SQL = '''
+    SELECT shard, COUNT(*) FROM original_data
+    WHERE processed = 'no'
+    AND taken = 'no'
+    GROUP BY shard
+    ORDER BY shard
+'''
+
+
+# One annotator's targets (rows per day over `work_days` days from `start_date`,
+# 'YYYY-MM-DD') and the shards they claim rows from (empty: the whole pool)
+class Assignment:
+    def __init__(self, annotator_id, daily_target, work_days, start_date, shards=()):
+        datetime.strptime(start_date, '%Y-%m-%d')
+        self.annotator_id = annotator_id
+        self.daily_target = int(daily_target)
+        self.work_days = int(work_days)
+        self.start_date = start_date
+        self.shards = tuple(shards)
+
+    @property
+    def total_target(self):
+        return self.daily_target * self.work_days
+
+    def __repr__(self):
+        return (f"Assignment({self.annotator_id!r}, daily_target={self.daily_target}, "
+                f"work_days={self.work_days}, start_date={self.start_date!r}, shards={list(self.shards)})")
+
+
+# Function to read every active annotator's assignment; returns {annotator_id: Assignment}
+def load_assignments(conn):
+    c = conn.cursor()
+    c.execute(ANNOTATOR_SHARDS_SQL)
+    shards = {}
+    for annotator_id, shard in c.fetchall():
+        shards.setdefault(annotator_id, []).append(shard)
+    c.execute(ASSIGNMENTS_SQL)
+    return {
+        annotator_id: Assignment(annotator_id, daily_target, work_days, start_date, shards.get(annotator_id, ()))
+        for annotator_id, daily_target, work_days, start_date in c.fetchall()
+    }
+
+
+# Function to add or update assignments (and replace their shards) in one transaction
+def save_assignments(conn, assignments):
+    c = conn.cursor()
+    with transaction(conn):
+        for assignment in assignments:
+            c.execute(SAVE_ASSIGNMENT_SQL, (assignment.annotator_id, assignment.daily_target,
+                                            assignment.work_days, assignment.start_date))
+            c.execute("DELETE FROM annotator_shards WHERE annotator_id = ?", (assignment.annotator_id,))
+            c.executemany("INSERT INTO annotator_shards (annotator_id, shard) VALUES (?, ?)",
+                          [(assignment.annotator_id, shard) for shard in assignment.shards])
+
+
+# Function to save `assignments` only if the annotators table is still empty, e.g. to
+# seed it from a legacy configuration; deactivated annotators are not brought back.
+# Returns whether they were saved.
+def seed_assignments(conn, assignments):
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM annotators LIMIT 1")
+    if c.fetchone() is not None:
+        return False
+    save_assignments(conn, assignments)
+    return True
+
+
+# Function to stop an annotator from logging in; their annotations are kept
+def deactivate_annotator(conn, annotator_id):
+    with transaction(conn):
+        conn.execute("UPDATE annotators SET active = 0 WHERE annotator_id = ?", (annotator_id,))
+
+
+# Function to count the free rows of every shard: {shard: rows}
+def shard_backlog(conn):
+    c = conn.cursor()
+    c.execute(SHARD_BACKLOG_SQL)
+    return dict(c.fetchall())
+
+
+# Command line entry point:
+#     python -m annotation_app.assignments <sqlite path | sqlitecloud:// url> list | set | deactivate
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show or change annotator targets and work shards.")
+    parser.add_argument("database", help="path to a SQLite file or a sqlitecloud:// connection string")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="show assignments and the free rows of each shard")
+    set_parser = commands.add_parser("set", help="add an annotator or change their assignment")
+    set_parser.add_argument("annotator_id")
+    set_parser.add_argument("--daily-target", type=int, required=True, help="rows per day")
+    set_parser.add_argument("--work-days", type=int, required=True, help="days the target runs for")
+    set_parser.add_argument("--start-date", required=True, help="first work day, YYYY-MM-DD")
+    set_parser.add_argument("--shard", action="append", default=[],
+                            help="dialect to claim rows from (repeatable; none: the whole pool)")
+    deactivate_parser = commands.add_parser("deactivate", help="stop an annotator from logging in")
+    deactivate_parser.add_argument("annotator_id")
+    args = parser.parse_args(argv)
+
+    conn = connect_target(args.database)
+    try:
+        apply_migrations(conn)
+        if args.command == "set":
+            save_assignments(conn, [Assignment(args.annotator_id, args.daily_target, args.work_days,
+                                               args.start_date, args.shard)])
+        elif args.command == "deactivate":
+            deactivate_annotator(conn, args.annotator_id)
+        for assignment in load_assignments(conn).values():
+            print(assignment)
+        if args.command == "list":
+            for shard, rows in shard_backlog(conn).items():
+                print(f"shard {shard or '(no dialect)'}: {rows:,} free rows")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from annotation_app.annotations import write_processed_row
+from annotation_app.db_pool import transaction
+from annotation_app.instrumentation import Metrics
+from annotation_app.row_claims import RowPrefetcher
+from annotation_app.storage import LocalSQLiteStorage
+
+# Headless load test of the annotation flow against a local SQLite stand-in.
+#
+#     python -m annotation_app.benchmark --rows 20000 --annotators 5 --actions 200 \
+#         --output benchmarks.jsonl
+#
+# Each simulated annotator runs the same data path as the Streamlit callbacks: take the
+# next row from its RowQueue, prefetch the one after it in the background, look up
+# previous mappings for a few source tokens, read its progress counters and then
+# process, skip or reject the row. Statements are counted per annotator thread by the
+# storage's instrumentation. A run fails if a row went to two annotators (other than
+# after a skip, which hands the row on), or to the same annotator twice.
+
+VOCABULARY_SIZE = 5000
+OPERATIONS = ("next_row", "mapping_lookup", "progress", "process", "skip", "reject")
+
+
+# Function to build a Zipf-like token sampler, so a few words are very common
+def _token_sampler(rng, prefix, size):
+    tokens = [f"{prefix}{i}" for i in range(size)]
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(size)))
+    return lambda k: rng.choices(tokens, cum_weights=cum_weights, k=k)
+
+
+# Function to fill original_data with `rows` synthetic sentences and `history` prior
+# processed rows (with annotations and mappings) so lookups have data to return
+def seed_corpus(storage, rows, history, seed=0, dialects=("gulf", "levant", "egypt", "maghreb", "iraq")):
+    rng = random.Random(seed)
+    source_words = _token_sampler(rng, "ع", VOCABULARY_SIZE)
+    target_words = _token_sampler(rng, "w", VOCABULARY_SIZE)
+    with storage.connection() as conn:
+        conn.execute("BEGIN")
+        conn.executemany('''
+            INSERT INTO original_data (entity_id, keyword, source_text, translation_1, translation_2,
+                                       translation_3, dialect, processed, taken, taken_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 'no', 'no', NULL)
+        ''', (
+            (entity_id, source_words(1)[0], " ".join(source_words(rng.randint(4, 14))),
+             " ".join(target_words(8)), " ".join(target_words(8)), " ".join(target_words(8)),
+             rng.choice(dialects))
+            for entity_id in range(1, rows + history + 1)
+        ))
+        conn.execute("COMMIT")
+    storage.migrate()
+
+    start = datetime(2024, 9, 24)
+    with storage.connection() as conn:
+        with transaction(conn):
+            for entity_id in range(rows + 1, rows + history + 1):
+                tokens = source_words(6)
+                write_processed_row(
+                    conn, entity_id, f"history{entity_id % 5}", "translation_1", " ".join(tokens),
+                    " ".join(target_words(6)), (start + timedelta(minutes=entity_id)).strftime('%Y-%m-%d %H:%M:%S'),
+                    [(entity_id, token, target_words(1)[0]) for token in tokens[:rng.randint(1, 6)]],
+                )
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# One simulated annotator working through `actions` rows
+def _annotator(storage, annotator_id, actions, batch_size, seed, timings, queries, claims, skips, lock):
+    rng = random.Random(seed)
+    prefetcher = RowPrefetcher(storage.row_queue(annotator_id, batch_size=batch_size))
+    local_timings = defaultdict(list)
+    local_queries = defaultdict(list)
+    local_claims = []
+    local_skips = []
+
+    def timed(operation, function, *args, **kwargs):
+        before = storage.metrics.current.queries
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        local_timings[operation].append(time.perf_counter() - started)
+        local_queries[operation].append(storage.metrics.current.queries - before)
+        return result
+
+    for _ in range(actions):
+        row = timed("next_row", prefetcher.next_row)
+        if row is None:
+            break
+        local_claims.append(row[0])
+        entity_id, source_text = row[0], row[2]
+        prefetcher.prefetch(exclude=[entity_id])
+        tokens = source_text.split()
+        for token in rng.sample(tokens, min(len(tokens), rng.randint(1, 3))):
+            timed("mapping_lookup", storage.mapping_summary, token)
+        timed("progress", storage.progress, annotator_id, time.strftime('%Y-%m-%d'))
+
+        choice = rng.random()
+        if choice < 0.8:
+            mappings = [(entity_id, token, f"w{rng.randrange(VOCABULARY_SIZE)}")
+                        for token in tokens[:rng.randint(1, 8)]]
+            timed("process", storage.commit_processed_row, entity_id, annotator_id, "translation_1",
+                  source_text, row[3], time.strftime('%Y-%m-%d %H:%M:%S'), mappings)
+        elif choice < 0.9:
+            local_skips.append(entity_id)
+            timed("skip", storage.write, "skip_row", entity_id=entity_id, annotator_id=annotator_id,
+                  datestamp=time.strftime('%Y-%m-%d %H:%M:%S'))
+        else:
+            timed("reject", storage.write, "reject_row", entity_id=entity_id, annotator_id=annotator_id,
+                  datestamp=time.strftime('%Y-%m-%d %H:%M:%S'))
+    prefetcher.wait()
+    prefetcher.release()
+
+    with lock:
+        for operation, values in local_timings.items():
+            timings[operation].extend(values)
+        for operation, values in local_queries.items():
+            queries[operation].extend(values)
+        claims[annotator_id] = local_claims
+        skips[annotator_id] = local_skips
+
+
+# Function to run one benchmark and return its results as a JSON-serializable dict
+def run_benchmark(rows=20000, history=2000, annotators=5, actions=200, batch_size=5, pool_size=8,
+                  seed=0, path=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = LocalSQLiteStorage(path or os.path.join(tmp, "benchmark.sqlite3"), pool_size=pool_size,
+                                     metrics=Metrics())
+        seed_corpus(storage, rows, history, seed=seed)
+
+        timings = defaultdict(list)
+        queries = defaultdict(list)
+        claims = {}
+        skips = {}
+        lock = threading.Lock()
+        threads = [
+            threading.Thread(target=_annotator, args=(storage, f"annotator{i}", actions, batch_size,
+                                                      seed + i, timings, queries, claims, skips, lock))
+            for i in range(annotators)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        storage.close()
+
+    # A row skipped by one annotator goes back to the pool for the others
+    claimed_by = defaultdict(set)
+    for annotator_id, entity_ids in claims.items():
+        skipped = set(skips[annotator_id])
+        for entity_id in entity_ids:
+            if entity_id not in skipped:
+                claimed_by[entity_id].add(annotator_id)
+    rows_claimed = sum(len(entity_ids) for entity_ids in claims.values())
+
+    operations = {}
+    for operation in OPERATIONS:
+        values = sorted(timings.get(operation, []))
+        counts = queries.get(operation, [])
+        operations[operation] = {
+            "count": len(values),
+            "p50_ms": round(_percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(_percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(_percentile(values, 0.99) * 1000, 3),
+            "queries_per_call": round(sum(counts) / len(counts), 2) if counts else 0.0,
+        }
+
+    return {
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "commit": _git_commit(),
+        "params": {"rows": rows, "history": history, "annotators": annotators, "actions": actions,
+                   "batch_size": batch_size, "pool_size": pool_size, "seed": seed},
+        "elapsed_s": round(elapsed, 3),
+        "rows_claimed": rows_claimed,
+        "rows_claimed_per_s": round(rows_claimed / elapsed, 1) if elapsed else 0.0,
+        "duplicate_claims": sum(1 for owners in claimed_by.values() if len(owners) > 1),
+        "repeated_rows": sum(len(entity_ids) - len(set(entity_ids)) for entity_ids in claims.values()),
+        "operations": operations,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Function to find the most recent stored run with the same parameters
+def _previous_result(output, params):
+    if not output or not os.path.exists(output):
+        return None
+    previous = None
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                if result.get("params") == params:
+                    previous = result
+    return previous
+
+
+def _format_report(result, previous=None):
+    def delta(current, before):
+        if before in (None, 0):
+            return ""
+        return f" ({(current - before) / before * 100:+.0f}%)"
+
+    lines = [
+        f"commit {result['commit']}  {result['params']}",
+        f"rows claimed: {result['rows_claimed']} in {result['elapsed_s']}s = "
+        f"{result['rows_claimed_per_s']}/s"
+        + delta(result["rows_claimed_per_s"], previous and previous["rows_claimed_per_s"]),
+        f"duplicate claims: {result['duplicate_claims']}  rows served twice to one annotator: "
+        f"{result['repeated_rows']}",
+        f"{'operation':<16}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}",
+    ]
+    for operation, stats in result["operations"].items():
+        before = previous and previous["operations"].get(operation, {}).get("p95_ms")
+        lines.append(
+            f"{operation:<16}{stats['count']:>7}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+            f"{stats['p99_ms']:>10}{stats['queries_per_call']:>9}" + delta(stats["p95_ms"], before)
+        )
+    if previous:
+        lines.append(f"(% changes are against commit {previous['commit']} from {previous['timestamp']})")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent annotators against a local SQLite database.")
+    parser.add_argument("--rows", type=int, default=20000, help="pending rows in the synthetic corpus")
+    parser.add_argument("--history", type=int, default=2000, help="already processed rows with mappings")
+    parser.add_argument("--annotators", type=int, default=5, help="concurrent annotator threads")
+    parser.add_argument("--actions", type=int, default=200, help="rows handled by each annotator")
+    parser.add_argument("--batch-size", type=int, default=5, help="rows claimed per round-trip")
+    parser.add_argument("--pool-size", type=int, default=8, help="connection pool size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="keep the database at this path instead of a temporary file")
+    parser.add_argument("--output", help="append the result to this JSONL file and compare with the last "
+                                         "run that used the same parameters")
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(rows=args.rows, history=args.history, annotators=args.annotators,
+                           actions=args.actions, batch_size=args.batch_size, pool_size=args.pool_size,
+                           seed=args.seed, path=args.db)
+    print(_format_report(result, _previous_result(args.output, result["params"])))
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return 1 if result["duplicate_claims"] or result["repeated_rows"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Raised when every pooled connection is busy for longer than the acquire timeout
+class PoolTimeout(Exception):
+    pass
+
+
+# A live connection plus the bookkeeping the pool needs to decide if it is stale
+class PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+# Thread-safe, bounded pool of database connections shared by all Streamlit sessions.
+#
+# `connect` is a zero-argument callable returning a new DB-API connection that is
+# ready to use (database selected, pragmas applied). Connections that sat idle for
+# longer than `ping_after` seconds are health-checked with a cheap query before being
+# handed out, connections older than `max_lifetime` seconds are recycled, and at most
+# `max_size` connections are open at any time. With a Metrics instance, the time spent
+# waiting for a connection is recorded as "pool.acquire".
+class ConnectionPool:
+    def __init__(self, connect, max_size=8, acquire_timeout=10.0, ping_after=30.0, max_lifetime=1800.0,
+                 metrics=None):
+        self._connect = connect
+        self._metrics = metrics
+        self.max_size = max_size
+        self._acquire_timeout = acquire_timeout
+        self._ping_after = ping_after
+        self._max_lifetime = max_lifetime
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._created = 0
+        self._discarded = 0
+        self._closed = False
+
+    # Function to check that a pooled connection is still usable
+    def _is_healthy(self, pooled):
+        now = time.monotonic()
+        if now - pooled.created_at > self._max_lifetime:
+            return False
+        if now - pooled.last_used < self._ping_after:
+            return True
+        try:
+            pooled.conn.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def _open_new(self):
+        pooled = PooledConnection(self._connect())
+        with self._lock:
+            self._created += 1
+        return pooled
+
+    def _discard(self, pooled):
+        with self._lock:
+            self._discarded += 1
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    # Function to take a connection out of the pool, opening or replacing one if needed
+    def acquire(self):
+        if self._closed:
+            raise RuntimeError("connection pool is closed")
+        if self._metrics is not None:
+            with self._metrics.timer("pool.acquire"):
+                return self._acquire()
+        return self._acquire()
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self._acquire_timeout):
+            raise PoolTimeout(f"no database connection free after {self._acquire_timeout}s")
+        try:
+            while True:
+                try:
+                    pooled = self._idle.get_nowait()
+                except queue.Empty:
+                    pooled = self._open_new()
+                    break
+                if self._is_healthy(pooled):
+                    break
+                self._discard(pooled)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+        return pooled
+
+    # Function to hand a connection back to the pool (or close it if it is broken)
+    def release(self, pooled, discard=False):
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if discard or self._closed:
+                self._discard(pooled)
+            else:
+                pooled.last_used = time.monotonic()
+                self._idle.put(pooled)
+        finally:
+            self._slots.release()
+
+    # Context manager used by all data functions:
+    #
+    #     with pool.connection() as conn:
+    #         conn.execute(...)
+    #
+    # If the block raises, the open transaction is rolled back; a connection that
+    # cannot even roll back is treated as dead and dropped from the pool.
+    @contextmanager
+    def connection(self):
+        pooled = self.acquire()
+        broken = False
+        try:
+            yield pooled.conn
+        except BaseException:
+            try:
+                pooled.conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self.release(pooled, discard=broken)
+
+    # Function to report pool usage (for monitoring / the admin panel)
+    def stats(self):
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "created": self._created,
+                "discarded": self._discarded,
+            }
+
+    # Function to close every idle connection and refuse new checkouts
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(pooled)
+
+
+# Context manager running a block as one explicit transaction on `conn`:
+# COMMIT if the block finishes, ROLLBACK if it raises. The write lock is taken up front
+# (BEGIN IMMEDIATE) so a read-then-write block cannot fail half-way on a lock upgrade;
+# pass immediate=False for read-only blocks.
+@contextmanager
+def transaction(conn, immediate=True):
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+# Function to open a connection from a command line target: a SQLite file path or a
+# sqlitecloud:// connection string
+def connect_target(target):
+    if target.startswith("sqlitecloud://"):
+        import sqlitecloud
+        return sqlitecloud.connect(target)
+    import sqlite3
+    return sqlite3.connect(target)
@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+from annotation_app.db_pool import connect_target
+
+# Streaming export of annotations (joined with their original_data row and token
+# mappings) to Parquet or JSONL, for building training data.
+#
+#     python -m annotation_app.exporter <sqlite path | sqlitecloud:// url> exports/ --format parquet
+#
+# Only processed annotations are exported (the reject and skip records kept for the
+# quality reports have no edited text). They are read in (datestamp, rowid) order with
+# keyset pagination, one page per query, and written as they arrive: Parquet row groups
+# or JSONL lines. Memory is bounded by the page size whatever the table size.
+#
+# Each run writes one new file into the output directory and records the last
+# exported (datestamp, rowid) in _export_state.json there, so the next run exports
+# only annotations added since. Filters (annotator, dialect) are part of that state:
+# changing them needs --full.
+
+EXPORT_COLUMNS = (
+    "annotation_id", "entity_id", "annotator_id", "action", "datestamp", "selected_translation",
+    "edited_source", "edited_translation", "keyword", "source_text", "translation_1",
+    "translation_2", "translation_3", "dialect", "token_mappings",
+)
+
+# One page of processed annotations after a (datestamp, rowid) cursor; {filters} is
+# filled in by export_rows(). The row's mappings come back as a JSON array of
+# [source, translation].
+EXPORT_PAGE_SQL = '''
+    SELECT a.rowid, a.entity_id, a.annotator_id, a.action, a.datestamp, a.selected_translation,
+           a.edited_source, a.edited_translation, o.keyword, o.source_text, o.translation_1,
+           o.translation_2, o.translation_3, o.dialect,
+           (SELECT json_group_array(json_array(m.source_token, m.translation_token))
+            FROM token_mappings m
+            WHERE m.entity_id = a.entity_id AND m.annotator_id IS a.annotator_id)
+    FROM annotation a
+    LEFT JOIN original_data o ON o.entity_id = a.entity_id
+    WHERE a.datestamp IS NOT NULL
+    AND (a.datestamp, a.rowid) > (?, ?)
+    AND a.action = 'processed'
+    {filters}
+    ORDER BY a.datestamp, a.rowid
+    LIMIT ?
+'''
+
+# One page of original_data rows with a given processed state, after an entity_id
+ORIGINAL_DATA_PAGE_SQL = '''
+    SELECT entity_id, keyword, source_text, translation_1, translation_2, translation_3,
+           dialect, processed, taken, taken_by
+    FROM original_data
+    WHERE processed = ?
+    AND entity_id > ?
+    ORDER BY entity_id
+    LIMIT ?
+'''
+
+STATE_FILE = "_export_state.json"
+
+
+def _placeholders(values):
+    return ",".join(["?"] * len(values))
+
+
+# Function to fetch one page of original_data rows by processed state, in entity_id order
+def original_data_page(conn, processed, after=0, limit=1000):
+    c = conn.cursor()
+    c.execute(ORIGINAL_DATA_PAGE_SQL, (processed, after, limit))
+    return c.fetchall()
+
+
+# Function to yield annotations after `since` (a (datestamp, rowid) cursor) as dicts,
+# optionally only for some annotators or dialects, one page_size query at a time
+def export_rows(conn, since=None, annotators=(), dialects=(), page_size=5000):
+    annotators, dialects = list(annotators), list(dialects)
+    filters = ""
+    if annotators:
+        filters += f"AND a.annotator_id IN ({_placeholders(annotators)}) "
+    if dialects:
+        filters += f"AND o.dialect IN ({_placeholders(dialects)}) "
+    sql = EXPORT_PAGE_SQL.format(filters=filters)
+    datestamp, rowid = since or ("", 0)
+    c = conn.cursor()
+    while True:
+        c.execute(sql, (datestamp, rowid, *annotators, *dialects, page_size))
+        rows = c.fetchall()
+        for row in rows:
+            record = dict(zip(EXPORT_COLUMNS, row))
+            record["token_mappings"] = json.loads(record["token_mappings"] or "[]")
+            yield record
+        if len(rows) < page_size:
+            return
+        datestamp, rowid = rows[-1][4], rows[-1][0]
+
+
+def _parquet_schema():
+    import pyarrow as pa
+
+    text = pa.string()
+    return pa.schema([
+        ("annotation_id", pa.int64()), ("entity_id", pa.int64()), ("annotator_id", text),
+        ("action", text), ("datestamp", text), ("selected_translation", text),
+        ("edited_source", text), ("edited_translation", text), ("keyword", text),
+        ("source_text", text), ("translation_1", text), ("translation_2", text),
+        ("translation_3", text), ("dialect", text), ("token_mappings", pa.list_(pa.list_(text))),
+    ])
+
+
+# Writes rows to one Parquet file, `chunk_rows` rows per row group
+class ParquetExportWriter:
+    def __init__(self, path, chunk_rows=50000):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as error:
+            raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow") from error
+        self.chunk_rows = chunk_rows
+        self._schema = _parquet_schema()
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._chunk = []
+
+    def write(self, record):
+        self._chunk.append(record)
+        if len(self._chunk) >= self.chunk_rows:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+
+        if self._chunk:
+            self._writer.write_table(pa.Table.from_pylist(self._chunk, schema=self._schema))
+            self._chunk = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+# Writes rows to one JSONL file, one object per line
+class JsonlExportWriter:
+    def __init__(self, path, chunk_rows=None):
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+EXPORT_WRITERS = {"parquet": ParquetExportWriter, "jsonl": JsonlExportWriter}
+
+
+def _read_state(out_dir):
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# Function to export annotations added since the last run into a new file in `out_dir`.
+# Returns (path of the new file or None when there was nothing new, rows written).
+def export_annotations(conn, out_dir, fmt="parquet", annotators=(), dialects=(), full=False,
+                       page_size=5000, chunk_rows=50000):
+    os.makedirs(out_dir, exist_ok=True)
+    filters = {"annotators": sorted(annotators), "dialects": sorted(dialects)}
+    state = None if full else _read_state(out_dir)
+    if state is not None and state["filters"] != filters:
+        raise ValueError(f"{out_dir} holds an export with filters {state['filters']}; "
+                         f"use --full or another directory for {filters}")
+    since = (state["datestamp"], state["rowid"]) if state else None
+
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    path = os.path.join(out_dir, f"annotations-{stamp}.{fmt}")
+    writer = EXPORT_WRITERS[fmt](path + ".partial", chunk_rows=chunk_rows)
+    count, last = 0, None
+    try:
+        for record in export_rows(conn, since, annotators, dialects, page_size):
+            writer.write(record)
+            count += 1
+            last = record
+    finally:
+        writer.close()
+
+    if not count:
+        os.remove(path + ".partial")
+        return None, 0
+    os.replace(path + ".partial", path)
+    _write_state(out_dir, {
+        "datestamp": last["datestamp"],
+        "rowid": last["annotation_id"],
+        "filters": filters,
+        "last_file": os.path.basename(path),
+    })
+    return path, count
+
+
+# Command line entry point:
+#     python -m annotation_app.exporter <sqlite path | sqlitecloud:// url> <output dir>
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export annotations with their rows and token mappings.")
+    parser.add_argument("database", help="path to a SQLite file or a sqlitecloud:// connection string")
+    parser.add_argument("out_dir", help="directory for the export files and the incremental export state")
+    parser.add_argument("--format", choices=sorted(EXPORT_WRITERS), default="parquet")
+    parser.add_argument("--annotator", action="append", default=[], help="only this annotator (repeatable)")
+    parser.add_argument("--dialect", action="append", default=[], help="only this dialect (repeatable)")
+    parser.add_argument("--full", action="store_true", help="export everything, not only what is new since the last run")
+    parser.add_argument("--page-size", type=int, default=5000, help="annotations fetched per query")
+    parser.add_argument("--chunk-rows", type=int, default=50000, help="rows per Parquet row group")
+    args = parser.parse_args(argv)
+
+    conn = connect_target(args.database)
+    try:
+        path, count = export_annotations(conn, args.out_dir, fmt=args.format, annotators=args.annotator,
+                                         dialects=args.dialect, full=args.full, page_size=args.page_size,
+                                         chunk_rows=args.chunk_rows)
+    finally:
+        conn.close()
+    print(f"exported {count:,} annotations to {path}" if count else "nothing new to export")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+from annotation_app.db_pool import connect_target, transaction
+from annotation_app.migrations import apply_migrations
+from annotation_app.storage import BASE_SCHEMA_SQL
+
+# Streaming bulk import of new work into original_data from CSV or JSONL.
+#
+#     python -m annotation_app.importer rows.csv annotations.sqlite3
+#     python -m annotation_app.importer rows.jsonl "sqlitecloud://..." --chunk-size 5000
+#
+# Records are read lazily and written `chunk_size` at a time with one executemany per
+# chunk, each chunk in its own transaction together with the number of records done so
+# far (import_progress), so memory stays flat and an interrupted import resumes after
+# the last committed chunk when it is run again.
+#
+# Records need a source_text and may carry an integer entity_id, keyword, translation_1..3 and
+# dialect. Records with an entity_id that already exists are skipped (or, with
+# --update, refresh rows nobody has taken yet); records without one are skipped when a
+# row with the same source_text and dialect exists.
+
+IMPORT_COLUMNS = ("keyword", "source_text", "translation_1", "translation_2", "translation_3", "dialect")
+
+# New rows are written as free work (processed = 'no', taken = 'no') explicitly rather
+# than through column defaults, which a database not created from BASE_SCHEMA_SQL may lack
+INSERT_WITH_ID_SQL = '''
+    INSERT INTO original_data (entity_id, keyword, source_text, translation_1, translation_2, translation_3, dialect,
+                               processed, taken)
+    VALUES (?, ?, ?, ?, ?, ?, ?, 'no', 'no')
+    ON CONFLICT (entity_id) DO NOTHING
+'''
+
+UPSERT_WITH_ID_SQL = '''
+    INSERT INTO original_data (entity_id, keyword, source_text, translation_1, translation_2, translation_3, dialect,
+                               processed, taken)
+    VALUES (?, ?, ?, ?, ?, ?, ?, 'no', 'no')
+    ON CONFLICT (entity_id) DO UPDATE SET
+        keyword = excluded.keyword,
+        source_text = excluded.source_text,
+        translation_1 = excluded.translation_1,
+        translation_2 = excluded.translation_2,
+        translation_3 = excluded.translation_3,
+        dialect = excluded.dialect,
+        processed = 'no',
+        taken = 'no'
+    WHERE COALESCE(original_data.processed, 'no') = 'no' AND COALESCE(original_data.taken, 'no') = 'no'
+'''
+
+INSERT_NEW_TEXT_SQL = '''
+    INSERT INTO original_data (keyword, source_text, translation_1, translation_2, translation_3, dialect,
+                               processed, taken)
+    SELECT ?, ?, ?, ?, ?, ?, 'no', 'no'
+    WHERE NOT EXISTS (
+        SELECT 1 FROM original_data
+        WHERE source_text = ? AND dialect IS ?
+    )
+'''
+
+IMPORT_PROGRESS_SQL = "SELECT records_done FROM import_progress WHERE source = ?"
+
+SAVE_IMPORT_PROGRESS_SQL = '''
+    INSERT INTO import_progress (source, records_done, updated_at)
+    VALUES (?, ?, ?)
+    ON CONFLICT (source) DO UPDATE SET
+        records_done = excluded.records_done,
+        updated_at = excluded.updated_at
+'''
+
+
+# Function to stream the records of a CSV (with a header row) or JSONL file as dicts
+def read_records(path, fmt=None):
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".ndjson", ".json")) else "csv")
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+            return
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                raise ValueError(f"{path}:{line_number}: invalid JSON: {error}") from error
+
+
+def _clean(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+# Function to turn one input record into (entity_id, keyword, source_text, translation_1,
+# translation_2, translation_3, dialect); returns None for an invalid record (no
+# source_text, or an entity_id that is not an integer)
+def _record_row(record):
+    values = tuple(_clean(record.get(column)) for column in IMPORT_COLUMNS)
+    if values[1] is None:
+        return None
+    entity_id = _clean(record.get("entity_id"))
+    if entity_id is None:
+        return (None, *values)
+    try:
+        return (int(entity_id), *values)
+    except ValueError:
+        return None
+
+
+# Function to write one chunk of rows; returns how many rows were inserted or updated
+def _write_chunk(conn, rows, update):
+    with_id = [row for row in rows if row[0] is not None]
+    without_id = [row[1:] + (row[2], row[6]) for row in rows if row[0] is None]
+    written = 0
+    c = conn.cursor()
+    if with_id:
+        c.executemany(UPSERT_WITH_ID_SQL if update else INSERT_WITH_ID_SQL, with_id)
+        written += max(c.rowcount, 0)
+    if without_id:
+        c.executemany(INSERT_NEW_TEXT_SQL, without_id)
+        written += max(c.rowcount, 0)
+    return written
+
+
+# Function to import `path` into original_data; returns counts of records read, rows
+# written, duplicates skipped and invalid records. `source` names the import for
+# resuming (default: the file's absolute path); `restart` ignores saved progress.
+# `report(stats)` is called after every committed chunk.
+def import_file(conn, path, source=None, fmt=None, chunk_size=5000, update=False, restart=False, report=None):
+    source = source or os.path.abspath(path)
+    c = conn.cursor()
+    c.execute(IMPORT_PROGRESS_SQL, (source,))
+    row = c.fetchone()
+    resume_from = row[0] if row and not restart else 0
+
+    stats = {"source": source, "resumed_from": resume_from, "records": resume_from,
+             "written": 0, "duplicates": 0, "invalid": 0, "seconds": 0.0}
+    started = time.monotonic()
+    records = itertools.islice(read_records(path, fmt), resume_from, None)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            break
+        rows = [_record_row(record) for record in chunk]
+        valid = [row for row in rows if row is not None]
+        with transaction(conn):
+            written = _write_chunk(conn, valid, update)
+            conn.execute(SAVE_IMPORT_PROGRESS_SQL, (
+                source, stats["records"] + len(chunk),
+                datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+            ))
+        stats["records"] += len(chunk)
+        stats["written"] += written
+        stats["duplicates"] += len(valid) - written
+        stats["invalid"] += len(rows) - len(valid)
+        stats["seconds"] = time.monotonic() - started
+        if report is not None:
+            report(stats)
+    stats["seconds"] = time.monotonic() - started
+    return stats
+
+
+def _format_stats(stats):
+    imported = stats["records"] - stats["resumed_from"]
+    rate = imported / stats["seconds"] if stats["seconds"] else 0.0
+    return (f"{stats['records']:,} records  {stats['written']:,} written  "
+            f"{stats['duplicates']:,} duplicates  {stats['invalid']:,} invalid  {rate:,.0f} records/s")
+
+
+# Command line entry point:
+#     python -m annotation_app.importer <csv | jsonl file> <sqlite path | sqlitecloud:// url>
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream a CSV or JSONL file into original_data.")
+    parser.add_argument("path", help="CSV file with a header row, or JSONL file (one object per line)")
+    parser.add_argument("database", help="path to a SQLite file or a sqlitecloud:// connection string")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="input format (default: from the file name)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="records per transaction")
+    parser.add_argument("--update", action="store_true",
+                        help="refresh rows with the same entity_id that nobody has taken yet")
+    parser.add_argument("--name", help="name the import is resumed under (default: the file's absolute path)")
+    parser.add_argument("--restart", action="store_true", help="ignore saved progress and read from the start")
+    args = parser.parse_args(argv)
+
+    conn = connect_target(args.database)
+    try:
+        if not args.database.startswith("sqlitecloud://"):
+            conn.executescript(BASE_SCHEMA_SQL)
+        apply_migrations(conn)
+        last_report = [0.0]
+
+        def report(stats):
+            if stats["seconds"] - last_report[0] >= 2.0:
+                last_report[0] = stats["seconds"]
+                print(_format_stats(stats), file=sys.stderr)
+
+        stats = import_file(conn, args.path, source=args.name, fmt=args.format, chunk_size=args.chunk_size,
+                            update=args.update, restart=args.restart, report=report)
+        if stats["resumed_from"]:
+            print(f"resumed after {stats['resumed_from']:,} records already imported")
+        print(_format_stats(stats))
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+import functools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the histogram buckets shown in the admin panel
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf"))
+
+
+# Latency samples of one metric: lifetime count/total plus the most recent `window`
+# samples, from which percentiles and bucket counts are computed on demand. Recording
+# is an append under a lock, cheap enough to leave on in production.
+class RollingHistogram:
+    def __init__(self, window=2048):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+
+    def summary(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self.count, self.total
+        if not samples:
+            return {"count": count, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+
+        def percentile(fraction):
+            return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))] * 1000
+
+        return {
+            "count": count,
+            "mean_ms": round(total / count * 1000, 3),
+            "p50_ms": round(percentile(0.50), 3),
+            "p95_ms": round(percentile(0.95), 3),
+            "p99_ms": round(percentile(0.99), 3),
+            "max_ms": round(samples[-1] * 1000, 3),
+        }
+
+    def buckets(self):
+        with self._lock:
+            samples = list(self._samples)
+        counts = [0] * len(BUCKET_BOUNDS_MS)
+        for seconds in samples:
+            ms = seconds * 1000
+            for i, bound in enumerate(BUCKET_BOUNDS_MS):
+                if ms <= bound:
+                    counts[i] += 1
+                    break
+        return dict(zip((f"<={b:g}ms" if b != float("inf") else ">5000ms" for b in BUCKET_BOUNDS_MS), counts))
+
+
+# Counters of the work done by the current thread since its last finish_rerun()
+class _RerunStats(threading.local):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = None
+        self.queries = 0
+        self.round_trips = 0
+        self.db_seconds = 0.0
+        self.spans = {}
+        self.span_queries = {}
+
+
+# Process-wide timings of database calls, named spans and script reruns.
+#
+# Every DB statement is timed under "db.<verb>" (db.select, db.update, ...) and counted
+# as a query and a round-trip for the current thread; commits, rollbacks and new
+# connections count as round-trips too. Streamlit runs each rerun (and the widget
+# callbacks that precede it) in one thread, so start_rerun()/finish_rerun() can report
+# per-rerun totals. With `jsonl_path` set, each finished rerun is appended to that file
+# as one JSON object; with `log_reruns`, it is also logged at INFO level.
+class Metrics:
+    def __init__(self, window=2048, jsonl_path=None, log_reruns=False):
+        self.window = window
+        self.jsonl_path = jsonl_path
+        self.log_reruns = log_reruns
+        self.current = _RerunStats()
+        self._histograms = {}
+        self._rerun_queries = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, RollingHistogram(self.window))
+        return histogram
+
+    def record(self, name, seconds):
+        self.histogram(name).record(seconds)
+
+    def record_db(self, name, seconds, queries=1):
+        self.record(name, seconds)
+        current = self.current
+        current.queries += queries
+        current.round_trips += 1
+        current.db_seconds += seconds
+
+    # Context manager timing a named span: `with metrics.timer("get_available_row"):`
+    @contextmanager
+    def timer(self, name):
+        current = self.current
+        queries_before = current.queries
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.record(name, elapsed)
+            current.spans[name] = current.spans.get(name, 0.0) + elapsed
+            current.span_queries[name] = current.span_queries.get(name, 0) + current.queries - queries_before
+
+    # Decorator timing every call of a function under `name`
+    def timed(self, name):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def start_rerun(self):
+        self.current.started = time.perf_counter()
+
+    # Function to close the current rerun: record its duration and export its totals
+    def finish_rerun(self, **fields):
+        current = self.current
+        if current.started is None:
+            return None
+        elapsed = time.perf_counter() - current.started
+        self.record("rerun", elapsed)
+        self._rerun_queries.append(current.queries)
+        event = {
+            "ts": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "rerun_ms": round(elapsed * 1000, 3),
+            "queries": current.queries,
+            "round_trips": current.round_trips,
+            "db_ms": round(current.db_seconds * 1000, 3),
+            "spans_ms": {name: round(seconds * 1000, 3) for name, seconds in current.spans.items()},
+            "span_queries": dict(current.span_queries),
+            **fields,
+        }
+        current.reset()
+        self._export(event)
+        return event
+
+    def _export(self, event):
+        if self.log_reruns:
+            logger.info("rerun %s", json.dumps(event, ensure_ascii=False))
+        if self.jsonl_path:
+            line = json.dumps(event, ensure_ascii=False) + "\n"
+            with self._export_lock:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(line)
+
+    # Function to summarize every histogram, e.g. for the admin panel
+    def snapshot(self):
+        with self._lock:
+            names = sorted(self._histograms)
+        return {name: self._histograms[name].summary() for name in names}
+
+    # Function to summarize how many queries recent reruns made
+    def queries_per_rerun(self):
+        counts = sorted(self._rerun_queries)
+        if not counts:
+            return {"reruns": 0, "mean": 0.0, "p95": 0, "max": 0}
+        return {
+            "reruns": len(counts),
+            "mean": round(sum(counts) / len(counts), 2),
+            "p95": counts[min(len(counts) - 1, int(round(0.95 * (len(counts) - 1))))],
+            "max": counts[-1],
+        }
+
+
+# DB-API cursor/connection wrappers reporting every statement to a Metrics instance
+class InstrumentedCursor:
+    def __init__(self, cursor, metrics):
+        self._cursor = cursor
+        self._metrics = metrics
+
+    def _timed(self, method, sql, *args):
+        started = time.perf_counter()
+        try:
+            method(sql, *args)
+        finally:
+            verb = sql.lstrip().split(None, 1)[0].lower() if sql.strip() else "empty"
+            self._metrics.record_db(f"db.{verb}", time.perf_counter() - started)
+        return self
+
+    def execute(self, sql, *args):
+        return self._timed(self._cursor.execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(self._cursor.executemany, sql, *args)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    def __init__(self, conn, metrics):
+        self._conn = conn
+        self._metrics = metrics
+
+    def cursor(self):
+        return InstrumentedCursor(self._conn.cursor(), self._metrics)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            self._metrics.record_db("db.commit", time.perf_counter() - started, queries=0)
+
+    def rollback(self):
+        started = time.perf_counter()
+        try:
+            self._conn.rollback()
+        finally:
+            self._metrics.record_db("db.rollback", time.perf_counter() - started, queries=0)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+# Function to wrap a connection factory so new connections are timed and instrumented
+def instrument_connect(connect, metrics):
+    def instrumented_connect():
+        started = time.perf_counter()
+        conn = connect()
+        metrics.record_db("db.connect", time.perf_counter() - started, queries=0)
+        return InstrumentedConnection(conn, metrics)
+    return instrumented_connect
@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# How long a claimed row stays reserved without a heartbeat from its annotator
+DEFAULT_LEASE_SECONDS = 1800.0
+
+# Keep an annotator's unfinished rows reserved until `expires_at`. Skipped rows are left
+# alone: they keep the hold they got when they were skipped (see LeasePolicy).
+RENEW_LEASES_SQL = '''
+    UPDATE original_data
+    SET lease_expires_at = ?
+    WHERE taken_by = ?
+    AND processed = 'no'
+    AND taken = 'yes'
+'''
+
+# Hand every reservation whose lease has run out back to the shared pool; skipped rows
+# go back as unprocessed so anyone can claim them again
+RECLAIM_LEASES_SQL = '''
+    UPDATE original_data
+    SET taken = 'no', taken_by = NULL, lease_expires_at = NULL,
+        processed = CASE WHEN processed = 'skipped' THEN 'no' ELSE processed END
+    WHERE lease_expires_at < ?
+    AND taken = 'yes'
+    AND processed IN ('no', 'skipped')
+'''
+
+# Give a lease to reservations that have none: rows claimed before leases existed (or by
+# an older app version during a rollout), and skipped rows when skipped rows expire
+ADOPT_UNLEASED_SQL = '''
+    UPDATE original_data
+    SET lease_expires_at = ?
+    WHERE lease_expires_at IS NULL
+    AND processed = ?
+    AND taken = 'yes'
+    AND taken_by IS NOT NULL
+'''
+
+# Without a skip hold, return rows skipped before skips stopped holding rows (they kept
+# the row with its annotator for good) to the pool; skipped_rows keeps them away from
+# the annotator who skipped them
+RELEASE_UNHELD_SKIPS_SQL = '''
+    UPDATE original_data
+    SET processed = 'no', taken = 'no', taken_by = NULL
+    WHERE processed = 'skipped'
+    AND lease_expires_at IS NULL
+'''
+
+# Rows that are reserved (locked away from other annotators) versus actually being
+# worked on (an unprocessed row with a live lease)
+LEASE_STATS_SQL = '''
+    SELECT
+        COALESCE(SUM(taken = 'no' OR taken_by IS NULL), 0) AS free,
+        COALESCE(SUM(taken = 'yes' AND taken_by IS NOT NULL), 0) AS locked,
+        COALESCE(SUM(processed = 'no' AND taken = 'yes' AND lease_expires_at >= ?), 0) AS in_progress,
+        COALESCE(SUM(processed = 'skipped' AND taken = 'yes'), 0) AS skipped,
+        COALESCE(SUM(taken = 'yes' AND lease_expires_at < ?), 0) AS expired,
+        COALESCE(SUM(taken = 'yes' AND taken_by IS NOT NULL AND lease_expires_at IS NULL), 0) AS unleased
+    FROM original_data
+    WHERE processed IN ('no', 'skipped')
+'''
+
+
+# Rules for how long reservations last.
+#
+# lease_seconds: how long a claimed row stays reserved after the annotator's last
+#     heartbeat (any interaction with the page renews it).
+# skip_hold_seconds: how long a skipped row stays with the annotator who skipped it
+#     before it goes back to the pool; None hands it back right away. Either way the
+#     annotator who skipped it is never offered it again (see annotations.skip_row).
+class LeasePolicy:
+    def __init__(self, lease_seconds=DEFAULT_LEASE_SECONDS, skip_hold_seconds=None):
+        self.lease_seconds = float(lease_seconds)
+        self.skip_hold_seconds = None if skip_hold_seconds is None else float(skip_hold_seconds)
+
+    # Function to get the hold expiry for a row skipped at `now` (None: no hold)
+    def skip_expiry(self, now=None):
+        if self.skip_hold_seconds is None:
+            return None
+        return (time.time() if now is None else now) + self.skip_hold_seconds
+
+
+# Function to extend the leases on every unfinished row an annotator holds
+def renew_leases(conn, annotator_id, lease_seconds=DEFAULT_LEASE_SECONDS, now=None):
+    now = time.time() if now is None else now
+    c = conn.cursor()
+    c.execute(RENEW_LEASES_SQL, (now + lease_seconds, annotator_id))
+    conn.commit()
+    return c.rowcount
+
+
+# Function to return expired reservations to the pool; returns how many rows were freed.
+# Reservations without a lease are given one first, so they expire in due course too;
+# skipped rows without one get the skip hold, or go back right away when there is none.
+def reclaim_expired_leases(conn, policy, now=None):
+    now = time.time() if now is None else now
+    c = conn.cursor()
+    c.execute(ADOPT_UNLEASED_SQL, (now + policy.lease_seconds, 'no'))
+    reclaimed = 0
+    if policy.skip_hold_seconds is None:
+        c.execute(RELEASE_UNHELD_SKIPS_SQL)
+        reclaimed += c.rowcount
+    else:
+        c.execute(ADOPT_UNLEASED_SQL, (policy.skip_expiry(now), 'skipped'))
+    c.execute(RECLAIM_LEASES_SQL, (now,))
+    reclaimed += c.rowcount
+    conn.commit()
+    return reclaimed
+
+
+# Function to count free, locked, in-progress, skipped and expired rows
+def lease_stats(conn, now=None):
+    now = time.time() if now is None else now
+    c = conn.cursor()
+    c.execute(LEASE_STATS_SQL, (now, now))
+    free, locked, in_progress, skipped, expired, unleased = c.fetchone()
+    return {
+        "free": free,
+        "locked": locked,
+        "in_progress": in_progress,
+        "skipped": skipped,
+        "expired": expired,
+        "unleased": unleased,
+    }
+
+
+# Background thread that periodically returns expired reservations to the pool.
+#
+# Reclaiming is idempotent, so it is safe to run one reclaimer in every server process.
+class LeaseReclaimer:
+    def __init__(self, get_connection, policy, interval=60.0):
+        self.policy = policy
+        self.interval = interval
+        self._get_connection = get_connection
+        self._stopping = threading.Event()
+        self._thread = None
+        self.reclaimed = 0
+        self.last_run = None
+        self.last_error = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="lease-reclaimer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=10.0):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.reclaim_once()
+            except Exception as error:
+                self.last_error = str(error)
+                logger.warning("lease reclaim failed, retrying in %ss: %s", self.interval, error)
+            self._stopping.wait(self.interval)
+
+    # Function to run one reclaim pass; returns how many rows went back to the pool
+    def reclaim_once(self):
+        with self._get_connection() as conn:
+            reclaimed = reclaim_expired_leases(conn, self.policy)
+        self.reclaimed += reclaimed
+        self.last_run = time.time()
+        if reclaimed:
+            logger.info("returned %s rows with expired leases to the pool", reclaimed)
+        return reclaimed
+
+    def stats(self):
+        with self._get_connection() as conn:
+            stats = lease_stats(conn)
+        stats.update(reclaimed=self.reclaimed, last_error=self.last_error)
+        return stats
@@ -0,0 +1,279 @@
+import argparse
+import re
+import sys
+from datetime import datetime, timezone
+
+from annotation_app.db_pool import connect_target, transaction
+from annotation_app.exporter import EXPORT_PAGE_SQL, ORIGINAL_DATA_PAGE_SQL
+from annotation_app.leases import ADOPT_UNLEASED_SQL, RECLAIM_LEASES_SQL, RELEASE_UNHELD_SKIPS_SQL, RENEW_LEASES_SQL
+from annotation_app.progress import BUMP_PROGRESS_SQL, PROGRESS_SQL
+from annotation_app.row_claims import (CLAIM_CLUSTER_ROWS_SQL, CLAIM_ROWS_SQL, CLAIM_SHARD_ROWS_SQL, HELD_ROWS_SQL,
+                                       ROW_CLUSTERS_SQL)
+from annotation_app.token_mappings import MAPPING_SUMMARY_SQL
+
+# Ordered schema changes: (version, description, statements). Never edit a released
+# entry; append a new version instead. Each version is applied once, in one transaction,
+# and recorded in schema_migrations.
+MIGRATIONS = [
+    (1, "indexes for row claiming and token-mapping lookups", [
+        "CREATE INDEX IF NOT EXISTS idx_original_data_pending ON original_data (processed, taken)",
+        "CREATE INDEX IF NOT EXISTS idx_original_data_taken_by ON original_data (taken_by, processed)",
+        "CREATE INDEX IF NOT EXISTS idx_annotation_entity ON annotation (entity_id)",
+        "CREATE INDEX IF NOT EXISTS idx_token_mappings_source "
+        "ON token_mappings (source_token, translation_token, entity_id)",
+    ]),
+    (2, "annotation_date column and index for per-day progress", [
+        # datestamp is 'YYYY-MM-DD HH:MM:SS' text; a LIKE 'YYYY-MM-DD%' on it cannot use an index
+        "ALTER TABLE annotation ADD COLUMN annotation_date TEXT "
+        "GENERATED ALWAYS AS (substr(datestamp, 1, 10)) VIRTUAL",
+        "CREATE INDEX IF NOT EXISTS idx_annotation_annotator_date ON annotation (annotator_id, annotation_date)",
+    ]),
+    (3, "per-annotator, per-day progress counters", [
+        '''
+        CREATE TABLE IF NOT EXISTS annotation_progress (
+            annotator_id TEXT NOT NULL,
+            annotation_date TEXT NOT NULL,
+            annotation_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (annotator_id, annotation_date)
+        )
+        ''',
+        '''
+        INSERT INTO annotation_progress (annotator_id, annotation_date, annotation_count)
+        SELECT annotator_id, annotation_date, COUNT(*)
+        FROM annotation
+        WHERE annotator_id IS NOT NULL AND annotation_date IS NOT NULL
+        GROUP BY annotator_id, annotation_date
+        ''',
+    ]),
+    (4, "high-water marks of write-behind journals", [
+        '''
+        CREATE TABLE IF NOT EXISTS write_behind_applied (
+            journal_id TEXT PRIMARY KEY,
+            last_seq INTEGER NOT NULL
+        )
+        ''',
+    ]),
+    (5, "lease expiry on row reservations", [
+        # Unix time; NULL means the reservation never expires (e.g. skipped rows kept by
+        # their annotator). Existing reservations get a lease from the reclaimer.
+        "ALTER TABLE original_data ADD COLUMN lease_expires_at REAL",
+        "CREATE INDEX IF NOT EXISTS idx_original_data_lease ON original_data (lease_expires_at)",
+    ]),
+    (6, "per-annotator skipped rows", [
+        '''
+        CREATE TABLE IF NOT EXISTS skipped_rows (
+            annotator_id TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            skipped_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (annotator_id, entity_id)
+        )
+        ''',
+        '''
+        INSERT OR IGNORE INTO skipped_rows (annotator_id, entity_id)
+        SELECT taken_by, entity_id
+        FROM original_data
+        WHERE processed = 'skipped' AND taken_by IS NOT NULL
+        ''',
+    ]),
+    (7, "bulk import: resume points and duplicate lookups by source text", [
+        '''
+        CREATE TABLE IF NOT EXISTS import_progress (
+            source TEXT PRIMARY KEY,
+            records_done INTEGER NOT NULL,
+            updated_at TEXT
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_original_data_source_text ON original_data (source_text)",
+    ]),
+    (8, "indexes for paginated exports", [
+        "CREATE INDEX IF NOT EXISTS idx_annotation_datestamp ON annotation (datestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_token_mappings_entity ON token_mappings (entity_id, annotator_id)",
+    ]),
+    (9, "MinHash/LSH index of near-duplicate source sentences", [
+        "CREATE TABLE IF NOT EXISTS minhash_signatures (entity_id INTEGER PRIMARY KEY, signature BLOB NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS minhash_bands (band_key INTEGER NOT NULL, entity_id INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_minhash_bands_key ON minhash_bands (band_key)",
+        "CREATE TABLE IF NOT EXISTS near_duplicate_clusters (entity_id INTEGER PRIMARY KEY, cluster_id INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_near_duplicate_clusters_cluster ON near_duplicate_clusters (cluster_id)",
+    ]),
+    (10, "full-text search over processed annotations and their mappings", [
+        # Filled by annotation_app.search, which folds Arabic letters before indexing
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS annotation_search USING fts5 (
+            edited_source, edited_translation, mappings,
+            entity_id UNINDEXED, annotator_id UNINDEXED,
+            tokenize = 'unicode61', prefix = '2 3 4'
+        )
+        ''',
+    ]),
+    (11, "additive statistics for agreement and quality reports", [
+        # Maintained by annotation_app.analytics; "" stands for "not broken down by this key"
+        '''
+        CREATE TABLE IF NOT EXISTS quality_stats (
+            metric TEXT NOT NULL,
+            dialect TEXT NOT NULL,
+            day TEXT NOT NULL,
+            annotator_a TEXT NOT NULL,
+            annotator_b TEXT NOT NULL,
+            category TEXT NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (metric, dialect, day, annotator_a, annotator_b, category)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS quality_marks (
+            source TEXT PRIMARY KEY,
+            last_rowid INTEGER NOT NULL
+        )
+        ''',
+    ]),
+    (12, "dialect shards of the work pool and annotator assignments", [
+        # Rows are claimed per shard (see assignments.py); to shard by another key, add a
+        # migration that redefines the column
+        "ALTER TABLE original_data ADD COLUMN shard TEXT GENERATED ALWAYS AS (COALESCE(dialect, '')) VIRTUAL",
+        "CREATE INDEX IF NOT EXISTS idx_original_data_shard_pending ON original_data (shard, processed, taken)",
+        '''
+        CREATE TABLE IF NOT EXISTS annotators (
+            annotator_id TEXT PRIMARY KEY,
+            daily_target INTEGER NOT NULL,
+            work_days INTEGER NOT NULL,
+            start_date TEXT NOT NULL,
+            active INTEGER NOT NULL DEFAULT 1
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS annotator_shards (
+            annotator_id TEXT NOT NULL,
+            shard TEXT NOT NULL,
+            PRIMARY KEY (annotator_id, shard)
+        )
+        ''',
+    ]),
+    (13, "index for paging original_data by processed state", [
+        # original_data_page() reads one processed state in entity_id order; without the
+        # second column SQLite sorts every row of that state in a temp b-tree
+        "CREATE INDEX IF NOT EXISTS idx_original_data_processed ON original_data (processed, entity_id)",
+    ]),
+    # Kept so version numbers stay stable: it used to return every unleased skipped row to
+    # the pool, even with a skip hold configured. The lease reclaimer now does that, and
+    # only when there is no hold (leases.reclaim_expired_leases).
+    (14, "return skipped rows without a hold to the pool (moved to the lease reclaimer)", []),
+]
+
+# The app's hot queries with sample parameters, checked by check_query_plans()
+HOT_QUERIES = {
+    "held_rows": (HELD_ROWS_SQL, ("annotator", 0, 1)),
+    "claim_rows": (CLAIM_ROWS_SQL, ("annotator", 0.0, "annotator", 1)),
+    "row_clusters": (ROW_CLUSTERS_SQL.format(entity_ids="?"), (1,)),
+    "claim_shard_rows": (CLAIM_SHARD_ROWS_SQL.format(shards="?"), ("annotator", 0.0, "gulf", "annotator", 1)),
+    "claim_cluster_rows": (CLAIM_CLUSTER_ROWS_SQL.format(cluster_ids="?", shard_filter=""),
+                           ("annotator", 0.0, 1, "annotator", 1)),
+    "renew_leases": (RENEW_LEASES_SQL, (0.0, "annotator")),
+    "adopt_unleased": (ADOPT_UNLEASED_SQL, (0.0, "no")),
+    "reclaim_leases": (RECLAIM_LEASES_SQL, (0.0,)),
+    "release_unheld_skips": (RELEASE_UNHELD_SKIPS_SQL, ()),
+    "mapping_summary": (MAPPING_SUMMARY_SQL, ("token", 10, 0, "token", 3)),
+    "progress": (PROGRESS_SQL, ("2024-01-01", "annotator")),
+    "bump_progress": (BUMP_PROGRESS_SQL, ("annotator", "2024-01-01")),
+    "export_page": (EXPORT_PAGE_SQL.format(filters=""), ("2024-01-01", 0, 1)),
+    "original_data_page": (ORIGINAL_DATA_PAGE_SQL, ("no", 0, 1)),
+}
+
+# Claim statements: the UPDATE picks its rows in a subquery and must then reach each of
+# them by rowid, not by searching an index range of original_data again
+ROWID_TARGET_QUERIES = ("claim_rows", "claim_shard_rows", "claim_cluster_rows")
+
+# Hot queries allowed to sort in a temp b-tree: mapping_summary ranks the aggregated
+# translations of a single source token, never rows read straight from a table
+TEMP_SORT_QUERIES = ("mapping_summary",)
+
+# A query-plan step that reads a whole app table instead of searching an index
+_FULL_SCAN = re.compile(r"^SCAN (original_data|annotation|token_mappings|annotation_progress|skipped_rows|near_duplicate_clusters|minhash_bands)\b(?!.*\bINDEX\b)")
+# A query-plan step that sorts rows instead of reading them in index order
+_TEMP_SORT = re.compile(r"^USE TEMP B-TREE\b")
+# A query-plan step that reads one row by its rowid or primary key
+_KEY_LOOKUP = re.compile(r"^SEARCH \w+ USING (INTEGER )?PRIMARY KEY \(\w+=\?\)")
+
+
+def _applied_versions(conn):
+    c = conn.cursor()
+    c.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in c.fetchall()}
+
+
+# Function to bring the schema up to date; safe to call on every startup and from
+# several processes at once. Returns the versions applied by this call.
+def apply_migrations(conn, migrations=MIGRATIONS):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        )
+    ''')
+    applied = []
+    pending = [m for m in migrations if m[0] not in _applied_versions(conn)]
+    for version, description, statements in pending:
+        with transaction(conn, immediate=True):
+            # Another process may have applied it while we waited for the write lock
+            if version in _applied_versions(conn):
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(
+                "INSERT INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')),
+            )
+        applied.append(version)
+    return applied
+
+
+# Function to run EXPLAIN QUERY PLAN on each hot query and report the steps that make it
+# slow as a table grows: full table scans, temp b-tree sorts (outside TEMP_SORT_QUERIES)
+# and, for ROWID_TARGET_QUERIES, an UPDATE target not looked up by key.
+# Returns {query_name: [offending plan steps]}; an empty list means the plan is fine.
+def check_query_plans(conn, queries=None):
+    queries = HOT_QUERIES if queries is None else queries
+    report = {}
+    c = conn.cursor()
+    for name, (sql, params) in queries.items():
+        c.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        plan = c.fetchall()
+        problems = [row[-1] for row in plan if _FULL_SCAN.search(row[-1])]
+        if name not in TEMP_SORT_QUERIES:
+            problems += [row[-1] for row in plan if _TEMP_SORT.search(row[-1])]
+        if name in ROWID_TARGET_QUERIES:
+            # Steps at the top level (parent 0) that read a table are the UPDATE target
+            problems += [
+                detail for _, parent, _, detail in plan
+                if parent == 0 and detail.startswith(("SCAN ", "SEARCH ")) and not _KEY_LOOKUP.search(detail)
+            ]
+        report[name] = problems
+    return report
+
+
+# Command line entry point:
+#     python -m annotation_app.migrations <sqlite path | sqlitecloud:// url> [--check]
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply schema migrations and check query plans.")
+    parser.add_argument("database", help="path to a SQLite file or a sqlitecloud:// connection string")
+    parser.add_argument("--check", action="store_true", help="also report hot queries with slow plans")
+    args = parser.parse_args(argv)
+
+    conn = connect_target(args.database)
+    try:
+        applied = apply_migrations(conn)
+        print(f"applied migrations: {applied or 'none (schema up to date)'}")
+        if not args.check:
+            return 0
+        failures = 0
+        for name, problems in check_query_plans(conn).items():
+            print(f"{'SLOW' if problems else 'ok  '}  {name}" + (f"  ({'; '.join(problems)})" if problems else ""))
+            failures += bool(problems)
+        return 1 if failures else 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+import argparse
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from annotation_app.db_pool import connect_target, transaction
+from annotation_app.migrations import apply_migrations
+from annotation_app.text import normalize_arabic
+
+# MinHash/LSH index of near-duplicate source sentences in original_data.
+#
+#     python -m annotation_app.near_duplicates <sqlite path | sqlitecloud:// url> [--rebuild]
+#
+# Each sentence is reduced to character shingles of its normalized text and a MinHash
+# signature (NUM_PERM minimum hash values). The signature is cut into BANDS bands;
+# sentences sharing any band become candidates, and candidates whose signatures agree
+# on at least `threshold` of their values (the estimated Jaccard similarity) are joined
+# into one cluster.
+#
+# Signatures and band keys are stored (minhash_signatures, minhash_bands), so the index
+# is built in one streaming pass over the table and new rows are added incrementally
+# later. Every row read gets a minhash_signatures entry (an empty signature when it has
+# no text), which is what marks it as indexed: rows imported later are picked up
+# whatever their entity_id. near_duplicate_clusters only lists rows that have
+# near-duplicates; a cluster's id is the smallest entity_id in it.
+
+NUM_PERM = 32
+BANDS = 8
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_SIZE = 4
+DEFAULT_THRESHOLD = 0.8
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(20240909)
+_HASH_A = _rng.randint(1, _PRIME, size=NUM_PERM).astype(np.uint64)
+_HASH_B = _rng.randint(0, _PRIME, size=NUM_PERM).astype(np.uint64)
+
+# Rows without a signature yet, in entity_id pages
+UNINDEXED_ROWS_SQL = '''
+    SELECT entity_id, source_text FROM original_data
+    WHERE entity_id > ?
+    AND NOT EXISTS (SELECT 1 FROM minhash_signatures s WHERE s.entity_id = original_data.entity_id)
+    ORDER BY entity_id
+    LIMIT ?
+'''
+
+# Processed annotation of another member of a row's cluster, most recent first
+CLUSTER_REFERENCE_SQL = '''
+    SELECT a.entity_id, a.annotator_id, a.selected_translation, a.edited_source, a.edited_translation
+    FROM near_duplicate_clusters c
+    JOIN near_duplicate_clusters m ON m.cluster_id = c.cluster_id AND m.entity_id != c.entity_id
+    JOIN annotation a ON a.entity_id = m.entity_id AND a.action = 'processed'
+    WHERE c.entity_id = ?
+    ORDER BY a.datestamp DESC
+    LIMIT 1
+'''
+
+
+def _placeholders(values):
+    return ",".join(["?"] * len(values))
+
+
+# Function to get the shingle hashes of one sentence (character SHINGLE_SIZE-grams)
+def _shingles(text):
+    text = normalize_arabic(text)
+    if not text:
+        return []
+    if len(text) <= SHINGLE_SIZE:
+        return [zlib.crc32(text.encode("utf-8"))]
+    return list({zlib.crc32(text[i:i + SHINGLE_SIZE].encode("utf-8"))
+                 for i in range(len(text) - SHINGLE_SIZE + 1)})
+
+
+# Function to compute MinHash signatures for many sentences at once; returns the indexes
+# of the sentences that have any text and their (n, NUM_PERM) uint32 signatures
+def minhash_signatures(texts):
+    shingles = [_shingles(text) for text in texts]
+    present = [i for i, values in enumerate(shingles) if values]
+    if not present:
+        return present, np.empty((0, NUM_PERM), dtype=np.uint32)
+    lengths = np.array([len(shingles[i]) for i in present])
+    hashes = np.fromiter((value for i in present for value in shingles[i]), dtype=np.uint64, count=lengths.sum())
+    permuted = (_HASH_A[:, None] * hashes[None, :] + _HASH_B[:, None]) % _PRIME
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    return present, np.minimum.reduceat(permuted, starts, axis=1).T.astype(np.uint32)
+
+
+# Function to get the LSH band keys of signatures: an (n, BANDS) array of int64 keys
+def band_keys(signatures):
+    keys = np.zeros((len(signatures), BANDS), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for band in range(BANDS):
+            key = np.full(len(signatures), band + 1, dtype=np.uint64)
+            for value in signatures[:, band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].T:
+                key = key * np.uint64(1000003) ^ value.astype(np.uint64)
+            keys[:, band] = key
+    return (keys & np.uint64((1 << 63) - 1)).astype(np.int64)
+
+
+class _Clusters:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, node):
+        root = node
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while node != root:
+            self.parent[node], node = root, self.parent.get(node, node)
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+
+# Function to add rows [(entity_id, source_text)] to the index and join them with their
+# near-duplicates (among each other and among rows indexed before). Does not commit.
+# Rows without text are recorded with an empty signature so later runs do not read them
+# again. Returns how many of the rows joined a cluster.
+#
+# A band key is stored for a row only when no row of the same cluster already has it,
+# so buckets hold one entry per cluster and large clusters do not slow lookups down.
+def index_rows(conn, rows, threshold=DEFAULT_THRESHOLD):
+    present, signatures = minhash_signatures([text for _, text in rows])
+    c = conn.cursor()
+    empty = set(range(len(rows))) - set(present)
+    c.executemany("INSERT OR REPLACE INTO minhash_signatures (entity_id, signature) VALUES (?, ?)",
+                  [(rows[i][0], b"") for i in sorted(empty)])
+    if not present:
+        return 0
+    entity_ids = [rows[i][0] for i in present]
+    keys = band_keys(signatures).tolist()
+
+    # Rows indexed before that share a band with this page, their signatures and clusters
+    buckets = {}
+    page_keys = list({key for row_keys in keys for key in row_keys})
+    for start in range(0, len(page_keys), 5000):
+        chunk = page_keys[start:start + 5000]
+        c.execute(f"SELECT band_key, entity_id FROM minhash_bands WHERE band_key IN ({_placeholders(chunk)})", chunk)
+        for key, entity_id in c.fetchall():
+            buckets.setdefault(key, []).append(entity_id)
+    old_ids = sorted({entity_id for members in buckets.values() for entity_id in members})
+    old_signatures, old_clusters = {}, {}
+    for start in range(0, len(old_ids), 5000):
+        chunk = old_ids[start:start + 5000]
+        c.execute(f"SELECT entity_id, signature FROM minhash_signatures WHERE entity_id IN ({_placeholders(chunk)})",
+                  chunk)
+        old_signatures.update((entity_id, np.frombuffer(blob, dtype=np.uint32)) for entity_id, blob in c.fetchall())
+        c.execute(f"SELECT entity_id, cluster_id FROM near_duplicate_clusters WHERE entity_id IN ({_placeholders(chunk)})",
+                  chunk)
+        old_clusters.update(c.fetchall())
+
+    clusters = _Clusters()
+    page_signatures = dict(zip(entity_ids, signatures))
+    matched, new_bands = set(), []
+
+    def cluster_of(entity_id):
+        return clusters.find(old_clusters.get(entity_id, entity_id))
+
+    for entity_id, signature, row_keys in zip(entity_ids, signatures, keys):
+        root = cluster_of(entity_id)
+        candidates = dict.fromkeys(other for key in row_keys for other in buckets.get(key, ()))
+        candidates = [other for other in candidates
+                      if cluster_of(other) != root
+                      and page_signatures.get(other, old_signatures.get(other)) is not None]
+        if candidates:
+            others = np.stack([page_signatures.get(other, old_signatures.get(other)) for other in candidates])
+            similarities = (others == signature).mean(axis=1)
+            for other in np.asarray(candidates)[similarities >= threshold].tolist():
+                clusters.union(cluster_of(entity_id), cluster_of(other))
+                matched.update((entity_id, other))
+        root = cluster_of(entity_id)
+        for key in row_keys:
+            members = buckets.setdefault(key, [])
+            if all(cluster_of(other) != root for other in members):
+                members.append(entity_id)
+                new_bands.append((key, entity_id))
+
+    for cluster_id in set(old_clusters.values()):
+        if clusters.find(cluster_id) != cluster_id:
+            c.execute("UPDATE near_duplicate_clusters SET cluster_id = ? WHERE cluster_id = ?",
+                      (clusters.find(cluster_id), cluster_id))
+    c.executemany("INSERT OR REPLACE INTO near_duplicate_clusters (entity_id, cluster_id) VALUES (?, ?)",
+                  [(entity_id, cluster_of(entity_id)) for entity_id in matched])
+    c.executemany("INSERT OR REPLACE INTO minhash_signatures (entity_id, signature) VALUES (?, ?)",
+                  [(entity_id, signature.tobytes()) for entity_id, signature in zip(entity_ids, signatures)])
+    c.executemany("INSERT INTO minhash_bands (band_key, entity_id) VALUES (?, ?)", new_bands)
+    return len(matched & set(entity_ids))
+
+
+# Function to index every row not indexed yet (or all rows with rebuild=True) in one
+# pass over original_data, one page per transaction.
+# `report(rows_indexed, rows_clustered)` is called after every page.
+def build_index(conn, threshold=DEFAULT_THRESHOLD, page_size=2000, rebuild=False, report=None):
+    c = conn.cursor()
+    if rebuild:
+        with transaction(conn):
+            for table in ("minhash_signatures", "minhash_bands", "near_duplicate_clusters"):
+                c.execute(f"DELETE FROM {table}")
+    after = 0
+    indexed = clustered = 0
+    while True:
+        c.execute(UNINDEXED_ROWS_SQL, (after, page_size))
+        rows = c.fetchall()
+        if not rows:
+            break
+        with transaction(conn):
+            clustered += index_rows(conn, rows, threshold)
+        indexed += len(rows)
+        after = rows[-1][0]
+        if report is not None:
+            report(indexed, clustered)
+    return indexed, clustered
+
+
+# Function to get the processed annotation (and its token mappings) of another row in
+# the same near-duplicate cluster, as a starting point for annotating `entity_id`.
+# Returns None when the row has no processed near-duplicate.
+def cluster_reference(conn, entity_id):
+    c = conn.cursor()
+    c.execute(CLUSTER_REFERENCE_SQL, (entity_id,))
+    row = c.fetchone()
+    if row is None:
+        return None
+    reference_id, annotator_id, selected_translation, edited_source, edited_translation = row
+    c.execute("SELECT source_token, translation_token FROM token_mappings WHERE entity_id = ? AND annotator_id IS ?",
+              (reference_id, annotator_id))
+    return {
+        "entity_id": reference_id,
+        "selected_translation": selected_translation,
+        "edited_source": edited_source,
+        "edited_translation": edited_translation,
+        "mappings": c.fetchall(),
+    }
+
+
+# Command line entry point:
+#     python -m annotation_app.near_duplicates <sqlite path | sqlitecloud:// url> [--rebuild]
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or update the near-duplicate index of original_data.")
+    parser.add_argument("database", help="path to a SQLite file or a sqlitecloud:// connection string")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="estimated Jaccard similarity of character shingles for two rows to be clustered")
+    parser.add_argument("--page-size", type=int, default=2000, help="rows per transaction")
+    parser.add_argument("--rebuild", action="store_true", help="drop the index and build it from scratch")
+    args = parser.parse_args(argv)
+
+    conn = connect_target(args.database)
+    try:
+        apply_migrations(conn)
+        started = time.monotonic()
+
+        def report(indexed, clustered):
+            print(f"{indexed:,} rows indexed  {clustered:,} in clusters  "
+                  f"{indexed / (time.monotonic() - started):,.0f} rows/s", file=sys.stderr)
+
+        indexed, clustered = build_index(conn, threshold=args.threshold, page_size=args.page_size,
+                                         rebuild=args.rebuild, report=report)
+    finally:
+        conn.close()
+    print(f"indexed {indexed:,} rows, {clustered:,} joined a near-duplicate cluster")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import threading
+import time
+
+# Today's and overall annotation counts of one annotator, read from the per-day counter
+# table maintained by bump_progress() (one indexed range over the annotator's days)
+PROGRESS_SQL = '''
+    SELECT COALESCE(SUM(CASE WHEN annotation_date = ? THEN annotation_count END), 0),
+           COALESCE(SUM(annotation_count), 0)
+    FROM annotation_progress
+    WHERE annotator_id = ?
+'''
+
+# Add one annotation to an annotator's counter for a day
+BUMP_PROGRESS_SQL = '''
+    INSERT INTO annotation_progress (annotator_id, annotation_date, annotation_count)
+    VALUES (?, ?, 1)
+    ON CONFLICT (annotator_id, annotation_date)
+    DO UPDATE SET annotation_count = annotation_count + 1
+'''
+
+
+# Function to read (daily, total) annotation counts of an annotator for a 'YYYY-MM-DD' day
+def get_progress(conn, annotator_id, day):
+    c = conn.cursor()
+    c.execute(PROGRESS_SQL, (day, annotator_id))
+    daily, total = c.fetchone()
+    return daily, total
+
+
+# Function to count one new annotation; call it in the same transaction as the insert
+def bump_progress(conn, annotator_id, day):
+    conn.execute(BUMP_PROGRESS_SQL, (annotator_id, day))
+
+
+# Process-wide, short-lived cache of (daily, total) counts per annotator and day.
+#
+# Reruns within `ttl` seconds are answered without touching the database. add() bumps a
+# cached entry right after this process commits an annotation so the progress bar
+# does not lag behind the annotator's own clicks.
+class ProgressCache:
+    def __init__(self, ttl=30.0):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    # Function to get (daily, total), calling `load()` only when the cached value is stale
+    def get(self, annotator_id, day, load):
+        key = (annotator_id, day)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                return entry[1], entry[2]
+        daily, total = load()
+        with self._lock:
+            self._entries[key] = (time.monotonic(), daily, total)
+        return daily, total
+
+    # Function to count a just-committed annotation in the cached entry, if any
+    def add(self, annotator_id, day, count=1):
+        key = (annotator_id, day)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], entry[1] + count, entry[2] + count)
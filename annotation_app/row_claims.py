@@ -0,0 +1,386 @@
+import itertools
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+
+from annotation_app.leases import DEFAULT_LEASE_SECONDS, renew_leases
+
+logger = logging.getLogger(__name__)
+
+# Columns of original_data, in table order (rows are returned as plain tuples)
+ORIGINAL_DATA_COLUMNS = (
+    "entity_id", "keyword", "source_text", "translation_1", "translation_2",
+    "translation_3", "dialect", "processed", "taken", "taken_by",
+)
+# The same columns as a select list; the table has more columns (lease_expires_at) that
+# the app does not unpack
+ORIGINAL_DATA_SELECT = ", ".join(ORIGINAL_DATA_COLUMNS)
+
+# Which in-memory queue currently holds each prefetched row. When a session ends,
+# only rows still owned by its queue are released, so a reload that re-adopted the
+# same rows in a new session does not have them pulled out from under it.
+_owners = {}
+_owners_lock = threading.Lock()
+_queue_tokens = itertools.count(1)
+
+
+# Rows reserved by one annotator that still need work, in entity_id order after a
+# keyset cursor. Rows the annotator skipped are either held as 'skipped' or back in the
+# pool, so they never come back here, and the cost does not grow with the number of skips.
+HELD_ROWS_SQL = f'''
+    SELECT {ORIGINAL_DATA_SELECT} FROM original_data
+    WHERE taken_by = ?
+    AND processed = 'no'
+    AND taken = 'yes'
+    AND entity_id > ?
+    ORDER BY entity_id
+    LIMIT ?
+'''
+
+# Reserve up to N free rows under a lease and return them, in one statement.
+# The outer re-check uses unary + so SQLite cannot pick idx_original_data_pending for it:
+# the chosen rows are then looked up by rowid instead of walking every pending row.
+CLAIM_ROWS_SQL = f'''
+    UPDATE original_data
+    SET taken = 'yes', taken_by = ?, lease_expires_at = ?
+    WHERE entity_id IN (
+        SELECT entity_id FROM original_data
+        WHERE processed = 'no'
+        AND (taken = 'no' OR (taken = 'yes' AND taken_by IS NULL))
+        AND NOT EXISTS (
+            SELECT 1 FROM skipped_rows
+            WHERE skipped_rows.annotator_id = ?
+            AND skipped_rows.entity_id = original_data.entity_id
+        )
+        LIMIT ?
+    )
+    AND +processed = 'no'
+    AND (+taken = 'no' OR (+taken = 'yes' AND +taken_by IS NULL))
+    RETURNING {ORIGINAL_DATA_SELECT}
+'''
+
+# The same, for an annotator assigned to some shards of the pool (see assignments.py):
+# only those shards' ranges of idx_original_data_shard_pending are read, and the chosen
+# rows are re-checked by rowid as above. {shards} is filled in by claim_rows()
+CLAIM_SHARD_ROWS_SQL = f'''
+    UPDATE original_data
+    SET taken = 'yes', taken_by = ?, lease_expires_at = ?
+    WHERE entity_id IN (
+        SELECT entity_id FROM original_data
+        WHERE shard IN ({{shards}})
+        AND processed = 'no'
+        AND (taken = 'no' OR (taken = 'yes' AND taken_by IS NULL))
+        AND NOT EXISTS (
+            SELECT 1 FROM skipped_rows
+            WHERE skipped_rows.annotator_id = ?
+            AND skipped_rows.entity_id = original_data.entity_id
+        )
+        LIMIT ?
+    )
+    AND +processed = 'no'
+    AND (+taken = 'no' OR (+taken = 'yes' AND +taken_by IS NULL))
+    RETURNING {ORIGINAL_DATA_SELECT}
+'''
+
+# Near-duplicate clusters of some rows (see near_duplicates.py); {entity_ids} is filled
+# in by claim_cluster_rows()
+ROW_CLUSTERS_SQL = '''
+    SELECT entity_id, cluster_id FROM near_duplicate_clusters
+    WHERE entity_id IN ({entity_ids})
+'''
+
+# Reserve up to N free rows of some near-duplicate clusters and return them with their
+# cluster id, re-checked by rowid like CLAIM_ROWS_SQL; {cluster_ids} and {shard_filter}
+# are filled in by claim_cluster_rows()
+CLAIM_CLUSTER_ROWS_SQL = f'''
+    UPDATE original_data
+    SET taken = 'yes', taken_by = ?, lease_expires_at = ?
+    WHERE entity_id IN (
+        SELECT member.entity_id
+        FROM near_duplicate_clusters member
+        JOIN original_data free ON free.entity_id = member.entity_id
+        WHERE member.cluster_id IN ({{cluster_ids}})
+        AND free.processed = 'no'
+        AND (free.taken = 'no' OR (free.taken = 'yes' AND free.taken_by IS NULL))
+        {{shard_filter}}
+        AND NOT EXISTS (
+            SELECT 1 FROM skipped_rows
+            WHERE skipped_rows.annotator_id = ?
+            AND skipped_rows.entity_id = member.entity_id
+        )
+        LIMIT ?
+    )
+    AND +processed = 'no'
+    AND (+taken = 'no' OR (+taken = 'yes' AND +taken_by IS NULL))
+    RETURNING {ORIGINAL_DATA_SELECT},
+        (SELECT cluster_id FROM near_duplicate_clusters WHERE entity_id = original_data.entity_id)
+'''
+
+
+def _placeholders(values):
+    return ",".join(["?"] * len(values))
+
+
+# Function to fetch rows this annotator already holds (e.g. from before a page reload),
+# starting after entity_id `after`
+def held_rows(conn, annotator_id, limit, after=0):
+    c = conn.cursor()
+    c.execute(HELD_ROWS_SQL, (annotator_id, after, limit))
+    return c.fetchall()
+
+
+# Function to atomically reserve up to `limit` free rows for an annotator, leased for
+# `lease_seconds`, from the given shards only (or from the whole pool); rows the
+# annotator skipped before are never offered to them again.
+# The select and the reservation happen in one UPDATE ... RETURNING statement, and the
+# outer WHERE re-checks the row is still free, so two annotators can never get the same row.
+def claim_rows(conn, annotator_id, limit, lease_seconds=DEFAULT_LEASE_SECONDS, shards=()):
+    if limit <= 0:
+        return []
+    shards = list(shards)
+    c = conn.cursor()
+    if shards:
+        c.execute(CLAIM_SHARD_ROWS_SQL.format(shards=_placeholders(shards)),
+                  (annotator_id, time.time() + lease_seconds, *shards, annotator_id, limit))
+    else:
+        c.execute(CLAIM_ROWS_SQL, (annotator_id, time.time() + lease_seconds, annotator_id, limit))
+    rows = c.fetchall()
+    conn.commit()
+    return sorted(rows, key=lambda row: row[0])
+
+
+# Function to reserve, for the same annotator, up to `limit` free near-duplicates of the
+# rows they just got, so a whole cluster is annotated by one person in a row.
+# Near-duplicates outside `shards` (when given) are left for the annotators of their shard.
+# Returns the rows ordered so each one directly follows the first of `rows` in its cluster.
+def claim_cluster_rows(conn, annotator_id, rows, limit, lease_seconds=DEFAULT_LEASE_SECONDS, shards=()):
+    entity_ids = [row[0] for row in rows]
+    if limit <= 0 or not entity_ids:
+        return list(rows)
+    c = conn.cursor()
+    c.execute(ROW_CLUSTERS_SQL.format(entity_ids=_placeholders(entity_ids)), entity_ids)
+    row_clusters = dict(c.fetchall())
+    if not row_clusters:
+        return list(rows)
+    cluster_ids = sorted(set(row_clusters.values()))
+    shards = list(shards)
+    shard_filter = f"AND free.shard IN ({_placeholders(shards)})" if shards else ""
+    c.execute(CLAIM_CLUSTER_ROWS_SQL.format(cluster_ids=_placeholders(cluster_ids), shard_filter=shard_filter),
+              (annotator_id, time.time() + lease_seconds, *cluster_ids, *shards, annotator_id, limit))
+    members = {}
+    for *row, cluster_id in sorted(c.fetchall(), key=lambda row: row[0]):
+        members.setdefault(cluster_id, []).append(tuple(row))
+    conn.commit()
+
+    ordered = []
+    for row in rows:
+        ordered.append(row)
+        ordered += members.pop(row_clusters.get(row[0]), [])
+    return ordered
+
+
+# Function to hand unprocessed rows reserved by an annotator back to the shared pool
+def release_rows(conn, annotator_id, entity_ids):
+    entity_ids = list(entity_ids)
+    if not entity_ids:
+        return 0
+    c = conn.cursor()
+    c.execute(f'''
+        UPDATE original_data
+        SET taken = 'no', taken_by = NULL, lease_expires_at = NULL
+        WHERE taken_by = ?
+        AND processed = 'no'
+        AND entity_id IN ({_placeholders(entity_ids)})
+    ''', (annotator_id, *entity_ids))
+    conn.commit()
+    return c.rowcount
+
+
+def _release_queued(get_connection, annotator_id, token, pending):
+    with _owners_lock:
+        entity_ids = [row[0] for row in pending if _owners.get(row[0]) == token]
+        for entity_id in entity_ids:
+            del _owners[entity_id]
+    pending.clear()
+    if not entity_ids:
+        return
+    try:
+        with get_connection() as conn:
+            release_rows(conn, annotator_id, entity_ids)
+    except Exception:
+        # Best effort: rows that could not be released stay reserved by the annotator
+        # and are picked up again by held_rows() on their next session.
+        pass
+
+
+# Per-session queue of rows claimed in batches for one annotator.
+#
+# next_row() pops from the local queue without touching the database and only goes
+# back to the server (one held_rows + one claim_rows call) when the queue runs dry.
+# Held rows are read with a keyset cursor (the highest held entity_id loaded so far), so
+# held rows already handed out in this session are not read again. Rows claimed in this
+# session can still be read back as held rows while they are on screen or their write is
+# pending, so every id handed out is remembered and never queued twice.
+# Rows still queued when the session ends (the queue is garbage collected) or when
+# release() is called are returned to the pool.
+#
+# Reservations are leased: heartbeat() keeps them alive while the annotator is active,
+# and rows of a session that went quiet for longer than `lease_seconds` are returned to
+# the pool by the lease reclaimer (see leases.py).
+#
+# With cluster_limit > 0, each refill also claims up to that many free near-duplicates
+# of the loaded rows and queues them right after their cluster mate.
+#
+# With shards, new rows are only claimed from those shards of the pool (see assignments.py).
+class RowQueue:
+    def __init__(self, get_connection, annotator_id, batch_size=5, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 cluster_limit=0, shards=()):
+        self.annotator_id = annotator_id
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.cluster_limit = cluster_limit
+        self.shards = tuple(shards)
+        self._get_connection = get_connection
+        self._token = next(_queue_tokens)
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._renewed_at = None
+        self._after = 0
+        self._served = set()
+        self._finalizer = weakref.finalize(
+            self, _release_queued, get_connection, annotator_id, self._token, self._pending
+        )
+
+    def __len__(self):
+        return len(self._pending)
+
+    # Function to load the next batch: rows already held by the annotator first, then new claims
+    def _refill(self):
+        with self._get_connection() as conn:
+            held = held_rows(conn, self.annotator_id, self.batch_size, self._after)
+            if held:
+                renew_leases(conn, self.annotator_id, self.lease_seconds)
+                # Only held rows move the cursor: claimed and near-duplicate rows can have
+                # higher ids than held rows not loaded yet
+                self._after = held[-1][0]
+            queued = {row[0] for row in self._pending}
+            rows = [row for row in held if row[0] not in self._served and row[0] not in queued]
+            rows += claim_rows(conn, self.annotator_id, self.batch_size - len(rows), self.lease_seconds,
+                               self.shards)
+            rows = claim_cluster_rows(conn, self.annotator_id, rows, self.cluster_limit, self.lease_seconds,
+                                      self.shards)
+        self._renewed_at = time.monotonic()
+        with _owners_lock:
+            for row in rows:
+                _owners[row[0]] = self._token
+        self._pending.extend(rows)
+
+    # Function to get the next row for this annotator, skipping ids in `exclude` (rows whose
+    # writes have not reached the database yet, e.g. in write-behind mode)
+    def next_row(self, exclude=()):
+        exclude = set(exclude)
+        with self._lock:
+            self._drop_if_expired()
+            while True:
+                if not self._pending:
+                    self._refill()
+                    if not self._pending:
+                        return None
+                row = self._pending.popleft()
+                self._served.add(row[0])
+                with _owners_lock:
+                    if _owners.get(row[0]) == self._token:
+                        del _owners[row[0]]
+                if row[0] not in exclude:
+                    return row
+
+    # Function to make sure the next row is loaded (claiming a batch if needed) and return
+    # it without taking it off the queue
+    def peek(self, exclude=()):
+        exclude = set(exclude)
+        with self._lock:
+            self._drop_if_expired()
+            for row in self._pending:
+                if row[0] not in exclude:
+                    return row
+            self._refill()
+            for row in self._pending:
+                if row[0] not in exclude:
+                    return row
+            return None
+
+    # Function to forget queued rows whose leases may have run out (and been reclaimed by
+    # someone else) since the last heartbeat; the next refill picks up those still held
+    def _drop_if_expired(self):
+        if self._renewed_at is None or time.monotonic() - self._renewed_at < self.lease_seconds:
+            return
+        with _owners_lock:
+            for row in self._pending:
+                if _owners.get(row[0]) == self._token:
+                    del _owners[row[0]]
+        self._pending.clear()
+        self._renewed_at = None
+        self._after = 0
+
+    # Function to keep this annotator's reservations alive. Cheap to call on every rerun:
+    # the leases are only renewed in the database once a third of the lease has passed.
+    def heartbeat(self):
+        if self._renewed_at is not None and time.monotonic() - self._renewed_at < self.lease_seconds / 3:
+            return 0
+        with self._lock:
+            self._drop_if_expired()
+            with self._get_connection() as conn:
+                renewed = renew_leases(conn, self.annotator_id, self.lease_seconds)
+            self._renewed_at = time.monotonic()
+        return renewed
+
+    # Function to return every queued (not yet shown) row to the pool right away
+    def release(self):
+        with self._lock:
+            _release_queued(self._get_connection, self.annotator_id, self._token, self._pending)
+
+
+# Per-session helper that loads the annotator's next row on a background thread while
+# the current one is being annotated: it claims a new batch if the queue ran dry and
+# calls `warm(row)` (e.g. to load the row's token-mapping history into a cache).
+#
+# The prefetched row stays in the RowQueue until next_row() takes it, so a row that is
+# never shown is released together with the rest of the queue when the session ends.
+class RowPrefetcher:
+    def __init__(self, row_queue, warm=None):
+        self.row_queue = row_queue
+        self._warm = warm
+        self._thread = None
+        self.last_error = None
+
+    def _prefetch(self, exclude):
+        try:
+            row = self.row_queue.peek(exclude)
+            if row is not None and self._warm is not None:
+                self._warm(row)
+        except Exception as error:
+            # Prefetching is only an optimization; next_row() claims synchronously instead
+            self.last_error = error
+            logger.warning("row prefetch failed: %s", error)
+
+    # Function to start loading the next row, excluding the current one and any skipped rows
+    def prefetch(self, exclude=()):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._prefetch, args=(list(exclude),),
+                                        name="row-prefetch", daemon=True)
+        self._thread.start()
+
+    # Function to take the next row; waits for a running prefetch only through the queue lock
+    def next_row(self, exclude=()):
+        return self.row_queue.next_row(exclude)
+
+    # Function to wait until a running prefetch has finished
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def release(self):
+        self.row_queue.release()
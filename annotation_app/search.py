@@ -0,0 +1,184 @@
+import argparse
+import sys
+
+from annotation_app.db_pool import connect_target, transaction
+from annotation_app.migrations import apply_migrations
+from annotation_app.text import fold_arabic, normalize_arabic
+
+# Full-text search over processed annotations and their token mappings (SQLite FTS5).
+#
+#     python -m annotation_app.search <sqlite path | sqlitecloud:// url> [--rebuild] [--query "..."]
+#
+# annotation_search has one row per processed annotation (rowid = annotation.rowid)
+# holding its edited source, edited translation and mappings as "source → translation"
+# pairs, with Arabic letters folded (text.fold_arabic) so a search matches whatever
+# diacritics or alef/yeh/teh marbuta forms were typed. Queries are normalized the same
+# way and every word is a prefix, so "رايح" also finds "رايحين" and "رايحة".
+#
+# The write operations keep the index in step (index_annotations); index_new_annotations
+# catches up on annotations written without it, e.g. before this index existed.
+
+MAPPING_SEPARATOR = " ؛ "
+HIGHLIGHT = ("**", "**")
+
+# Processed annotations of some rows by one annotator, to (re)index after a write;
+# {entity_ids} is filled in by index_annotations()
+ROW_ANNOTATIONS_SQL = '''
+    SELECT rowid, entity_id, annotator_id, edited_source, edited_translation
+    FROM annotation
+    WHERE entity_id IN ({entity_ids})
+    AND annotator_id IS ?
+    AND action = 'processed'
+'''
+
+# Processed annotations not indexed yet, in rowid pages
+UNINDEXED_ANNOTATIONS_SQL = '''
+    SELECT rowid, entity_id, annotator_id, edited_source, edited_translation
+    FROM annotation
+    WHERE rowid > ?
+    AND action = 'processed'
+    ORDER BY rowid
+    LIMIT ?
+'''
+
+# Token mappings of a set of rows; {entity_ids} is filled in by _search_rows()
+ROW_MAPPINGS_SQL = '''
+    SELECT entity_id, annotator_id, source_token, translation_token
+    FROM token_mappings
+    WHERE entity_id IN ({entity_ids})
+'''
+
+LAST_INDEXED_SQL = "SELECT rowid FROM annotation_search ORDER BY rowid DESC LIMIT 1"
+
+# Ranked examples for a MATCH expression, with the matched words highlighted; mappings
+# weigh more than the sentences they came from
+SEARCH_SQL = '''
+    SELECT entity_id, annotator_id,
+           highlight(annotation_search, 0, ?, ?),
+           highlight(annotation_search, 1, ?, ?),
+           highlight(annotation_search, 2, ?, ?)
+    FROM annotation_search
+    WHERE annotation_search MATCH ?
+    ORDER BY bm25(annotation_search, 1.0, 1.0, 2.0)
+    LIMIT ?
+'''
+
+
+def _placeholders(values):
+    return ",".join(["?"] * len(values))
+
+
+# Function to turn annotation rows (rowid, entity_id, annotator_id, edited_source,
+# edited_translation) into annotation_search rows, with their token mappings
+def _search_rows(conn, annotations):
+    entity_ids = sorted({row[1] for row in annotations})
+    mappings = {}
+    c = conn.cursor()
+    for start in range(0, len(entity_ids), 500):
+        chunk = entity_ids[start:start + 500]
+        c.execute(ROW_MAPPINGS_SQL.format(entity_ids=_placeholders(chunk)), chunk)
+        for entity_id, annotator_id, source_token, translation_token in c.fetchall():
+            mappings.setdefault((entity_id, annotator_id), []).append(f"{source_token} → {translation_token}")
+    return [
+        (rowid, fold_arabic(edited_source), fold_arabic(edited_translation),
+         fold_arabic(MAPPING_SEPARATOR.join(mappings.get((entity_id, annotator_id), []))), entity_id, annotator_id)
+        for rowid, entity_id, annotator_id, edited_source, edited_translation in annotations
+    ]
+
+
+def _write_search_rows(conn, rows):
+    c = conn.cursor()
+    c.executemany("DELETE FROM annotation_search WHERE rowid = ?", [(row[0],) for row in rows])
+    c.executemany('''
+        INSERT INTO annotation_search (rowid, edited_source, edited_translation, mappings, entity_id, annotator_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+
+# Function to (re)index the processed annotations of `entity_ids` by `annotator_id`, after
+# they or their token mappings were written. Does not commit.
+def index_annotations(conn, entity_ids, annotator_id):
+    entity_ids = sorted(set(entity_ids))
+    if not entity_ids:
+        return
+    c = conn.cursor()
+    c.execute(ROW_ANNOTATIONS_SQL.format(entity_ids=_placeholders(entity_ids)), (*entity_ids, annotator_id))
+    annotations = c.fetchall()
+    if annotations:
+        _write_search_rows(conn, _search_rows(conn, annotations))
+
+
+# Function to index every processed annotation added after the last indexed one (or all
+# of them with rebuild=True), one page per transaction. Returns how many were indexed.
+def index_new_annotations(conn, page_size=2000, rebuild=False):
+    c = conn.cursor()
+    if rebuild:
+        with transaction(conn):
+            c.execute("DELETE FROM annotation_search")
+    c.execute(LAST_INDEXED_SQL)
+    row = c.fetchone()
+    after = row[0] if row else 0
+    indexed = 0
+    while True:
+        c.execute(UNINDEXED_ANNOTATIONS_SQL, (after, page_size))
+        annotations = c.fetchall()
+        if not annotations:
+            break
+        with transaction(conn):
+            _write_search_rows(conn, _search_rows(conn, annotations))
+        indexed += len(annotations)
+        after = annotations[-1][0]
+    return indexed
+
+
+# Function to turn what an annotator typed into an FTS5 query: normalized words, each a
+# prefix, all required. Words joined with _ (multi-word tokens) become a phrase.
+# Returns None when nothing searchable is left.
+def match_query(text):
+    words = normalize_arabic(text).split()
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+# Function to find past annotations matching `text` in their source, translation or
+# mappings, best first. Returns [{"entity_id", "annotator_id", "edited_source",
+# "edited_translation", "mappings"}], with the matched words wrapped in HIGHLIGHT.
+def search_examples(conn, text, limit=10, highlight=HIGHLIGHT):
+    query = match_query(text)
+    if query is None:
+        return []
+    c = conn.cursor()
+    c.execute(SEARCH_SQL, (*highlight, *highlight, *highlight, query, limit))
+    return [
+        {"entity_id": entity_id, "annotator_id": annotator_id, "edited_source": edited_source,
+         "edited_translation": edited_translation, "mappings": mappings}
+        for entity_id, annotator_id, edited_source, edited_translation, mappings in c.fetchall()
+    ]
+
+
+# Command line entry point:
+#     python -m annotation_app.search <sqlite path | sqlitecloud:// url> [--rebuild] [--query "..."]
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Update the full-text search index of annotations.")
+    parser.add_argument("database", help="path to a SQLite file or a sqlitecloud:// connection string")
+    parser.add_argument("--rebuild", action="store_true", help="drop the index and build it from scratch")
+    parser.add_argument("--query", help="search the index after updating it")
+    parser.add_argument("--limit", type=int, default=10, help="results shown for --query")
+    args = parser.parse_args(argv)
+
+    conn = connect_target(args.database)
+    try:
+        apply_migrations(conn)
+        print(f"indexed {index_new_annotations(conn, rebuild=args.rebuild):,} annotations")
+        if args.query:
+            for result in search_examples(conn, args.query, limit=args.limit):
+                print(f"{result['entity_id']}  {result['edited_source']}  |  {result['edited_translation']}  |  "
+                      f"{result['mappings']}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
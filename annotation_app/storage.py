@@ -0,0 +1,198 @@
+import sqlite3
+from abc import ABC, abstractmethod
+
+from annotation_app.annotations import WRITE_OPERATIONS, commit_processed_row
+from annotation_app.assignments import load_assignments, save_assignments, seed_assignments, shard_backlog
+from annotation_app.db_pool import ConnectionPool, transaction
+from annotation_app.instrumentation import instrument_connect
+from annotation_app.leases import DEFAULT_LEASE_SECONDS, lease_stats, reclaim_expired_leases
+from annotation_app.migrations import apply_migrations
+from annotation_app.near_duplicates import cluster_reference
+from annotation_app.progress import get_progress
+from annotation_app.row_claims import RowQueue, claim_rows, held_rows, release_rows
+from annotation_app.search import index_new_annotations, search_examples
+from annotation_app.token_mappings import MAPPING_PAGE_SIZE, get_mapping_summary
+
+# Base tables the app expects; the cloud database already has them, a local database
+# is created from this. Everything else (indexes, counters, ...) comes from migrations.py.
+BASE_SCHEMA_SQL = '''
+    CREATE TABLE IF NOT EXISTS original_data (
+        entity_id INTEGER PRIMARY KEY,
+        keyword TEXT,
+        source_text TEXT,
+        translation_1 TEXT,
+        translation_2 TEXT,
+        translation_3 TEXT,
+        dialect TEXT,
+        processed TEXT NOT NULL DEFAULT 'no',
+        taken TEXT NOT NULL DEFAULT 'no',
+        taken_by TEXT
+    );
+    CREATE TABLE IF NOT EXISTS annotation (
+        entity_id INTEGER REFERENCES original_data (entity_id),
+        selected_translation TEXT,
+        edited_source TEXT,
+        edited_translation TEXT,
+        action TEXT,
+        annotator_id TEXT,
+        datestamp TEXT
+    );
+    CREATE TABLE IF NOT EXISTS token_mappings (
+        entity_id INTEGER REFERENCES original_data (entity_id),
+        annotator_id TEXT,
+        source_token TEXT,
+        translation_token TEXT
+    );
+'''
+
+
+# Storage interface used by the app: row claiming, annotation writes, mapping lookups
+# and progress counts, all on top of a shared ConnectionPool.
+#
+# Both backends speak SQLite, so the SQL lives in the modules imported above and a
+# backend only has to say how to open a ready-to-use connection (connect()).
+#
+# With a Metrics instance every connection is wrapped so statements, commits and
+# connects are timed and counted (see instrumentation.py).
+class Storage(ABC):
+    def __init__(self, pool_size=8, metrics=None):
+        self.metrics = metrics
+        connect = self.connect if metrics is None else instrument_connect(self.connect, metrics)
+        self.pool = ConnectionPool(connect, max_size=pool_size, metrics=metrics)
+
+    # Function to open a new connection with the database selected and pragmas applied
+    @abstractmethod
+    def connect(self):
+        pass
+
+    # Function to borrow a pooled connection: `with storage.connection() as conn:`
+    def connection(self):
+        return self.pool.connection()
+
+    def migrate(self):
+        with self.connection() as conn:
+            return apply_migrations(conn)
+
+    # Row claiming
+    def row_queue(self, annotator_id, batch_size=5, lease_seconds=DEFAULT_LEASE_SECONDS, cluster_limit=0,
+                  shards=()):
+        return RowQueue(self.connection, annotator_id, batch_size=batch_size, lease_seconds=lease_seconds,
+                        cluster_limit=cluster_limit, shards=shards)
+
+    def held_rows(self, annotator_id, limit, after=0):
+        with self.connection() as conn:
+            return held_rows(conn, annotator_id, limit, after)
+
+    def claim_rows(self, annotator_id, limit, lease_seconds=DEFAULT_LEASE_SECONDS, shards=()):
+        with self.connection() as conn:
+            return claim_rows(conn, annotator_id, limit, lease_seconds, shards)
+
+    def release_rows(self, annotator_id, entity_ids):
+        with self.connection() as conn:
+            return release_rows(conn, annotator_id, entity_ids)
+
+    def reclaim_expired_leases(self, policy):
+        with self.connection() as conn:
+            return reclaim_expired_leases(conn, policy)
+
+    def lease_stats(self):
+        with self.connection() as conn:
+            return lease_stats(conn)
+
+    def shard_backlog(self):
+        with self.connection() as conn:
+            return shard_backlog(conn)
+
+    # Annotator assignments
+    def assignments(self):
+        with self.connection() as conn:
+            return load_assignments(conn)
+
+    def save_assignments(self, assignments):
+        with self.connection() as conn:
+            save_assignments(conn, assignments)
+
+    def seed_assignments(self, assignments):
+        with self.connection() as conn:
+            return seed_assignments(conn, assignments)
+
+    # Annotation writes
+    def write(self, operation, **payload):
+        with self.connection() as conn:
+            with transaction(conn):
+                WRITE_OPERATIONS[operation](conn, **payload)
+
+    def commit_processed_row(self, entity_id, annotator_id, selected_translation, edited_source,
+                             edited_translation, datestamp, mappings):
+        with self.connection() as conn:
+            commit_processed_row(conn, entity_id, annotator_id, selected_translation, edited_source,
+                                 edited_translation, datestamp, mappings)
+
+    # Mapping lookups and progress counts
+    def mapping_summary(self, source_token, page=0, page_size=MAPPING_PAGE_SIZE):
+        with self.connection() as conn:
+            return get_mapping_summary(conn, source_token, page=page, page_size=page_size)
+
+    def search_examples(self, text, limit=10):
+        with self.connection() as conn:
+            return search_examples(conn, text, limit=limit)
+
+    def index_new_annotations(self):
+        with self.connection() as conn:
+            return index_new_annotations(conn)
+
+    def cluster_reference(self, entity_id):
+        with self.connection() as conn:
+            return cluster_reference(conn, entity_id)
+
+    def progress(self, annotator_id, day):
+        with self.connection() as conn:
+            return get_progress(conn, annotator_id, day)
+
+    def close(self):
+        self.pool.close()
+
+
+# The hosted SQLite Cloud database (the production setup)
+class SQLiteCloudStorage(Storage):
+    def __init__(self, db_connect, db_name, pool_size=8, metrics=None):
+        self.db_connect = db_connect
+        self.db_name = db_name
+        super().__init__(pool_size=pool_size, metrics=metrics)
+
+    def connect(self):
+        import sqlitecloud
+
+        conn = sqlitecloud.connect(self.db_connect)
+        conn.execute(f"USE DATABASE {self.db_name}")
+        conn.execute('PRAGMA foreign_keys = ON;')
+        return conn
+
+
+# A local SQLite file in WAL mode, for single-node deployments, benchmarks and tests.
+#
+# Connections run in autocommit mode (transactions are explicit, see db_pool.transaction)
+# with pragmas tuned for many short transactions from a few threads.
+class LocalSQLiteStorage(Storage):
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA foreign_keys = ON",
+        "PRAGMA busy_timeout = 30000",
+        "PRAGMA cache_size = -65536",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA mmap_size = 268435456",
+    )
+
+    def __init__(self, path, pool_size=8, create_schema=True, metrics=None):
+        self.path = path
+        super().__init__(pool_size=pool_size, metrics=metrics)
+        if create_schema:
+            with self.connection() as conn:
+                conn.executescript(BASE_SCHEMA_SQL)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
@@ -0,0 +1,27 @@
+import re
+
+# Arabic text normalization shared by duplicate detection and search: diacritics and
+# tatweel are dropped and letter variants annotators type interchangeably are unified.
+_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_LETTER_VARIANTS = str.maketrans({
+    "أ": "ا",  # alef with hamza above -> alef
+    "إ": "ا",  # alef with hamza below -> alef
+    "آ": "ا",  # alef with madda -> alef
+    "ٱ": "ا",  # alef wasla -> alef
+    "ى": "ي",  # alef maksura -> yeh
+    "ة": "ه",  # teh marbuta -> heh
+})
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+# Function to fold Arabic letters only: no diacritics or tatweel, unified alef/yeh/teh
+# marbuta; spacing and punctuation are kept, so the text still reads as typed
+def fold_arabic(text):
+    return _DIACRITICS.sub("", text or "").translate(_LETTER_VARIANTS)
+
+
+# Function to normalize Arabic (and Latin) text for matching: folded letters, lower case,
+# punctuation removed, single spaces
+def normalize_arabic(text):
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", fold_arabic(text).lower())).strip()
@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Number of translation groups shown per page and example sentences per group
+MAPPING_PAGE_SIZE = 10
+MAPPING_EXAMPLES = 3
+
+
+# Previous mappings of one source token, grouped by translation_token with example sentences
+MAPPING_SUMMARY_SQL = '''
+    WITH grouped AS (
+        SELECT translation_token,
+               COUNT(*) AS mapping_count,
+               COUNT(*) OVER () AS total_groups,
+               SUM(COUNT(*)) OVER () AS total_mappings
+        FROM token_mappings
+        WHERE source_token = ?
+        GROUP BY translation_token
+        ORDER BY mapping_count DESC, translation_token
+        LIMIT ? OFFSET ?
+    ),
+    ranked AS (
+        SELECT translation_token, entity_id,
+               ROW_NUMBER() OVER (PARTITION BY translation_token ORDER BY entity_id DESC) AS rn
+        FROM (
+            SELECT DISTINCT translation_token, entity_id
+            FROM token_mappings
+            WHERE source_token = ?
+            AND translation_token IN (SELECT translation_token FROM grouped)
+        )
+    )
+    SELECT g.translation_token, g.mapping_count, g.total_groups, g.total_mappings,
+           (SELECT edited_source FROM annotation WHERE entity_id = r.entity_id AND action = 'processed' LIMIT 1)
+    FROM grouped g
+    LEFT JOIN ranked r ON r.translation_token = g.translation_token AND r.rn <= ?
+    ORDER BY g.mapping_count DESC, g.translation_token, r.rn
+'''
+
+
+# Function to summarize previous mappings of a source token in a single query.
+#
+# Mappings are grouped per translation_token (most frequent first) and each group
+# carries up to `examples` distinct edited source sentences from the annotation table.
+# Pass page_size=-1 to get every group at once.
+# Returns a dict with the overall totals and the requested page of groups:
+#     {"total_mappings": 412, "total_groups": 7,
+#      "groups": [(translation_token, count, [edited_source, ...]), ...]}
+def get_mapping_summary(conn, source_token, page=0, page_size=MAPPING_PAGE_SIZE, examples=MAPPING_EXAMPLES):
+    c = conn.cursor()
+    c.execute(MAPPING_SUMMARY_SQL, (source_token, page_size, page * page_size, source_token, examples))
+    rows = c.fetchall()
+
+    summary = {"total_mappings": 0, "total_groups": 0, "groups": []}
+    for translation_token, mapping_count, total_groups, total_mappings, edited_source in rows:
+        summary["total_mappings"] = total_mappings
+        summary["total_groups"] = total_groups
+        if not summary["groups"] or summary["groups"][-1][0] != translation_token:
+            summary["groups"].append((translation_token, mapping_count, []))
+        if edited_source:
+            summary["groups"][-1][2].append(edited_source)
+    return summary
+
+
+# Process-wide cache of previous mappings, keyed by source_token.
+#
+# Each entry holds the per-translation_token counts and a few example sentences for one
+# source token. Entries are loaded on first use with `load(source_token)` (which must
+# return an unpaged get_mapping_summary() result), updated in place by add() whenever a
+# new mapping is saved, evicted least-recently-used beyond `max_entries`, and reloaded
+# once they are older than `ttl` seconds so writes from other server processes show up.
+class TokenMappingIndex:
+    def __init__(self, max_entries=5000, ttl=600.0, examples=MAPPING_EXAMPLES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.examples = examples
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_from_summary(self, summary):
+        counts = {}
+        examples = {}
+        for translation_token, mapping_count, group_examples in summary["groups"]:
+            counts[translation_token] = mapping_count
+            examples[translation_token] = list(group_examples[:self.examples])
+        return {"loaded_at": time.monotonic(), "counts": counts, "examples": examples}
+
+    def _get_entry(self, source_token, load):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(source_token)
+            if entry is not None and now - entry["loaded_at"] < self.ttl:
+                self._entries.move_to_end(source_token)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = self._entry_from_summary(load(source_token))
+        with self._lock:
+            self._entries[source_token] = entry
+            self._entries.move_to_end(source_token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    # Function to answer the previous-mappings view from memory, in the same shape as
+    # get_mapping_summary()
+    def summary(self, source_token, load, page=0, page_size=MAPPING_PAGE_SIZE):
+        entry = self._get_entry(source_token, load)
+        with self._lock:
+            ordered = sorted(entry["counts"].items(), key=lambda item: (-item[1], item[0]))
+            groups = [
+                (translation_token, mapping_count, list(entry["examples"].get(translation_token, [])))
+                for translation_token, mapping_count in ordered[page * page_size:(page + 1) * page_size]
+            ]
+            return {
+                "total_mappings": sum(entry["counts"].values()),
+                "total_groups": len(ordered),
+                "groups": groups,
+            }
+
+    # Function to record a newly saved mapping in the cached entry (if that token is cached)
+    def add(self, source_token, translation_token, example=None):
+        with self._lock:
+            entry = self._entries.get(source_token)
+            if entry is None:
+                return
+            entry["counts"][translation_token] = entry["counts"].get(translation_token, 0) + 1
+            examples = entry["examples"].setdefault(translation_token, [])
+            if example and example not in examples:
+                examples.insert(0, example)
+                del examples[self.examples:]
+
+    # Function to drop one token (or everything) from the cache
+    def invalidate(self, source_token=None):
+        with self._lock:
+            if source_token is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(source_token, None)
@@ -0,0 +1,252 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+from annotation_app.db_pool import transaction
+
+logger = logging.getLogger(__name__)
+
+# Cloud-side high-water mark of each journal, updated in the same transaction as every
+# delivered batch. Entries at or below it were already applied and are skipped, so a
+# crash between the cloud COMMIT and the local delete never writes anything twice.
+APPLIED_SEQ_SQL = 'SELECT last_seq FROM write_behind_applied WHERE journal_id = ?'
+SET_APPLIED_SEQ_SQL = '''
+    INSERT INTO write_behind_applied (journal_id, last_seq) VALUES (?, ?)
+    ON CONFLICT (journal_id) DO UPDATE SET last_seq = excluded.last_seq
+'''
+
+
+# Raised by a failed delivery. `data_error` is True when the connection was still alive
+# afterwards, i.e. the entry itself was rejected rather than the network being down.
+class DeliveryError(Exception):
+    def __init__(self, message, data_error):
+        super().__init__(message)
+        self.data_error = data_error
+
+
+# Durable, ordered journal of pending writes in a local SQLite file.
+#
+# Every append is committed with synchronous=FULL (fsync'd) before it returns, so a
+# write the annotator has moved past survives a process restart.
+class WriteJournal:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = FULL")
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS journal_meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                operation TEXT NOT NULL,
+                entity_id,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            );
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                seq INTEGER PRIMARY KEY,
+                operation TEXT NOT NULL,
+                entity_id,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL,
+                last_error TEXT
+            );
+        ''')
+        self._conn.execute("INSERT OR IGNORE INTO journal_meta VALUES ('journal_id', ?)", (uuid.uuid4().hex,))
+        self.journal_id = self._conn.execute("SELECT value FROM journal_meta WHERE key = 'journal_id'").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+    # Function to durably record a write; returns its sequence number
+    def append(self, operation, entity_id, payload):
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO journal (operation, entity_id, payload, created_at) VALUES (?, ?, ?, ?)",
+                (operation, entity_id, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+            return cursor.lastrowid
+
+    # Function to read the oldest `limit` entries as (seq, operation, payload) tuples
+    def peek(self, limit):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, operation, payload FROM journal ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+        return [(seq, operation, json.loads(payload)) for seq, operation, payload in rows]
+
+    # Function to drop every entry up to and including `seq` once it is in the cloud
+    def remove_through(self, seq):
+        with self._lock:
+            self._conn.execute("DELETE FROM journal WHERE seq <= ?", (seq,))
+
+    # Function to count a failed delivery of one entry; returns its attempt count
+    def record_failure(self, seq, error):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE journal SET attempts = attempts + 1, last_error = ? WHERE seq = ?", (error, seq)
+            )
+            return self._conn.execute("SELECT attempts FROM journal WHERE seq = ?", (seq,)).fetchone()[0]
+
+    # Function to set aside an entry the cloud keeps rejecting, so later writes can proceed
+    def move_to_dead_letter(self, seq):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("INSERT INTO dead_letter SELECT * FROM journal WHERE seq = ?", (seq,))
+            self._conn.execute("DELETE FROM journal WHERE seq = ?", (seq,))
+            self._conn.execute("COMMIT")
+
+    # Function to list rows that still have undelivered writes (kept out of row claiming)
+    def pending_entity_ids(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT entity_id FROM journal").fetchall()
+        return {row[0] for row in rows}
+
+    def dead_letter_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Background thread that drains a WriteJournal to the cloud database.
+#
+# Entries are delivered strictly in journal order, up to `batch_size` per cloud
+# transaction. When a batch fails, the oldest entry is retried on its own with
+# exponential backoff; network failures are retried indefinitely, while an entry the
+# database itself rejects `max_attempts` times is moved to the dead_letter table.
+class WriteBehindWorker:
+    def __init__(self, journal, get_connection, operations, batch_size=50, max_attempts=5,
+                 poll_interval=1.0, retry_delay=0.5, max_retry_delay=30.0):
+        self.journal = journal
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._get_connection = get_connection
+        self._operations = operations
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._isolate_head = False
+        self._failures = 0
+        self.delivered = 0
+        self.last_error = None
+
+    # Function to record a write and return immediately; the worker delivers it later
+    def enqueue(self, operation, entity_id, payload):
+        if operation not in self._operations:
+            raise ValueError(f"unknown write operation: {operation}")
+        seq = self.journal.append(operation, entity_id, payload)
+        self._wake.set()
+        return seq
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+        return self
+
+    # Function to stop the worker; pending entries stay in the journal for the next start
+    def stop(self, timeout=10.0):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                delivered = self.drain_once()
+            except Exception:
+                logger.exception("write-behind worker failed unexpectedly")
+                delivered = 0
+            if delivered:
+                continue
+            delay = self._retry_wait() if self._failures else self.poll_interval
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def _retry_wait(self):
+        return min(self.retry_delay * 2 ** (self._failures - 1), self.max_retry_delay)
+
+    def _deliver(self, entries):
+        with self._get_connection() as conn:
+            try:
+                with transaction(conn):
+                    c = conn.cursor()
+                    c.execute(APPLIED_SEQ_SQL, (self.journal.journal_id,))
+                    row = c.fetchone()
+                    applied_seq = row[0] if row else 0
+                    for seq, operation, payload in entries:
+                        if seq > applied_seq:
+                            self._operations[operation](conn, **payload)
+                    c.execute(SET_APPLIED_SEQ_SQL, (self.journal.journal_id, entries[-1][0]))
+            except Exception as error:
+                try:
+                    conn.execute("SELECT 1")
+                    data_error = True
+                except Exception:
+                    data_error = False
+                raise DeliveryError(repr(error), data_error) from error
+
+    # Function to deliver the next batch; returns how many entries reached the cloud
+    def drain_once(self):
+        entries = self.journal.peek(1 if self._isolate_head else self.batch_size)
+        if not entries:
+            return 0
+        try:
+            self._deliver(entries)
+        except Exception as error:
+            self.last_error = str(error)
+            if len(entries) > 1:
+                # Retry the oldest entry on its own to find out which one is failing
+                self._isolate_head = True
+                return 0
+            self._failures += 1
+            seq = entries[0][0]
+            if isinstance(error, DeliveryError) and error.data_error:
+                attempts = self.journal.record_failure(seq, str(error))
+                if attempts >= self.max_attempts:
+                    logger.error("write-behind entry %s rejected %s times, moved to dead_letter: %s",
+                                 seq, attempts, error)
+                    self.journal.move_to_dead_letter(seq)
+                    self._failures = 0
+                    return 0
+            logger.warning("write-behind delivery of entry %s failed, retrying: %s", seq, error)
+            return 0
+        self.journal.remove_through(entries[-1][0])
+        self._isolate_head = False
+        self._failures = 0
+        self.delivered += len(entries)
+        return len(entries)
+
+    # Function to block until the journal is empty (or the timeout passes); returns True if drained
+    def wait_until_drained(self, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        while len(self.journal):
+            if time.monotonic() > deadline:
+                return False
+            self._wake.set()
+            time.sleep(0.05)
+        return True
+
+    def stats(self):
+        return {
+            "pending": len(self.journal),
+            "dead_letter": self.journal.dead_letter_count(),
+            "delivered": self.delivered,
+            "last_error": self.last_error,
+        }
@@ -1,9 +1,52 @@
+import functools
+
 import streamlit as st
-import sqlitecloud
 import pandas as pd
 import pytz
 from datetime import datetime
 
+from annotation_app.alignment import AlignmentModel
+from annotation_app.analytics import load_stats, pair_agreement
+from annotation_app.annotations import WRITE_OPERATIONS
+from annotation_app.assignments import Assignment
+from annotation_app.instrumentation import Metrics
+from annotation_app.leases import DEFAULT_LEASE_SECONDS, LeasePolicy, LeaseReclaimer
+from annotation_app.progress import ProgressCache
+from annotation_app.row_claims import RowPrefetcher
+from annotation_app.storage import LocalSQLiteStorage, SQLiteCloudStorage
+from annotation_app.token_mappings import MAPPING_PAGE_SIZE, TokenMappingIndex
+from annotation_app.write_behind import WriteBehindWorker, WriteJournal
+
+# Timings of DB calls, reruns and the main data functions, shared by every session.
+# [metrics] jsonl_path = "..." exports one JSON line per rerun; log_reruns = true logs them.
+@st.cache_resource
+def get_metrics():
+    config = st.secrets.get("metrics", {})
+    return Metrics(jsonl_path=config.get("jsonl_path"), log_reruns=config.get("log_reruns", False))
+
+metrics = get_metrics()
+metrics.start_rerun()
+
+# Decorator turning a part of the page into a Streamlit fragment: interacting with its
+# widgets re-runs only that function, not the whole script. Such partial reruns are
+# timed and exported like full ones, with scope set to the section name.
+def page_section(name):
+    def decorator(function):
+        timed_function = metrics.timed(name)(function)
+
+        @functools.wraps(function)
+        def run_section(*args, **kwargs):
+            if metrics.current.started is not None:
+                return timed_function(*args, **kwargs)
+            metrics.start_rerun()
+            try:
+                return timed_function(*args, **kwargs)
+            finally:
+                metrics.finish_rerun(annotator_id=st.session_state.annotator_id, scope=name)
+
+        return st.fragment(run_section)
+    return decorator
+
 # Initialize session state variables for progress tracking
 if 'daily_annotated' not in st.session_state:
     st.session_state.daily_annotated = 0
@@ -23,14 +66,6 @@ if 'current_row_index' not in st.session_state:
 if 'show_warning' not in st.session_state:
     st.session_state.show_warning = False
 
-# Predefined list of valid annotator IDs
-first = st.secrets["Annotatorid"]["first"]
-second = st.secrets["Annotatorid"]["second"]
-third = st.secrets["Annotatorid"]["third"]
-forth = st.secrets["Annotatorid"]["forth"]
-fifth = st.secrets["Annotatorid"]["fifth"]
-valid_annotator_ids = [first, second, third, forth, fifth]
-
 # Capture annotator ID at the start and store it in session state
 if 'annotator_id' not in st.session_state:
     st.session_state.annotator_id = None
@@ -43,41 +78,6 @@ if annotator_id_input:
     st.session_state.annotator_id = annotator_id_input
 
 
-# Set different DAILY_TARGET based on annotator_id
-if st.session_state.annotator_id == first or st.session_state.annotator_id == third:
-    DAILY_TARGET = 60  # Assign 100 for first and second annotators
-    WORK_DAYS = 42 
-    TOTAL_TARGET = DAILY_TARGET * WORK_DAYS
-    start_date_str = "2024-09-24" 
-elif st.session_state.annotator_id == second or st.session_state.annotator_id == forth or st.session_state.annotator_id == fifth:
-    DAILY_TARGET = 60  # Assign 100 for first and second annotators
-    WORK_DAYS = 42 
-    TOTAL_TARGET = DAILY_TARGET * WORK_DAYS
-    start_date_str = "2024-09-27" 
-else:
-    DAILY_TARGET = 10  # Assign 100 for first and second annotators
-    WORK_DAYS = 40 
-    TOTAL_TARGET = DAILY_TARGET * WORK_DAYS
-    start_date_str = "2024-09-23" 
-    st.error("معرف المراجع غير صحيح. يرجى إدخال معرف صالح.")
-    st.stop()  # Stop execution until a valid ID is provided
-
-# Set the start date for the 30-day task
-# start_date_str = "2024-09-15"  # Set your desired start date in 'YYYY-MM-DD' format
-start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-
-# Get the current date in user's timezone
-current_date = datetime.now(pytz.timezone('Asia/Riyadh')).date()
-
-# Calculate how many days have passed since the start date
-# days_passed = (current_date - start_date).days
-days_passed = max(0, (current_date - start_date).days)
-
-
-# Recalculate expected progress based on days passed and set targets
-expected_annotations = min(days_passed * DAILY_TARGET, TOTAL_TARGET)
-# expected_annotations_yesterday = min((days_passed - 1) * DAILY_TARGET, TOTAL_TARGET)
-expected_annotations_yesterday = min(max(days_passed - 1, 0) * DAILY_TARGET, TOTAL_TARGET)
 
 
 
@@ -94,160 +94,216 @@ def get_local_time():
 
 
 
-# Function to establish a fresh database connection
+# Storage backend (and its connection pool) shared by every session of this server process.
+# dbcloud.backend = "sqlite" runs against a local WAL-mode SQLite file (dbcloud.db_path)
+# instead of SQLite Cloud.
+@st.cache_resource
+def get_storage():
+    config = st.secrets["dbcloud"]
+    pool_size = int(config.get("pool_size", 8))
+    if config.get("backend", "sqlitecloud") == "sqlite":
+        return LocalSQLiteStorage(config["db_path"], pool_size=pool_size, metrics=get_metrics())
+    return SQLiteCloudStorage(config["db_connect"], config["db_name"], pool_size=pool_size, metrics=get_metrics())
+
+# Targets the app used to hard-code per [Annotatorid] key: (daily target, work days, start date).
+# They seed the annotators table of a database that has no annotators yet.
+LEGACY_ASSIGNMENTS = {
+    "first": (60, 42, "2024-09-24"),
+    "third": (60, 42, "2024-09-24"),
+    "second": (60, 42, "2024-09-27"),
+    "forth": (60, 42, "2024-09-27"),
+    "fifth": (60, 42, "2024-09-27"),
+}
+
+# Annotator targets and work shards from the annotators/annotator_shards tables, read
+# once and shared by every session; changes (python -m annotation_app.assignments) are
+# picked up within 10 minutes
+@st.cache_resource(ttl=600)
+def get_assignments():
+    storage = get_storage()
+    assignments = storage.assignments()
+    if not assignments and "Annotatorid" in st.secrets:
+        storage.seed_assignments([
+            Assignment(annotator_id, *LEGACY_ASSIGNMENTS[key])
+            for key, annotator_id in st.secrets["Annotatorid"].items() if key in LEGACY_ASSIGNMENTS
+        ])
+        assignments = storage.assignments()
+    return assignments
+
+# Function to borrow a pooled database connection: `with get_db_connection() as conn:`
 def get_db_connection():
-    db_connect = st.secrets["dbcloud"]["db_connect"]
-    db_name = st.secrets["dbcloud"]["db_name"]
-    conn = sqlitecloud.connect(db_connect)
-    conn.execute(f"USE DATABASE {db_name}")
-    conn.execute('PRAGMA foreign_keys = ON;')
-    return conn
-
-# Function to fetch rows that are unprocessed or skipped, and not taken or taken by the current annotator
+    return get_storage().connection()
+
+# Bring the schema (indexes, annotation_date column) up to date once per server process
+@st.cache_resource
+def migrate_database():
+    return get_storage().migrate()
+
+# Index annotations written before the search index existed (or by older app versions)
+# once per server process; new ones are indexed as they are written
+@st.cache_resource
+def update_search_index():
+    return get_storage().index_new_annotations()
+
+# Lease rules for row reservations (dbcloud.lease_seconds, dbcloud.skip_hold_seconds)
+@st.cache_resource
+def get_lease_policy():
+    config = st.secrets["dbcloud"]
+    return LeasePolicy(lease_seconds=config.get("lease_seconds", DEFAULT_LEASE_SECONDS),
+                       skip_hold_seconds=config.get("skip_hold_seconds"))
+
+# Background thread returning rows with expired leases (abandoned sessions, skipped rows
+# past their hold) to the shared pool, once per server process
+@st.cache_resource
+def get_lease_reclaimer():
+    interval = float(st.secrets["dbcloud"].get("reclaim_interval", 60))
+    return LeaseReclaimer(get_storage().connection, get_lease_policy(), interval=interval).start()
+
+# Optional write-behind mode (dbcloud.write_behind = true): writes go to a local durable
+# journal and a background thread delivers them to the cloud database in order
+@st.cache_resource
+def get_write_behind():
+    if not st.secrets["dbcloud"].get("write_behind", False):
+        return None
+    journal = WriteJournal(st.secrets["dbcloud"].get("write_behind_journal", "write_behind.sqlite3"))
+    return WriteBehindWorker(journal, get_storage().connection, WRITE_OPERATIONS).start()
+
+# Function to run a named write (see WRITE_OPERATIONS) in its own transaction, or hand it
+# to the write-behind journal and return at once when that mode is enabled.
+# `row_id` is the original_data row the write belongs to; `payload` are the operation's arguments.
+@metrics.timed("submit_write")
+def submit_write(operation, row_id, **payload):
+    write_behind = get_write_behind()
+    if write_behind is not None:
+        write_behind.enqueue(operation, row_id, payload)
+        return
+    get_storage().write(operation, **payload)
+
+# Function to get this session's row prefetcher: a queue of rows pre-claimed for the
+# current annotator from their work shards (looked up once per page run, see below),
+# topped up (and the next row's mapping history loaded) in the background
+def get_row_prefetcher():
+    prefetcher = st.session_state.get('row_prefetcher')
+    shards = st.session_state.get('shards', ())
+    if (prefetcher is None or prefetcher.row_queue.annotator_id != st.session_state.annotator_id
+            or prefetcher.row_queue.shards != tuple(shards)):
+        if prefetcher is not None:
+            prefetcher.release()
+        storage = get_storage()
+        token_mapping_index = get_token_mapping_index()
+        batch_size = int(st.secrets["dbcloud"].get("claim_batch_size", 5))
+
+        # Runs on the prefetch thread, so it must not call st.* functions
+        def warm_mapping_history(row):
+            for token in set(tokenize(row[2])):
+                token_mapping_index.summary(token.strip(), lambda t: storage.mapping_summary(t, page_size=-1))
+
+        row_queue = storage.row_queue(st.session_state.annotator_id, batch_size=batch_size,
+                                      lease_seconds=get_lease_policy().lease_seconds,
+                                      cluster_limit=int(st.secrets["dbcloud"].get("cluster_claim_limit", 20)),
+                                      shards=shards)
+        prefetcher = RowPrefetcher(row_queue, warm=warm_mapping_history)
+        st.session_state.row_prefetcher = prefetcher
+    return prefetcher
+
+# Function to keep the annotator's reserved rows leased while they are working on the page
+def keep_rows_reserved():
+    get_row_prefetcher().row_queue.heartbeat()
+
+# Function to list rows that must not be handed out again although they look unfinished
+# in the database: rows whose writes are still waiting in the write-behind journal.
+# (Skipped rows are tracked per annotator in the database, see annotations.skip_row.)
+def get_excluded_rows():
+    write_behind = get_write_behind()
+    if write_behind is None:
+        return []
+    return list(write_behind.journal.pending_entity_ids())
+
+# Function to fetch the next row for the annotator: rows they already hold come first,
+# then rows claimed atomically in batches; usually already loaded by the prefetcher
+@metrics.timed("get_available_row")
 def get_available_row():
-    conn = get_db_connection()
-    c = conn.cursor()
-    annotator_id = st.session_state.annotator_id
-    
-    # Get list of skipped rows to exclude from fetching
-    skipped_rows = st.session_state.get('skipped_rows', [])
-    skipped_rows_placeholder = ','.join(['?'] * len(skipped_rows))
-
-    # First, try to get a row that is already taken by this annotator
-    if skipped_rows:
-        c.execute(f'''
-            SELECT * FROM original_data 
-            WHERE (processed = "no" OR processed = "skipped")
-            AND taken = "yes" 
-            AND taken_by = ?
-            AND entity_id NOT IN ({skipped_rows_placeholder})
-            LIMIT 1
-        ''', (annotator_id, *skipped_rows))
-    else:
-        c.execute('''
-            SELECT * FROM original_data 
-            WHERE (processed = "no" OR processed = "skipped")
-            AND taken = "yes" 
-            AND taken_by = ?
-            LIMIT 1
-        ''', (annotator_id,))
-    
-    row = c.fetchone()
-    
-    # If no such row exists, get a new available row that is either not taken or has a null annotator
-    if not row:
-        if skipped_rows:
-            c.execute(f'''
-                SELECT * FROM original_data 
-                WHERE processed = "no"
-                AND (taken = "no" OR (taken = "yes" AND taken_by IS NULL))
-                AND entity_id NOT IN ({skipped_rows_placeholder})
-                LIMIT 1
-            ''', (*skipped_rows,))
-        else:
-            c.execute('''
-                SELECT * FROM original_data 
-                WHERE processed = "no"
-                AND (taken = "no" OR (taken = "yes" AND taken_by IS NULL))
-                LIMIT 1
-            ''')
-        row = c.fetchone()
-        
-        # If a new row is fetched, mark it as taken by the current annotator
-        if row and row[7] == "no":  # Ensure 'taken' is 'no' before reserving
-            entity_id = row[0]
-            c.execute('''
-                UPDATE original_data 
-                SET taken = "yes", taken_by = ? 
-                WHERE entity_id = ?
-            ''', (annotator_id, entity_id))
-            conn.commit()
-    
-    conn.close()
-    return row
-
-
-
-
-
-# Function to fetch rows based on the processed state
-def get_rows_by_processed(processed_status):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT * FROM original_data WHERE processed = ?', (processed_status,))
-    rows = c.fetchall()
-    conn.close()  # Close the connection after fetching rows
-    return rows
-
-# Function to update the original_data table based on action
-def update_original_data(entity_id, action):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('UPDATE original_data SET processed = ? WHERE entity_id = ?', (action, entity_id))
-    conn.commit()
-    conn.close()  # Close the connection after updating
-
-# Function to save the annotation with the annotator ID and localized datestamp
-def save_annotation(entity_id, selected_translation, edited_source, edited_translation, action):
-    annotator_id = st.session_state.annotator_id  # Retrieve annotator ID from session state
-    conn = get_db_connection()
-    c = conn.cursor()
-
-    # Get the current timestamp in the user's timezone
-    local_timestamp = get_local_time()
+    return get_row_prefetcher().next_row(exclude=get_excluded_rows())
 
-    # Insert the annotation with the local timestamp
-    c.execute('''
-        INSERT INTO annotation (entity_id, selected_translation, edited_source, edited_translation, action, annotator_id, datestamp)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (entity_id, selected_translation, edited_source, edited_translation, action, annotator_id, local_timestamp))
 
-    conn.commit()
-    conn.close()  # Close the connection after saving
+# Short-lived progress counts shared by every session, so reruns rarely hit the database
+@st.cache_resource
+def get_progress_cache():
+    return ProgressCache(ttl=30)
 
-    # Update progress
+# Function to count a just-saved annotation in the session and the shared progress cache
+def record_progress(annotator_id, day):
+    get_progress_cache().add(annotator_id, day)
     st.session_state.daily_annotated += 1
     st.session_state.total_annotated += 1
 
-# Function to fetch today's annotations based on datestamp and annotator_id
-def get_daily_annotations():
+# Function to fetch today's and total annotations of the annotator from the progress counters
+@metrics.timed("get_annotation_progress")
+def get_annotation_progress():
+    annotator_id = st.session_state.annotator_id
     today = datetime.now(pytz.timezone('Asia/Riyadh')).strftime('%Y-%m-%d')  # Get today's date
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT COUNT(*) FROM annotation WHERE annotator_id = ? AND datestamp LIKE ?', 
-              (st.session_state.annotator_id, f'{today}%'))
-    count = c.fetchone()[0]
-    conn.close()
-    return count
-
-# Function to fetch total annotations for the specific annotator
-def get_total_annotations():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT COUNT(*) FROM annotation WHERE annotator_id = ?', 
-              (st.session_state.annotator_id,))
-    count = c.fetchone()[0]
-    conn.close()
-    return count
+
+    return get_progress_cache().get(annotator_id, today, lambda: get_storage().progress(annotator_id, today))
 
 
 # Function to tokenize text into words (simple whitespace tokenization)
 def tokenize(text):
     return text.split()
 
-# Function to save token mappings into the database
-def save_token_mapping(entity_id, annotator_id, source_token, translation_token):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO token_mappings (entity_id, annotator_id, source_token, translation_token)
-        VALUES (?, ?, ?, ?)
-    ''', (entity_id, annotator_id, source_token, translation_token))
-    conn.commit()
-    conn.close()  # Close the connection after saving
-
-
-# Function to display token mapping dropdowns and append the results to the list
+# In-memory index of previous mappings per source token, shared by every session
+@st.cache_resource
+def get_token_mapping_index():
+    return TokenMappingIndex()
+
+# Function to load all previous mappings of one source token (called by the index on a miss)
+@metrics.timed("load_mapping_summary")
+def load_mapping_summary(source_token):
+    return get_storage().mapping_summary(source_token, page_size=-1)
+
+# Alignment suggestions learned from every processed sentence and saved mapping, shared
+# by every session and kept up to date by process_row_callback
+@st.cache_resource
+def get_alignment_model():
+    config = st.secrets.get("alignment", {})
+    model = AlignmentModel(method=config.get("method", "dice"), min_score=float(config.get("min_score", 0.15)))
+    with get_db_connection() as conn:
+        return model.load(conn)
+
+# Function to suggest source -> translation token pairs for the sentence being edited
+@metrics.timed("alignment_suggestions")
+def get_alignment_suggestions(source_tokens, translation_tokens):
+    return get_alignment_model().suggest(source_tokens, translation_tokens)
+
+# Function to get the processed near-duplicate of a row (see annotation_app.near_duplicates),
+# looked up once per row and kept in the session while the row is on screen
+def get_cluster_reference(entity_id):
+    cached = st.session_state.get('cluster_reference')
+    if cached is None or cached[0] != entity_id:
+        cached = (entity_id, get_storage().cluster_reference(entity_id))
+        st.session_state.cluster_reference = cached
+    return cached[1]
+
+# Function to start from a near-duplicate's annotation: its edited translation, and its
+# token mappings whose source token also appears in this row's source text
+def use_cluster_reference(entity_id, source_key, translation_key):
+    reference = get_cluster_reference(entity_id)
+    st.session_state[translation_key] = reference["edited_translation"]
+    source_tokens = {token.strip() for token in tokenize(st.session_state[source_key])}
+    existing = {(mapping[1], mapping[2]) for mapping in st.session_state.token_mappings}
+    st.session_state.token_mappings.extend(
+        (entity_id, source_token, translation_token)
+        for source_token, translation_token in reference["mappings"]
+        if source_token in source_tokens and (source_token, translation_token) not in existing
+    )
+
+# Function to search past annotations and mappings for a word or its inflected forms
+@metrics.timed("search_examples")
+def search_examples(text):
+    return get_storage().search_examples(text, limit=int(st.secrets["dbcloud"].get("search_limit", 10)))
+
+# Function to display token mapping dropdowns and append the results to the list.
+# Choosing tokens, paging and adding/removing mappings re-run only this section.
+@page_section("token_mapping")
 def display_token_mapping(source_text, translation_text, entity_id):
     # Tokenize the source and translation texts
     source_tokens = tokenize(source_text)
@@ -257,6 +313,22 @@ def display_token_mapping(source_text, translation_text, entity_id):
     <p style='font-size:14px; color:gray;'>ملاحظة: إذا أردت اختيار كلمتين وليست كلمة واحدة فاضف علامة _ بين الكلمتين, على سبيل المثال: كيف_حالك</p>
     """, unsafe_allow_html=True)
     
+    # Suggested alignments for this sentence, learned from earlier annotations;
+    # one click adds all of them to the temporary mappings
+    suggestions = get_alignment_suggestions(source_tokens, translation_tokens)
+    suggested_translations = {source_token: translation_token for source_token, translation_token, _ in suggestions}
+    if suggestions:
+        st.write("ارتباطات مقترحة:")
+        st.caption(" | ".join(f"{source_token} -> {translation_token}"
+                              for source_token, translation_token, _ in suggestions))
+        if st.button("إضافة الارتباطات المقترحة"):
+            existing = {(mapping[1], mapping[2]) for mapping in st.session_state.token_mappings}
+            st.session_state.token_mappings.extend(
+                (entity_id, source_token, translation_token)
+                for source_token, translation_token, _ in suggestions
+                if (source_token, translation_token) not in existing
+            )
+
     # Display dropdowns for selecting tokens
     selected_source_token = st.selectbox("اختر كلمة من النص الأصلي:", source_tokens)
     
@@ -268,49 +340,45 @@ def display_token_mapping(source_text, translation_text, entity_id):
         # # Debugging output
         # st.write(f"Selected Source Token: '{normalized_source_token}'")
 
-        # Fetch existing mappings for the selected source token
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('''
-            SELECT source_token, translation_token, entity_id
-            FROM token_mappings 
-            WHERE source_token = ?
-        ''', (normalized_source_token,))
-        previous_mappings = c.fetchall()
-        conn.close()
-        
-        # Display the count of previous mappings
-        if previous_mappings:
-            st.write(f"{len(previous_mappings)} ارتباطات سابقة لهذه الكلمة كالتالي:")
-
-            # Fetching edited_source for each mapping
-            conn = get_db_connection()
-            c = conn.cursor()
-            for mapping in previous_mappings:
-                # Debugging: print the entity_id
-                # st.write(f"Debug: entity_id={mapping[2]}")
-
-                # Retrieve the edited_source from the annotation table based on entity_id
-                c.execute('''
-                    SELECT edited_source 
-                    FROM annotation 
-                    WHERE entity_id = ?
-                ''', (mapping[2],))
-                
-                result = c.fetchone()
-
-                edited_sources = result[0] if result else "غير متوفر" 
-                # edited_source_display = ", ".join(edited_sources) if edited_sources else "غير متوفر"
-                
-                # Display the mapping with edited_source
-                st.write(f"{mapping[0]} -> {mapping[1]}  :: {edited_sources}")
-            conn.close()
+        # Page through the translation groups when there are many of them
+        page = st.session_state.get(f"mapping_page_{normalized_source_token}", 1) - 1
+
+        # Grouped counts and example sentences for the selected source token, served from
+        # the in-memory index (one query the first time a token is looked up)
+        summary = get_token_mapping_index().summary(normalized_source_token, load_mapping_summary, page=page)
+
+        # Display the count of previous mappings, grouped by translation token
+        if summary["total_mappings"]:
+            st.write(f"{summary['total_mappings']} ارتباطات سابقة لهذه الكلمة كالتالي:")
+
+            for translation_token, mapping_count, examples in summary["groups"]:
+                st.write(f"{normalized_source_token} -> {translation_token}  ({mapping_count})")
+                examples_display = " | ".join(examples) if examples else "غير متوفر"
+                st.caption(examples_display)
+
+            page_count = -(-summary["total_groups"] // MAPPING_PAGE_SIZE)
+            if page_count > 1:
+                st.number_input("الصفحة", min_value=1, max_value=page_count, step=1,
+                                key=f"mapping_page_{normalized_source_token}")
         else:
             st.write("لا توجد ارتباطات سابقة لهذه الكلمة.")
 
+        # Past sentences containing the word, its other forms (prefix match) or its mappings
+        search_text = st.text_input("ابحث في الجمل السابقة:", value=normalized_source_token,
+                                    key=f"search_{normalized_source_token}")
+        for result in search_examples(search_text):
+            st.markdown(f"{result['edited_source']}  \n{result['edited_translation']}")
+            if result["mappings"]:
+                st.caption(result["mappings"])
 
 
-    selected_translation_token = st.selectbox("اختر كلمة من الترجمة المختارة:", translation_tokens)
+
+
+    # Pre-select the suggested translation token for the chosen source token
+    suggested_translation = suggested_translations.get((selected_source_token or "").strip())
+    suggested_index = translation_tokens.index(suggested_translation) if suggested_translation in translation_tokens else 0
+    selected_translation_token = st.selectbox("اختر كلمة من الترجمة المختارة:", translation_tokens,
+                                              index=suggested_index)
 
     # Button to temporarily store the selected token mappings in session state
     if st.button("تعيين ارتباط"):
@@ -329,6 +397,7 @@ def display_token_mapping(source_text, translation_text, entity_id):
         if st.button("إزالة ارتباط"):
             # Clear all temporary mappings
             st.session_state.token_mappings = []
+            st.rerun(scope="fragment")
 
 
 
@@ -336,6 +405,7 @@ def display_token_mapping(source_text, translation_text, entity_id):
 
 
 # Function to handle processing a row and then move to the next one
+@metrics.timed("process_row_callback")
 def process_row_callback():
     if not st.session_state.token_mappings:
         st.session_state.show_warning = True
@@ -346,6 +416,12 @@ def process_row_callback():
     row = st.session_state.current_row
     entity_id, _, _, translation_1, translation_2, translation_3, _, _, _, _ = row
 
+    # The editor is a fragment, so read its current values from the widget state
+    source_key, translation_key = st.session_state.editor_keys
+    edited_source_text = st.session_state[source_key]
+    edited_translation = st.session_state[translation_key]
+    st.session_state.selected_translation = st.session_state[f"translation_{entity_id}"]
+
     # Identify the selected translation
     if st.session_state.selected_translation == translation_1:
         selected_translation_key = "translation_1"
@@ -354,14 +430,23 @@ def process_row_callback():
     else:
         selected_translation_key = "translation_3"
 
-    # Save the annotation with the selected translation
-    save_annotation(entity_id, selected_translation_key, edited_source_text, edited_translation, "processed")
-    update_original_data(entity_id, "yes")
-    
-    # Save all token mappings to the database at once when processing is confirmed
-    for entity_id, source_token, translation_token in st.session_state.token_mappings:
-        annotator_id = st.session_state.annotator_id
-        save_token_mapping(entity_id, annotator_id, source_token, translation_token)
+    # Save the annotation, mark the row as processed and save all token mappings
+    # in one transaction (or one journal entry) when processing is confirmed
+    annotator_id = st.session_state.annotator_id
+    local_timestamp = get_local_time()
+    submit_write("processed_row", entity_id, entity_id=entity_id, annotator_id=annotator_id,
+                 selected_translation=selected_translation_key, edited_source=edited_source_text,
+                 edited_translation=edited_translation, datestamp=local_timestamp,
+                 mappings=st.session_state.token_mappings)
+
+    # Keep the in-memory mapping index and the progress counters in step with the database
+    token_mapping_index = get_token_mapping_index()
+    for _, source_token, translation_token in st.session_state.token_mappings:
+        token_mapping_index.add(source_token, translation_token, edited_source_text)
+    alignment_model = get_alignment_model()
+    alignment_model.add_sentences([(edited_source_text, edited_translation)])
+    alignment_model.add_mappings([mapping[1:] for mapping in st.session_state.token_mappings])
+    record_progress(annotator_id, local_timestamp[:10])
     
     # Clear the token mappings after processing
     st.session_state.token_mappings = []
@@ -371,12 +456,14 @@ def process_row_callback():
 
 
 # Function to handle rejecting a row
+@metrics.timed("reject_row_callback")
 def reject_row_callback():
     row = st.session_state.current_row
     entity_id, _, _, translation_1, translation_2, translation_3, _, _, _, _ = row
     
-    # Update the row status as rejected
-    update_original_data(entity_id, "reject")
+    # Update the row status as rejected and record the reject for the quality reports
+    submit_write("reject_row", entity_id, entity_id=entity_id, annotator_id=st.session_state.annotator_id,
+                 datestamp=get_local_time())
     
     # Clear the current row and fetch a new available one
     st.session_state.current_row = get_available_row()
@@ -402,30 +489,18 @@ def reject_row_callback():
 #     st.session_state.current_row = get_available_row()
 
 
-# Function to handle skipping a row (set processed to "skipped" and assign it to the current annotator)
+# Function to handle skipping a row (never shown to this annotator again; held for them
+# for dbcloud.skip_hold_seconds if set, otherwise returned to the pool)
+@metrics.timed("skip_row_callback")
 def skip_row_callback():
-    conn = get_db_connection()
-    c = conn.cursor()
-    
     # Get the current row information
     current_row = st.session_state.current_row
     entity_id = current_row[0]
     annotator_id = st.session_state.annotator_id
-    
-    # Update the row as "skipped" and assign it to the current annotator
-    c.execute('''
-        UPDATE original_data 
-        SET processed = "skipped", taken = "yes", taken_by = ? 
-        WHERE entity_id = ?
-    ''', (annotator_id, entity_id))
-    
-    conn.commit()
-    conn.close()
-    
-    # Add the entity_id to the list of skipped rows in session state
-    if 'skipped_rows' not in st.session_state:
-        st.session_state.skipped_rows = []
-    st.session_state.skipped_rows.append(entity_id)
+
+    # Record the skip and hold or release the row
+    submit_write("skip_row", entity_id, entity_id=entity_id, annotator_id=annotator_id,
+                 lease_expires_at=get_lease_policy().skip_expiry(), datestamp=get_local_time())
     
     # Fetch a new available row
     st.session_state.current_row = get_available_row()
@@ -433,6 +508,151 @@ def skip_row_callback():
 
 
 
+migrate_database()
+update_search_index()
+get_lease_reclaimer()
+
+# Look up the annotator's targets, start date and work shards (see get_assignments)
+assignment = get_assignments().get(st.session_state.annotator_id)
+if assignment is None:
+    # An annotator deactivated or removed while working lands here on their next rerun:
+    # the rows reserved for them go back to the pool
+    prefetcher = st.session_state.pop('row_prefetcher', None)
+    current_row = st.session_state.pop('current_row', None)
+    if prefetcher is not None:
+        prefetcher.release()
+        if current_row is not None:
+            get_storage().release_rows(prefetcher.row_queue.annotator_id, [current_row[0]])
+    if prefetcher is not None and prefetcher.row_queue.annotator_id == st.session_state.annotator_id:
+        st.error("لم يعد معرف المراجع هذا مفعلاً. يرجى التواصل مع المشرف.")
+    else:
+        st.error("معرف المراجع غير صحيح. يرجى إدخال معرف صالح.")
+    metrics.finish_rerun(annotator_id=None, scope="page")
+    st.stop()  # Stop execution until a valid ID is provided
+st.session_state.shards = assignment.shards
+
+DAILY_TARGET = assignment.daily_target
+WORK_DAYS = assignment.work_days
+TOTAL_TARGET = assignment.total_target
+start_date_str = assignment.start_date
+
+# Set the start date for the 30-day task
+# start_date_str = "2024-09-15"  # Set your desired start date in 'YYYY-MM-DD' format
+start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+
+# Get the current date in user's timezone
+current_date = datetime.now(pytz.timezone('Asia/Riyadh')).date()
+
+# Calculate how many days have passed since the start date
+# days_passed = (current_date - start_date).days
+days_passed = max(0, (current_date - start_date).days)
+
+
+# Recalculate expected progress based on days passed and set targets
+expected_annotations = min(days_passed * DAILY_TARGET, TOTAL_TARGET)
+# expected_annotations_yesterday = min((days_passed - 1) * DAILY_TARGET, TOTAL_TARGET)
+expected_annotations_yesterday = min(max(days_passed - 1, 0) * DAILY_TARGET, TOTAL_TARGET)
+
+# Function to get per annotator pair agreement from the statistics kept up to date by
+# `python -m annotation_app.analytics` (read at most every 10 minutes)
+@st.cache_data(ttl=600)
+def get_pair_agreement():
+    with get_db_connection() as conn:
+        stats = load_stats(conn)
+    return pair_agreement(stats) if not stats.empty else None
+
+# Function to show performance numbers to admins only: open the app with
+# ?admin=<token>, where the token is set as admin.token in the secrets
+def display_admin_panel():
+    admin_token = st.secrets.get("admin", {}).get("token")
+    if not admin_token or st.query_params.get("admin") != admin_token:
+        return
+
+    with st.sidebar:
+        st.subheader("Performance")
+        st.write("Queries per rerun", metrics.queries_per_rerun())
+        snapshot = metrics.snapshot()
+        if snapshot:
+            st.dataframe(pd.DataFrame.from_dict(snapshot, orient="index"))
+            histogram_name = st.selectbox("Histogram", list(snapshot), key="admin_histogram")
+            st.bar_chart(pd.Series(metrics.histogram(histogram_name).buckets()))
+        st.write("Connection pool", get_storage().pool.stats())
+        token_mapping_index = get_token_mapping_index()
+        st.write("Mapping index", {"hits": token_mapping_index.hits, "misses": token_mapping_index.misses})
+        write_behind = get_write_behind()
+        if write_behind is not None:
+            st.write("Write-behind", write_behind.stats())
+        st.write("Reservations", get_lease_reclaimer().stats())
+        st.write("Free rows per shard", get_storage().shard_backlog())
+        st.write("Alignment model", get_alignment_model().stats())
+        agreement = get_pair_agreement()
+        if agreement is not None:
+            st.write("Agreement")
+            st.dataframe(agreement.round(3), hide_index=True)
+
+
+# Function to show today's and overall progress. It only runs with the whole page
+# (i.e. when the row changes), never on widget interactions inside the sections below.
+@metrics.timed("display_progress")
+def display_progress():
+    # Calculate today's and overall progress for the specific annotator
+    st.session_state.daily_annotated, st.session_state.total_annotated = get_annotation_progress()
+
+    # Progress feedback
+    st.write(f"تمت مراجعة {st.session_state.daily_annotated} من أصل {DAILY_TARGET} اليوم")
+    daily_progress = min(st.session_state.daily_annotated / DAILY_TARGET, 1.0)  # Ensure progress does not exceed 100%
+    st.progress(daily_progress)
+
+    if days_passed == 0:
+        st.markdown(f"""
+            <p><strong>مرحبا بك في اليوم الأول للترجمة</strong>. لقد بدأت اليوم وقمت بإدخال <span style="color:#F39C12;">{st.session_state.total_annotated}</span> جمل.</p>
+        """, unsafe_allow_html=True)
+    elif st.session_state.total_annotated >= expected_annotations:
+        st.markdown(f"""
+            <p><strong>عمل مميز</strong>.. مرّت <span style="color:#F39C12;">{days_passed}</span> أيام وقمت بإدخال <span style="color:#F39C12;">{st.session_state.total_annotated}</span> جمل.. بزيادة <span style="color:#F39C12;">{st.session_state.total_annotated - expected_annotations}</span> عن العدد المطلوب.</p>
+        """, unsafe_allow_html=True)
+    elif st.session_state.total_annotated < expected_annotations:
+        st.markdown(f"""
+            <p><strong>تحتاج إلى زيادة المعدل اليومي لتغطي</strong> <span style="color:#F39C12;">{expected_annotations - st.session_state.total_annotated}</span> المتأخرة بالإضافة إلى مهمة اليوم.. مرّت <span style="color:#F39C12;">{days_passed}</span> أيام وقمت بإدخال <span style="color:#F39C12;">{st.session_state.total_annotated}</span> جمل.</p>
+        """, unsafe_allow_html=True)
+
+
+# Function to show the sentence and translation editor; editing the text or choosing
+# another translation re-runs only this section (and the mapping panel inside it)
+@page_section("sentence_editor")
+def display_sentence_editor(entity_id, keyword, source_text, translations):
+    keep_rows_reserved()
+
+    # st.text_area("", value=keyword)
+    st.write(keyword)
+    # Custom label and input for the source text
+    st.markdown('<div class="custom-label" style="color:#F39C12; font-weight:bold;">الجملة العامية:</div>', unsafe_allow_html=True)
+    source_key = f"edited_source_{entity_id}"
+    edited_source_text = st.text_area("", value=source_text, key=source_key)
+
+    # Custom label and input for the translation options
+    st.markdown('<div class="custom-label" style="color:#F39C12; font-weight:bold;">اختر الترجمة:</div>', unsafe_allow_html=True)
+    st.session_state.selected_translation = st.radio("", options=translations, key=f"translation_{entity_id}")
+
+    # Custom label and input for editing the selected translation
+    st.markdown('<div class="custom-label" style="color:#F39C12; font-weight:bold;">تحرير الترجمة المختارة:</div>', unsafe_allow_html=True)
+    translation_key = f"edited_translation_{entity_id}_{translations.index(st.session_state.selected_translation)}"
+    edited_translation = st.text_area("", value=st.session_state.selected_translation, key=translation_key)
+
+    # Remember which widgets hold the edits, for process_row_callback
+    st.session_state.editor_keys = (source_key, translation_key)
+
+    # A near-duplicate of this sentence that was already annotated can be used as a starting point
+    reference = get_cluster_reference(entity_id)
+    if reference is not None and reference["edited_translation"]:
+        st.caption(f"جملة مشابهة تمت معالجتها: {reference['edited_source']} -> {reference['edited_translation']}")
+        st.button("استخدام ترجمة الجملة المشابهة", on_click=use_cluster_reference,
+                  args=(entity_id, source_key, translation_key))
+
+    # Display token mapping interface directly below the selected translation
+    display_token_mapping(edited_source_text, edited_translation, entity_id)
+
+
 # Fetch an available row if not already fetched
 if 'current_row' not in st.session_state:
     st.session_state.current_row = get_available_row()
@@ -493,45 +713,8 @@ if row:
         """, unsafe_allow_html=True)
 
 
-    # Calculate today's and overall progress for the specific annotator
-    st.session_state.daily_annotated = get_daily_annotations()
-    st.session_state.total_annotated = get_total_annotations()
-
-    # Progress feedback
-    st.write(f"تمت مراجعة {st.session_state.daily_annotated} من أصل {DAILY_TARGET} اليوم")
-    daily_progress = min(st.session_state.daily_annotated / DAILY_TARGET, 1.0)  # Ensure progress does not exceed 100%
-    st.progress(daily_progress)
-
-    if days_passed == 0:
-        st.markdown(f"""
-            <p><strong>مرحبا بك في اليوم الأول للترجمة</strong>. لقد بدأت اليوم وقمت بإدخال <span style="color:#F39C12;">{st.session_state.total_annotated}</span> جمل.</p>
-        """, unsafe_allow_html=True)
-    elif st.session_state.total_annotated >= expected_annotations:
-        st.markdown(f"""
-            <p><strong>عمل مميز</strong>.. مرّت <span style="color:#F39C12;">{days_passed}</span> أيام وقمت بإدخال <span style="color:#F39C12;">{st.session_state.total_annotated}</span> جمل.. بزيادة <span style="color:#F39C12;">{st.session_state.total_annotated - expected_annotations}</span> عن العدد المطلوب.</p>
-        """, unsafe_allow_html=True)
-    elif st.session_state.total_annotated < expected_annotations:
-        st.markdown(f"""
-            <p><strong>تحتاج إلى زيادة المعدل اليومي لتغطي</strong> <span style="color:#F39C12;">{expected_annotations - st.session_state.total_annotated}</span> المتأخرة بالإضافة إلى مهمة اليوم.. مرّت <span style="color:#F39C12;">{days_passed}</span> أيام وقمت بإدخال <span style="color:#F39C12;">{st.session_state.total_annotated}</span> جمل.</p>
-        """, unsafe_allow_html=True)
-
-
-    # st.text_area("", value=keyword)
-    st.write(keyword)
-    # Custom label and input for the source text
-    st.markdown('<div class="custom-label" style="color:#F39C12; font-weight:bold;">الجملة العامية:</div>', unsafe_allow_html=True)
-    edited_source_text = st.text_area("", value=source_text)
-
-    # Custom label and input for the translation options
-    st.markdown('<div class="custom-label" style="color:#F39C12; font-weight:bold;">اختر الترجمة:</div>', unsafe_allow_html=True)
-    st.session_state.selected_translation = st.radio("", options=[translation_1, translation_2, translation_3], key=f"translation_{entity_id}")
-
-    # Custom label and input for editing the selected translation
-    st.markdown('<div class="custom-label" style="color:#F39C12; font-weight:bold;">تحرير الترجمة المختارة:</div>', unsafe_allow_html=True)
-    edited_translation = st.text_area("", value=st.session_state.selected_translation)
-
-    # Display token mapping interface directly below the selected translation
-    display_token_mapping(edited_source_text, edited_translation, entity_id)
+    display_progress()
+    display_sentence_editor(entity_id, keyword, source_text, [translation_1, translation_2, translation_3])
     
     # Check if we need to display the warning (show it just above the buttons)
     if st.session_state.get('show_warning', False):
@@ -563,5 +746,11 @@ if row:
 
     st.markdown('</div>', unsafe_allow_html=True)
 
+    # Load the next row in the background while this one is being annotated
+    get_row_prefetcher().prefetch(exclude=[entity_id, *get_excluded_rows()])
+
 else:
     st.write("لا توجد صفوف غير معالجة متاحة.")
+
+display_admin_panel()
+metrics.finish_rerun(annotator_id=st.session_state.annotator_id, scope="page")
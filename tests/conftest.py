@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+from annotation_app.storage import LocalSQLiteStorage
+
+
+# Function to add `count` pending rows to original_data, numbered from `start`
+def seed_rows(storage, count, start=1, dialect="najdi"):
+    with storage.connection() as conn:
+        conn.executemany('''
+            INSERT INTO original_data (entity_id, keyword, source_text, translation_1, translation_2,
+                                       translation_3, dialect)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (entity_id, f"keyword {entity_id}", f"source {entity_id}", f"first {entity_id}",
+             f"second {entity_id}", f"third {entity_id}", dialect)
+            for entity_id in range(start, start + count)
+        ])
+        conn.commit()
+
+
+# Function to write `records` to a JSONL file and return its path
+def write_jsonl(path, records):
+    path.write_text("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records), encoding="utf-8")
+    return str(path)
+
+
+# A migrated local database in the test's temporary directory
+@pytest.fixture
+def storage(tmp_path):
+    storage = LocalSQLiteStorage(str(tmp_path / "annotations.sqlite3"), pool_size=2)
+    storage.migrate()
+    yield storage
+    storage.close()
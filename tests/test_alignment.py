@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from annotation_app.alignment import AlignmentModel, PairCounts
+
+from conftest import seed_rows
+
+SENTENCES = [("وين رايح", "where going"), ("وين رايح", "where going"), ("وين", "where")]
+
+
+def test_pair_counts_merge_pending_counts_into_the_arrays():
+    counts = PairCounts(merge_every=4)
+    counts.add(np.array([5, 1, 5], dtype=np.int64))
+    counts.add(np.array([7], dtype=np.int64))
+    assert len(counts.keys) == 0
+    assert counts.lookup(np.array([1, 5, 7, 9], dtype=np.int64)).tolist() == [1, 2, 1, 0]
+    counts.add(np.array([9], dtype=np.int64))
+    assert counts.keys.tolist() == [1, 5, 7, 9]
+    counts.add(np.array([5, 5, 2, 2], dtype=np.int64))
+    assert counts.keys.tolist() == [1, 2, 5, 7, 9]
+    counts.add(np.array([9], dtype=np.int64))
+    assert counts.lookup(np.array([1, 2, 5, 7, 9], dtype=np.int64)).tolist() == [1, 2, 4, 1, 2]
+    counts.merge()
+    assert counts.counts.tolist() == [1, 2, 4, 1, 2]
+    assert len(counts) == 5
+
+
+def test_suggest_scores_dice_from_cooccurrence():
+    model = AlignmentModel(mapping_weight=0.0)
+    model.add_sentences(SENTENCES)
+    assert model.stats()["sentences"] == 3
+    # Dice: وين/where 2*3/(3+3), رايح/going 2*2/(2+2), the cross pairs 2*2/(3+2)
+    assert model.suggest(["وين", "رايح"], ["where", "going"]) == [("وين", "where", 1.0), ("رايح", "going", 1.0)]
+    assert model.suggest(["رايح", "غير"], ["where"]) == [("رايح", "where", 0.8)]
+
+
+def test_suggest_picks_one_to_one_pairs_best_first():
+    model = AlignmentModel(mapping_weight=0.6)
+    model.add_sentences(SENTENCES)
+    model.add_mappings([("رايح", "where")] * 3)
+    # رايح/where 0.6 + 0.4 * 0.8 wins, which leaves وين/going (0.4 * 0.8) for وين
+    assert model.suggest(["وين", "رايح"], ["where", "going"]) == [("رايح", "where", 0.92), ("وين", "going", 0.32)]
+    assert model.suggest(["وين", "رايح"], ["where", "going"], limit=1) == [("رايح", "where", 0.92)]
+    model.min_score = 0.35
+    assert model.suggest(["وين", "رايح"], ["where", "going"]) == [("رايح", "where", 0.92)]
+
+
+def test_load_reads_processed_sentences_and_mappings_only(storage):
+    seed_rows(storage, 4)
+    for entity_id, (source, translation) in enumerate(SENTENCES, start=1):
+        storage.commit_processed_row(entity_id, "first", "translation_1", source, translation,
+                                     "2024-05-01 10:00:00", [(entity_id, "رايح", "where")])
+    storage.write("reject_row", entity_id=4, annotator_id="first", datestamp="2024-05-01 11:00:00")
+    with storage.connection() as conn:
+        model = AlignmentModel(merge_every=2).load(conn, page_size=2)
+    assert model.stats() == {"sentences": 3, "source_vocabulary": 2, "translation_vocabulary": 2,
+                             "cooccurring_pairs": 4, "mapped_pairs": 1}
+    assert model.suggest(["وين", "رايح"], ["where", "going"]) == [("رايح", "where", 0.92), ("وين", "going", 0.32)]
+
+
+def test_unknown_association_measure_is_rejected():
+    with pytest.raises(ValueError):
+        AlignmentModel(method="chi2")
@@ -0,0 +1,80 @@
+import pytest
+
+from annotation_app.analytics import daily_quality, fleiss_kappa, load_stats, pair_agreement, update_stats
+
+from conftest import seed_rows
+
+
+def test_daily_quality_counts_rejects_and_skips(storage):
+    seed_rows(storage, 3)
+    storage.commit_processed_row(1, "first", "translation_1", "source 1", "first 1", "2024-05-01 10:00:00",
+                                 [(1, "source", "first")])
+    storage.write("reject_row", entity_id=2, annotator_id="first", datestamp="2024-05-01 10:05:00")
+    storage.write("skip_row", entity_id=3, annotator_id="first", datestamp="2024-05-01 10:06:00")
+    with storage.connection() as conn:
+        update_stats(conn)
+        report = daily_quality(load_stats(conn), by_annotator=True)
+    row = report.iloc[0]
+    assert len(report) == 1
+    assert (row["day"], row["annotator_id"]) == ("2024-05-01", "first")
+    assert (row["processed"], row["reject"], row["skipped"], row["annotations"]) == (1, 1, 1, 3)
+    assert row["reject_rate"] == 1 / 3
+    assert row["mappings_per_row"] == 1
+
+
+# Function to have two annotators answer rows 1-4: they agree on rows 1, 3 and 4
+def answer_rows(storage, entity_ids=(1, 2, 3, 4)):
+    choices = {"first": ["translation_1", "translation_1", "translation_2", "translation_2"],
+               "second": ["translation_1", "translation_2", "translation_2", "translation_2"]}
+    mappings = {"first": [("وين", "where"), ("رايح", "going")], "second": [("وين", "where")]}
+    for entity_id in entity_ids:
+        for annotator_id, choice in choices.items():
+            storage.commit_processed_row(entity_id, annotator_id, choice[entity_id - 1], f"source {entity_id}",
+                                         f"edited {entity_id}", "2024-05-01 10:00:00",
+                                         [(entity_id, *mapping) for mapping in mappings[annotator_id]
+                                          if entity_id == 1])
+
+
+def test_pair_agreement_cohen_kappa_and_alignment_f1(storage):
+    seed_rows(storage, 4)
+    answer_rows(storage)
+    with storage.connection() as conn:
+        update_stats(conn)
+        report = pair_agreement(load_stats(conn))
+    row = report.iloc[0]
+    assert (row["annotator_a"], row["annotator_b"], row["rows"]) == ("first", "second", 4)
+    assert row["observed"] == pytest.approx(0.75)
+    # Chance agreement: 0.5 * 0.25 + 0.5 * 0.75 = 0.5
+    assert row["cohen_kappa"] == pytest.approx(0.5)
+    # One shared mapping out of 2 + 1
+    assert row["alignment_f1"] == pytest.approx(2 / 3)
+
+
+def test_fleiss_kappa(storage):
+    seed_rows(storage, 4)
+    answer_rows(storage)
+    with storage.connection() as conn:
+        update_stats(conn)
+        report = fleiss_kappa(load_stats(conn)).set_index("dialect")
+    # Observed 0.75; translation_1 has 3 of 8 ratings, translation_2 has 5
+    expected = (3 / 8) ** 2 + (5 / 8) ** 2
+    assert report.loc["", "rows"] == 4
+    assert report.loc["", "fleiss_kappa"] == pytest.approx((0.75 - expected) / (1 - expected))
+    assert report.loc["najdi", "fleiss_kappa"] == report.loc["", "fleiss_kappa"]
+
+
+def test_incremental_stats_match_a_rebuild(storage):
+    seed_rows(storage, 4)
+    answer_rows(storage, entity_ids=(1, 2))
+    with storage.connection() as conn:
+        update_stats(conn)
+    answer_rows(storage, entity_ids=(3, 4))
+    storage.write("reject_row", entity_id=2, annotator_id="third", datestamp="2024-05-02 09:00:00")
+    with storage.connection() as conn:
+        update_stats(conn)
+        incremental = load_stats(conn)
+        update_stats(conn, rebuild=True)
+        rebuilt = load_stats(conn)
+    key = ["metric", "dialect", "day", "annotator_a", "annotator_b", "category"]
+    assert (incremental.sort_values(key).reset_index(drop=True)
+            .equals(rebuilt.sort_values(key).reset_index(drop=True)))
@@ -0,0 +1,35 @@
+from annotation_app.annotations import skip_row
+from annotation_app.leases import LeasePolicy, reclaim_expired_leases
+from annotation_app.row_claims import claim_rows, held_rows
+
+from conftest import seed_rows
+
+
+def row_state(conn, entity_id):
+    return conn.execute("SELECT processed, taken, taken_by FROM original_data WHERE entity_id = ?",
+                        (entity_id,)).fetchone()
+
+
+def test_skip_without_hold_returns_row_to_the_pool(storage):
+    seed_rows(storage, 3)
+    with storage.connection() as conn:
+        claim_rows(conn, "first", 1)
+        skip_row(conn, 1, "first")
+        conn.commit()
+        assert row_state(conn, 1) == ("no", "no", None)
+        assert held_rows(conn, "first", 10) == []
+        assert [row[0] for row in claim_rows(conn, "first", 10)] == [2, 3]
+        assert [row[0] for row in claim_rows(conn, "second", 10)] == [1]
+
+
+def test_skip_with_hold_keeps_row_until_the_hold_runs_out(storage):
+    seed_rows(storage, 2)
+    with storage.connection() as conn:
+        claim_rows(conn, "first", 1)
+        skip_row(conn, 1, "first", lease_expires_at=1000.0)
+        conn.commit()
+        assert row_state(conn, 1) == ("skipped", "yes", "first")
+        assert [row[0] for row in claim_rows(conn, "second", 10)] == [2]
+        reclaim_expired_leases(conn, LeasePolicy(skip_hold_seconds=0), now=2000.0)
+        assert row_state(conn, 1) == ("no", "no", None)
+        assert [row[0] for row in claim_rows(conn, "third", 10)] == [1]
@@ -0,0 +1,81 @@
+import pytest
+
+from annotation_app.assignments import Assignment, deactivate_annotator, main
+
+from conftest import seed_rows
+
+
+def test_assignments_round_trip_with_their_shards(storage):
+    storage.save_assignments([Assignment("first", 60, 42, "2024-09-24", ["najdi", "gulf"]),
+                              Assignment("second", 30, 10, "2024-10-01")])
+    storage.save_assignments([Assignment("first", 50, 40, "2024-09-25", ["hijazi"])])
+    assignments = storage.assignments()
+    assert sorted(assignments) == ["first", "second"]
+    first = assignments["first"]
+    assert (first.daily_target, first.work_days, first.start_date, first.shards) == (50, 40, "2024-09-25",
+                                                                                      ("hijazi",))
+    assert first.total_target == 2000
+    assert assignments["second"].shards == ()
+
+
+def test_deactivated_annotators_are_left_out_until_saved_again(storage):
+    storage.save_assignments([Assignment("first", 60, 42, "2024-09-24"), Assignment("second", 60, 42, "2024-09-24")])
+    with storage.connection() as conn:
+        deactivate_annotator(conn, "first")
+    assert list(storage.assignments()) == ["second"]
+    storage.save_assignments([Assignment("first", 60, 42, "2024-09-24")])
+    assert sorted(storage.assignments()) == ["first", "second"]
+
+
+def test_start_date_must_be_a_date():
+    with pytest.raises(ValueError):
+        Assignment("first", 60, 42, "24/09/2024")
+
+
+def test_shard_backlog_counts_free_rows(storage):
+    seed_rows(storage, 3, start=1, dialect="najdi")
+    seed_rows(storage, 2, start=4, dialect="gulf")
+    seed_rows(storage, 1, start=6, dialect=None)
+    with storage.connection() as conn:
+        conn.execute("UPDATE original_data SET processed = 'yes' WHERE entity_id = 1")
+        conn.execute("UPDATE original_data SET taken = 'yes', taken_by = 'first' WHERE entity_id = 4")
+        conn.commit()
+    assert storage.shard_backlog() == {"": 1, "gulf": 1, "najdi": 2}
+
+
+def test_sharded_annotator_only_gets_rows_of_their_shards(storage):
+    seed_rows(storage, 3, start=1, dialect="najdi")
+    seed_rows(storage, 3, start=4, dialect="hijazi")
+    with storage.connection() as conn:
+        # Row 5's near-duplicates include a najdi row, which stays with the najdi annotators
+        conn.executemany("INSERT INTO near_duplicate_clusters (entity_id, cluster_id) VALUES (?, ?)",
+                         [(2, 2), (5, 2)])
+        conn.commit()
+    storage.save_assignments([Assignment("reader", 60, 42, "2024-09-24", ["hijazi"])])
+    queue = storage.row_queue("reader", batch_size=2, cluster_limit=5, shards=storage.assignments()["reader"].shards)
+    entity_ids = []
+    while True:
+        row = queue.next_row()
+        if row is None:
+            break
+        entity_ids.append(row[0])
+        with storage.connection() as conn:
+            conn.execute("UPDATE original_data SET processed = 'yes' WHERE entity_id = ?", (row[0],))
+            conn.commit()
+    assert entity_ids == [4, 5, 6]
+
+
+def test_command_line_sets_and_deactivates(storage, capsys):
+    assert main([storage.path, "set", "first", "--daily-target", "20", "--work-days", "5",
+                 "--start-date", "2024-09-24", "--shard", "gulf"]) == 0
+    assert "Assignment('first', daily_target=20, work_days=5" in capsys.readouterr().out
+    assert main([storage.path, "deactivate", "first"]) == 0
+    assert storage.assignments() == {}
+
+
+def test_seeding_never_brings_back_deactivated_annotators(storage):
+    assert storage.seed_assignments([Assignment("first", 60, 42, "2024-09-24")])
+    with storage.connection() as conn:
+        deactivate_annotator(conn, "first")
+    assert not storage.seed_assignments([Assignment("first", 60, 42, "2024-09-24")])
+    assert storage.assignments() == {}
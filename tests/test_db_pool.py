@@ -0,0 +1,102 @@
+import sqlite3
+
+import pytest
+
+from annotation_app.db_pool import ConnectionPool, PoolTimeout, transaction
+
+
+# Function to make a connect() for a pool over one SQLite file, keeping every connection
+# it opened so tests can break them
+def file_connect(path, opened):
+    def connect():
+        conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        opened.append(conn)
+        return conn
+    return connect
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "pool.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.close()
+    return path
+
+
+def test_idle_connections_are_reused(db_path):
+    opened = []
+    pool = ConnectionPool(file_connect(db_path, opened), max_size=2)
+    for _ in range(3):
+        with pool.connection() as conn:
+            conn.execute("SELECT 1")
+    assert len(opened) == 1
+    assert pool.stats() == {"max_size": 2, "in_use": 0, "idle": 1, "created": 1, "discarded": 0}
+
+
+def test_dead_idle_connection_fails_the_ping_and_is_replaced(db_path):
+    opened = []
+    pool = ConnectionPool(file_connect(db_path, opened), ping_after=0)
+    with pool.connection():
+        pass
+    opened[0].close()
+    with pool.connection() as conn:
+        assert conn is opened[1]
+        conn.execute("SELECT 1")
+    assert pool.stats()["discarded"] == 1
+
+
+def test_connections_past_max_lifetime_are_recycled(db_path):
+    opened = []
+    pool = ConnectionPool(file_connect(db_path, opened), max_lifetime=-1)
+    for _ in range(2):
+        with pool.connection():
+            pass
+    assert len(opened) == 2
+    assert pool.stats()["discarded"] == 1
+
+
+def test_acquire_times_out_when_every_connection_is_busy(db_path):
+    pool = ConnectionPool(file_connect(db_path, []), max_size=1, acquire_timeout=0.05)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    pool.release(held)
+    with pool.connection() as conn:
+        conn.execute("SELECT 1")
+
+
+def test_failed_transaction_is_rolled_back_and_connection_kept(db_path):
+    opened = []
+    pool = ConnectionPool(file_connect(db_path, opened))
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            with transaction(conn):
+                conn.execute("INSERT INTO t VALUES (1)")
+                raise ValueError("write failed half-way")
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    assert len(opened) == 1
+    assert pool.stats()["discarded"] == 0
+
+
+def test_connection_that_cannot_roll_back_is_discarded(db_path):
+    opened = []
+    pool = ConnectionPool(file_connect(db_path, opened))
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            conn.close()
+            raise ValueError("connection lost")
+    assert pool.stats() == {"max_size": 8, "in_use": 0, "idle": 0, "created": 1, "discarded": 1}
+    with pool.connection() as conn:
+        assert conn is opened[1]
+
+
+def test_closed_pool_refuses_checkouts(db_path):
+    pool = ConnectionPool(file_connect(db_path, []))
+    with pool.connection():
+        pass
+    pool.close()
+    assert pool.stats()["idle"] == 0
+    with pytest.raises(RuntimeError):
+        pool.acquire()
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from annotation_app.exporter import export_annotations, original_data_page
+from annotation_app.importer import import_file
+
+from conftest import write_jsonl
+
+RECORDS = [
+    {"entity_id": 1, "keyword": "رايح", "source_text": "وين رايح", "translation_1": "where are you going",
+     "dialect": "najdi"},
+    {"entity_id": 2, "source_text": "شلونك", "translation_1": "how are you", "dialect": "gulf"},
+    {"entity_id": 3, "source_text": "كيف حالك", "translation_1": "how are you", "dialect": "hijazi"},
+]
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def annotate(storage, entity_id, datestamp):
+    storage.commit_processed_row(entity_id, "first", "translation_1", RECORDS[entity_id - 1]["source_text"],
+                                 f"edited {entity_id}", datestamp, [(entity_id, "وين", "where")])
+
+
+def test_imported_rows_page_back_in_order(storage, tmp_path):
+    path = write_jsonl(tmp_path / "rows.jsonl", RECORDS)
+    with storage.connection() as conn:
+        import_file(conn, path, chunk_size=2)
+        first_page = original_data_page(conn, "no", limit=2)
+        second_page = original_data_page(conn, "no", after=first_page[-1][0], limit=2)
+    assert [row[0] for row in first_page + second_page] == [1, 2, 3]
+    assert first_page[0][:7] == (1, "رايح", "وين رايح", "where are you going", None, None, "najdi")
+
+
+def test_export_round_trip_is_incremental(storage, tmp_path):
+    with storage.connection() as conn:
+        import_file(conn, write_jsonl(tmp_path / "rows.jsonl", RECORDS))
+    annotate(storage, 1, "2024-05-01 10:00:00")
+    annotate(storage, 2, "2024-05-01 11:00:00")
+    out_dir = str(tmp_path / "exports")
+
+    with storage.connection() as conn:
+        path, count = export_annotations(conn, out_dir, fmt="jsonl")
+    records = read_jsonl(path)
+    assert count == 2
+    assert [record["entity_id"] for record in records] == [1, 2]
+    assert records[0]["source_text"] == "وين رايح"
+    assert records[0]["edited_translation"] == "edited 1"
+    assert records[0]["dialect"] == "najdi"
+    assert records[0]["token_mappings"] == [["وين", "where"]]
+
+    annotate(storage, 3, "2024-05-02 09:00:00")
+    with storage.connection() as conn:
+        path, count = export_annotations(conn, out_dir, fmt="jsonl")
+        assert [record["entity_id"] for record in read_jsonl(path)] == [3]
+        assert export_annotations(conn, out_dir, fmt="jsonl") == (None, 0)
+        with pytest.raises(ValueError):
+            export_annotations(conn, out_dir, fmt="jsonl", dialects=["gulf"])
+
+
+def test_parquet_export_matches_jsonl(storage, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    with storage.connection() as conn:
+        import_file(conn, write_jsonl(tmp_path / "rows.jsonl", RECORDS))
+    annotate(storage, 1, "2024-05-01 10:00:00")
+    with storage.connection() as conn:
+        parquet_path, _ = export_annotations(conn, str(tmp_path / "parquet"), fmt="parquet")
+        jsonl_path, _ = export_annotations(conn, str(tmp_path / "jsonl"), fmt="jsonl")
+    assert pq.read_table(parquet_path).to_pylist() == read_jsonl(jsonl_path)
+
+
+def test_export_leaves_out_rejects_and_skips(storage, tmp_path):
+    with storage.connection() as conn:
+        import_file(conn, write_jsonl(tmp_path / "rows.jsonl", RECORDS))
+    annotate(storage, 1, "2024-05-01 10:00:00")
+    storage.write("reject_row", entity_id=2, annotator_id="first", datestamp="2024-05-01 10:01:00")
+    storage.write("skip_row", entity_id=3, annotator_id="first", datestamp="2024-05-01 10:02:00")
+    with storage.connection() as conn:
+        path, count = export_annotations(conn, str(tmp_path / "exports"), fmt="jsonl")
+    assert count == 1
+    assert [(record["entity_id"], record["action"]) for record in read_jsonl(path)] == [(1, "processed")]
@@ -0,0 +1,38 @@
+import sqlite3
+
+from annotation_app.importer import import_file
+from annotation_app.migrations import apply_migrations
+from annotation_app.storage import BASE_SCHEMA_SQL
+
+from conftest import write_jsonl
+
+
+def test_import_counts_malformed_entity_ids_as_invalid(storage, tmp_path):
+    path = write_jsonl(tmp_path / "rows.jsonl", [
+        {"entity_id": 1, "source_text": "وين رايح"},
+        {"entity_id": "12a", "source_text": "شلونك"},
+        {"entity_id": 2},
+        {"source_text": "كيف حالك", "dialect": "hijazi"},
+    ])
+    with storage.connection() as conn:
+        stats = import_file(conn, path)
+        rows = conn.execute("SELECT entity_id, source_text FROM original_data ORDER BY entity_id").fetchall()
+    assert (stats["records"], stats["written"], stats["invalid"]) == (4, 2, 2)
+    assert rows == [(1, "وين رايح"), (2, "كيف حالك")]
+
+
+def test_import_writes_free_rows_without_column_defaults(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "cloud.sqlite3"), isolation_level=None)
+    conn.executescript(BASE_SCHEMA_SQL.replace("NOT NULL DEFAULT 'no'", ""))
+    apply_migrations(conn)
+    conn.execute("INSERT INTO original_data (entity_id, source_text) VALUES (1, 'old text')")
+    path = write_jsonl(tmp_path / "rows.jsonl", [
+        {"entity_id": 1, "source_text": "new text"},
+        {"entity_id": 2, "source_text": "second"},
+        {"source_text": "third"},
+    ])
+    stats = import_file(conn, path, update=True)
+    rows = conn.execute("SELECT entity_id, source_text, processed, taken FROM original_data").fetchall()
+    conn.close()
+    assert stats["written"] == 3
+    assert rows == [(1, "new text", "no", "no"), (2, "second", "no", "no"), (3, "third", "no", "no")]
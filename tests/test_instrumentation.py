@@ -0,0 +1,69 @@
+import json
+import threading
+
+from annotation_app.instrumentation import Metrics, RollingHistogram
+from annotation_app.storage import LocalSQLiteStorage
+
+
+def test_histogram_percentiles_cover_the_recent_window_only():
+    histogram = RollingHistogram(window=100)
+    for _ in range(50):
+        histogram.record(1.0)
+    for ms in range(1, 101):
+        histogram.record(ms / 1000)
+    summary = histogram.summary()
+    assert summary["count"] == 150
+    assert summary["mean_ms"] == round((50 * 1.0 + 5.05) / 150 * 1000, 3)
+    assert (summary["p50_ms"], summary["p95_ms"], summary["p99_ms"], summary["max_ms"]) == (51.0, 95.0, 99.0, 100.0)
+    buckets = histogram.buckets()
+    assert sum(buckets.values()) == 100
+    assert (buckets["<=1ms"], buckets["<=2ms"], buckets["<=100ms"], buckets[">5000ms"]) == (1, 1, 50, 0)
+
+
+def test_empty_histogram_summary():
+    assert RollingHistogram().summary() == {"count": 0, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0,
+                                            "p99_ms": 0.0, "max_ms": 0.0}
+
+
+def test_rerun_counters_are_kept_per_thread():
+    metrics = Metrics()
+    events = {}
+
+    def rerun(name, queries):
+        metrics.start_rerun()
+        with metrics.timer("span"):
+            for _ in range(queries):
+                metrics.record_db("db.select", 0.001)
+        metrics.record_db("db.commit", 0.001, queries=0)
+        barrier.wait()
+        events[name] = metrics.finish_rerun(annotator_id=name)
+
+    barrier = threading.Barrier(2)
+    threads = [threading.Thread(target=rerun, args=(name, queries)) for name, queries in (("first", 2), ("second", 5))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert {name: (event["queries"], event["round_trips"], event["span_queries"]["span"])
+            for name, event in events.items()} == {"first": (2, 3, 2), "second": (5, 6, 5)}
+    assert metrics.snapshot()["db.select"]["count"] == 7
+    assert metrics.queries_per_rerun() == {"reruns": 2, "mean": 3.5, "p95": 5, "max": 5}
+    assert metrics.finish_rerun() is None
+
+
+def test_finished_reruns_are_appended_as_jsonl(tmp_path):
+    path = tmp_path / "reruns.jsonl"
+    metrics = Metrics(jsonl_path=str(path))
+    storage = LocalSQLiteStorage(str(tmp_path / "annotations.sqlite3"), pool_size=1, metrics=metrics)
+    try:
+        for annotator_id in ("first", "second"):
+            metrics.start_rerun()
+            with storage.connection() as conn:
+                conn.execute("SELECT COUNT(*) FROM original_data").fetchone()
+            metrics.finish_rerun(annotator_id=annotator_id, scope="page")
+    finally:
+        storage.close()
+    events = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [(event["annotator_id"], event["scope"], event["queries"]) for event in events] == [
+        ("first", "page", 1), ("second", "page", 1)]
+    assert {"ts", "rerun_ms", "round_trips", "db_ms", "spans_ms", "span_queries"} <= set(events[0])
@@ -0,0 +1,73 @@
+from annotation_app.leases import LeasePolicy, lease_stats, reclaim_expired_leases, renew_leases
+from annotation_app.row_claims import claim_rows
+
+from conftest import seed_rows
+
+
+def leases(conn):
+    return conn.execute("SELECT entity_id, taken, taken_by, lease_expires_at FROM original_data ORDER BY 1").fetchall()
+
+
+def test_expired_leases_go_back_to_the_pool(storage):
+    seed_rows(storage, 3)
+    with storage.connection() as conn:
+        claim_rows(conn, "first", 2, lease_seconds=60)
+        now = conn.execute("SELECT MAX(lease_expires_at) FROM original_data").fetchone()[0] - 60
+        assert reclaim_expired_leases(conn, LeasePolicy(lease_seconds=60), now=now + 30) == 0
+        assert reclaim_expired_leases(conn, LeasePolicy(lease_seconds=60), now=now + 61) == 2
+        assert [row[:3] for row in leases(conn)] == [(1, "no", None), (2, "no", None), (3, "no", None)]
+        assert [row[0] for row in claim_rows(conn, "second", 5)] == [1, 2, 3]
+
+
+def test_renewed_leases_are_not_reclaimed(storage):
+    seed_rows(storage, 2)
+    with storage.connection() as conn:
+        claim_rows(conn, "first", 1, lease_seconds=60)
+        claim_rows(conn, "second", 1, lease_seconds=60)
+        assert renew_leases(conn, "first", lease_seconds=60, now=2e9) == 1
+        assert reclaim_expired_leases(conn, LeasePolicy(lease_seconds=60), now=2e9 - 1) == 1
+        assert [row[:3] for row in leases(conn)] == [(1, "yes", "first"), (2, "no", None)]
+
+
+def test_reservations_without_a_lease_are_adopted_then_reclaimed(storage):
+    seed_rows(storage, 2)
+    with storage.connection() as conn:
+        conn.execute("UPDATE original_data SET taken = 'yes', taken_by = 'legacy' WHERE entity_id = 1")
+        conn.commit()
+        assert lease_stats(conn, now=1000.0)["unleased"] == 1
+        assert reclaim_expired_leases(conn, LeasePolicy(lease_seconds=60), now=1000.0) == 0
+        assert leases(conn)[0] == (1, "yes", "legacy", 1060.0)
+        assert reclaim_expired_leases(conn, LeasePolicy(lease_seconds=60), now=1061.0) == 1
+        assert lease_stats(conn, now=1061.0) == {"free": 2, "locked": 0, "in_progress": 0, "skipped": 0,
+                                                 "expired": 0, "unleased": 0}
+
+
+def skipped_for_good(storage):
+    seed_rows(storage, 2)
+    with storage.connection() as conn:
+        # A skip from before skips stopped holding rows: kept by its annotator, no lease
+        conn.execute('''
+            UPDATE original_data SET processed = 'skipped', taken = 'yes', taken_by = 'first'
+            WHERE entity_id = 1
+        ''')
+        conn.execute("INSERT INTO skipped_rows (annotator_id, entity_id) VALUES ('first', 1)")
+        conn.commit()
+
+
+def test_old_skips_go_back_to_the_pool_without_a_skip_hold(storage):
+    skipped_for_good(storage)
+    with storage.connection() as conn:
+        assert reclaim_expired_leases(conn, LeasePolicy(), now=1000.0) == 1
+        assert leases(conn)[0] == (1, "no", None, None)
+        assert [row[0] for row in claim_rows(conn, "first", 5)] == [2]
+        assert [row[0] for row in claim_rows(conn, "second", 5)] == [1]
+
+
+def test_old_skips_keep_the_configured_skip_hold(storage):
+    skipped_for_good(storage)
+    with storage.connection() as conn:
+        policy = LeasePolicy(skip_hold_seconds=3600)
+        assert reclaim_expired_leases(conn, policy, now=1000.0) == 0
+        assert leases(conn)[0] == (1, "yes", "first", 4600.0)
+        assert reclaim_expired_leases(conn, policy, now=4601.0) == 1
+        assert leases(conn)[0] == (1, "no", None, None)
@@ -0,0 +1,27 @@
+from annotation_app.migrations import HOT_QUERIES, MIGRATIONS, apply_migrations, check_query_plans
+from annotation_app.row_claims import CLAIM_ROWS_SQL
+from annotation_app.storage import LocalSQLiteStorage
+
+
+def test_hot_queries_have_no_slow_plan_steps(storage):
+    with storage.connection() as conn:
+        report = check_query_plans(conn)
+    assert report == {name: [] for name in HOT_QUERIES}
+
+
+def test_check_query_plans_flags_claims_that_search_the_pending_index(storage):
+    unkeyed = CLAIM_ROWS_SQL.replace("+processed", "processed").replace("+taken", "taken")
+    with storage.connection() as conn:
+        report = check_query_plans(conn, {"claim_rows": (unkeyed, HOT_QUERIES["claim_rows"][1])})
+    assert report["claim_rows"]
+    assert all("USING INTEGER PRIMARY KEY" not in step for step in report["claim_rows"])
+
+
+def test_check_query_plans_flags_temp_b_tree_sorts(tmp_path):
+    storage = LocalSQLiteStorage(str(tmp_path / "annotations.sqlite3"))
+    with storage.connection() as conn:
+        # Everything except the (processed, entity_id) index that original_data_page sorts by
+        apply_migrations(conn, [migration for migration in MIGRATIONS if migration[0] != 13])
+        report = check_query_plans(conn, {"original_data_page": HOT_QUERIES["original_data_page"]})
+    storage.close()
+    assert report["original_data_page"] == ["USE TEMP B-TREE FOR ORDER BY"]
@@ -0,0 +1,61 @@
+from annotation_app.near_duplicates import build_index, minhash_signatures
+from annotation_app.row_claims import claim_cluster_rows, claim_rows
+
+from conftest import seed_rows
+
+SENTENCE = "وين رايح اليوم يا صاحبي بعد ما يخلص الدوام الطويل"
+NEAR_DUPLICATE = "وين رايح اليوم يا صاحبي بعد ما يخلص الدوام الطويل؟"
+OTHER = "الجو حار جدا في الرياض هذا الصيف ولازم نسافر"
+
+
+def set_sources(storage, sources):
+    with storage.connection() as conn:
+        conn.executemany("UPDATE original_data SET source_text = ? WHERE entity_id = ?",
+                         [(text, entity_id) for entity_id, text in sources.items()])
+        conn.commit()
+
+
+def clusters(storage):
+    with storage.connection() as conn:
+        return conn.execute("SELECT entity_id, cluster_id FROM near_duplicate_clusters ORDER BY entity_id").fetchall()
+
+
+def test_near_duplicates_join_one_cluster(storage):
+    seed_rows(storage, 6)
+    set_sources(storage, {2: SENTENCE, 4: OTHER, 5: SENTENCE.replace("اليوم", "أليوم"), 6: NEAR_DUPLICATE})
+    with storage.connection() as conn:
+        # Rows 5 and 6 join row 2 from the first page
+        assert build_index(conn, page_size=4) == (6, 2)
+    assert clusters(storage) == [(2, 2), (5, 2), (6, 2)]
+
+
+def test_later_runs_index_rows_imported_with_lower_ids(storage):
+    seed_rows(storage, 3, start=10)
+    set_sources(storage, {10: SENTENCE, 11: "", 12: OTHER})
+    with storage.connection() as conn:
+        assert build_index(conn) == (3, 0)
+        assert build_index(conn) == (0, 0)
+    seed_rows(storage, 2, start=1)
+    set_sources(storage, {1: NEAR_DUPLICATE})
+    with storage.connection() as conn:
+        assert build_index(conn) == (2, 1)
+        assert conn.execute("SELECT COUNT(*) FROM minhash_signatures").fetchone()[0] == 5
+    assert clusters(storage) == [(1, 1), (10, 1)]
+
+
+def test_rows_without_text_get_no_signature():
+    present, signatures = minhash_signatures([SENTENCE, "", None, "  "])
+    assert present == [0]
+    assert signatures.shape == (1, 32)
+
+
+def test_cluster_rows_are_claimed_together(storage):
+    seed_rows(storage, 8)
+    set_sources(storage, {1: SENTENCE, 4: OTHER, 7: NEAR_DUPLICATE})
+    with storage.connection() as conn:
+        build_index(conn)
+        rows = claim_rows(conn, "first", 2)
+        rows = claim_cluster_rows(conn, "first", rows, limit=5)
+        second = claim_rows(conn, "second", 10)
+    assert [row[0] for row in rows] == [1, 7, 2]
+    assert [row[0] for row in second] == [3, 4, 5, 6, 8]
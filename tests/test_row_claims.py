@@ -0,0 +1,129 @@
+from annotation_app.row_claims import CLAIM_CLUSTER_ROWS_SQL, CLAIM_ROWS_SQL, CLAIM_SHARD_ROWS_SQL, RowPrefetcher, claim_rows, held_rows
+
+from conftest import seed_rows
+
+
+# Function to get the steps of a statement's plan that read its target table (the ones
+# not nested under a subquery)
+def target_steps(conn, sql, params):
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [detail for _, parent, _, detail in plan if parent == 0 and "SUBQUERY" not in detail]
+
+
+def test_claim_rows_updates_chosen_rows_by_rowid(storage):
+    seed_rows(storage, 50)
+    with storage.connection() as conn:
+        steps = target_steps(conn, CLAIM_ROWS_SQL, ("reader", 0, "reader", 5))
+    assert steps == ["SEARCH original_data USING INTEGER PRIMARY KEY (rowid=?)"]
+
+
+def test_claim_shard_rows_updates_chosen_rows_by_rowid(storage):
+    seed_rows(storage, 50)
+    with storage.connection() as conn:
+        steps = target_steps(conn, CLAIM_SHARD_ROWS_SQL.format(shards="?"), ("reader", 0, "najdi", "reader", 5))
+    assert steps == ["SEARCH original_data USING INTEGER PRIMARY KEY (rowid=?)"]
+
+
+def test_claim_cluster_rows_updates_chosen_rows_by_rowid(storage):
+    seed_rows(storage, 50)
+    with storage.connection() as conn:
+        steps = target_steps(conn, CLAIM_CLUSTER_ROWS_SQL.format(cluster_ids="?", shard_filter=""),
+                             ("reader", 0, 1, "reader", 5))
+    assert steps == ["SEARCH original_data USING INTEGER PRIMARY KEY (rowid=?)"]
+
+
+def test_claim_rows_never_hands_out_a_row_twice(storage):
+    seed_rows(storage, 10)
+    with storage.connection() as conn:
+        first = claim_rows(conn, "first", 6)
+        second = claim_rows(conn, "second", 6)
+    assert [row[0] for row in first] == [1, 2, 3, 4, 5, 6]
+    assert [row[0] for row in second] == [7, 8, 9, 10]
+    assert {row[9] for row in first} == {"first"}
+
+
+def test_claim_rows_only_reads_the_given_shards(storage):
+    seed_rows(storage, 4, start=1, dialect="najdi")
+    seed_rows(storage, 4, start=5, dialect="hijazi")
+    with storage.connection() as conn:
+        rows = claim_rows(conn, "reader", 10, shards=["hijazi"])
+    assert [row[0] for row in rows] == [5, 6, 7, 8]
+
+
+def test_row_queue_does_not_skip_held_rows_behind_near_duplicates(storage):
+    seed_rows(storage, 30)
+    with storage.connection() as conn:
+        # Rows 1-10 are still held from an earlier session; row 20 is a free near-duplicate of row 1
+        claim_rows(conn, "reader", 10)
+        conn.executemany("INSERT INTO near_duplicate_clusters (entity_id, cluster_id) VALUES (?, ?)",
+                         [(1, 1), (20, 1)])
+        conn.commit()
+    queue = storage.row_queue("reader", batch_size=5, cluster_limit=5)
+    assert take(storage, queue, 11) == [1, 20, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+
+
+def finish(storage, entity_id):
+    with storage.connection() as conn:
+        conn.execute("UPDATE original_data SET processed = 'yes' WHERE entity_id = ?", (entity_id,))
+        conn.commit()
+
+
+# Function to take `count` rows off a queue the way the app does: each row is finished
+# before the next one is asked for
+def take(storage, queue, count):
+    entity_ids = []
+    for _ in range(count):
+        row = queue.next_row()
+        if row is None:
+            break
+        entity_ids.append(row[0])
+        finish(storage, row[0])
+    return entity_ids
+
+
+def test_row_queue_claims_in_batches_and_releases_what_was_not_shown(storage):
+    seed_rows(storage, 8)
+    queue = storage.row_queue("reader", batch_size=3)
+    assert take(storage, queue, 4) == [1, 2, 3, 4]
+    assert len(queue) == 2
+    queue.release()
+    with storage.connection() as conn:
+        assert held_rows(conn, "reader", 10) == []
+        assert [row[0] for row in claim_rows(conn, "other", 10)] == [5, 6, 7, 8]
+
+
+def test_row_queue_of_a_new_session_resumes_held_rows_first(storage):
+    seed_rows(storage, 6)
+    with storage.connection() as conn:
+        claim_rows(conn, "reader", 3)
+    finish(storage, 1)
+    queue = storage.row_queue("reader", batch_size=2)
+    assert take(storage, queue, 3) == [2, 3, 4]
+    # Row 5 is still being written (e.g. in the write-behind journal)
+    assert queue.next_row(exclude=[5])[0] == 6
+    finish(storage, 6)
+    finish(storage, 5)
+    assert queue.next_row() is None
+
+
+def test_prefetching_never_serves_a_row_twice(storage):
+    seed_rows(storage, 9)
+    prefetcher = RowPrefetcher(storage.row_queue("reader", batch_size=2))
+    served = []
+    row = prefetcher.next_row()
+    while row is not None:
+        entity_id = row[0]
+        served.append(entity_id)
+        # As in the app: prefetch while the row is on screen, then write it
+        prefetcher.prefetch(exclude=[entity_id])
+        prefetcher.wait()
+        if entity_id % 3 == 0:
+            storage.write("skip_row", entity_id=entity_id, annotator_id="reader")
+        elif entity_id % 3 == 1:
+            storage.write("processed_row", entity_id=entity_id, annotator_id="reader",
+                          selected_translation="translation_1", edited_source=f"source {entity_id}",
+                          edited_translation=f"first {entity_id}", datestamp="2024-05-01 10:00:00", mappings=[])
+        else:
+            storage.write("reject_row", entity_id=entity_id, annotator_id="reader", datestamp="2024-05-01 10:00:00")
+        row = prefetcher.next_row()
+    assert served == list(range(1, 10))
@@ -0,0 +1,62 @@
+from annotation_app.annotations import insert_annotation
+from annotation_app.search import index_new_annotations, match_query
+
+from conftest import seed_rows
+
+
+def process(storage, entity_id, edited_source, edited_translation, mappings=()):
+    storage.commit_processed_row(entity_id, "first", "translation_1", edited_source, edited_translation,
+                                 "2024-05-01 10:00:00", [(entity_id, source, translation)
+                                                         for source, translation in mappings])
+
+
+def found(storage, text):
+    return [result["entity_id"] for result in storage.search_examples(text)]
+
+
+def test_match_query_makes_every_normalized_word_a_prefix():
+    assert match_query("إلى  أينَ؟") == '"الي"* "اين"*'
+    assert match_query("رايح_معي") == '"رايح_معي"*'
+    assert match_query(" ؟! ") is None
+
+
+def test_processed_rows_are_found_by_folded_prefixes(storage):
+    seed_rows(storage, 3)
+    process(storage, 1, "إلى أينَ رايحين", "where are you going")
+    process(storage, 2, "شلونك اليوم", "how are you today")
+    storage.write("reject_row", entity_id=3, annotator_id="first", datestamp="2024-05-01 11:00:00")
+    assert found(storage, "الى اين") == [1]
+    assert found(storage, "رايح") == [1]
+    assert found(storage, "today") == [2]
+    assert found(storage, "going today") == []
+    [result] = storage.search_examples("رايح")
+    assert result["edited_source"] == "الي اين **رايحين**"
+    with storage.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM annotation_search").fetchone()[0] == 2
+
+
+def test_token_mapping_writes_reindex_the_row(storage):
+    seed_rows(storage, 2)
+    process(storage, 1, "وين رايح", "where are you going", [("وين", "where")])
+    assert found(storage, "ذاهب") == []
+    storage.write("token_mappings", annotator_id="first", mappings=[(1, "رايح", "ذاهب")])
+    [result] = storage.search_examples("ذاهب")
+    assert result["entity_id"] == 1
+    assert result["mappings"] == "وين → where ؛ رايح → **ذاهب**"
+
+
+def test_index_new_annotations_catches_up_on_unindexed_rows(storage):
+    seed_rows(storage, 3)
+    process(storage, 1, "وين رايح", "where are you going")
+    with storage.connection() as conn:
+        insert_annotation(conn, 2, "first", "translation_1", "كيف حالك", "how are you", "processed",
+                          "2024-05-01 10:00:00")
+        insert_annotation(conn, 3, "first", None, None, None, "reject", "2024-05-01 10:00:00")
+        conn.commit()
+        assert index_new_annotations(conn) == 1
+        assert index_new_annotations(conn) == 0
+    assert found(storage, "حال") == [2]
+    with storage.connection() as conn:
+        assert index_new_annotations(conn, rebuild=True) == 2
+    assert found(storage, "حال") == [2]
+    assert found(storage, "رايح") == [1]
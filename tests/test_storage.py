@@ -0,0 +1,11 @@
+import pytest
+
+from annotation_app.storage import Storage
+
+
+def test_storage_backends_must_implement_connect():
+    class NoConnect(Storage):
+        pass
+
+    with pytest.raises(TypeError):
+        NoConnect()
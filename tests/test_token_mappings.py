@@ -0,0 +1,76 @@
+from annotation_app import token_mappings
+from annotation_app.token_mappings import TokenMappingIndex
+
+from conftest import seed_rows
+
+
+class Loader:
+    def __init__(self, groups):
+        self.groups = groups
+        self.calls = []
+
+    def __call__(self, source_token):
+        self.calls.append(source_token)
+        return {"total_mappings": sum(count for _, count, _ in self.groups),
+                "total_groups": len(self.groups), "groups": list(self.groups)}
+
+
+def test_summary_groups_mappings_with_examples(storage):
+    seed_rows(storage, 3)
+    storage.commit_processed_row(1, "first", "translation_1", "وين رايح", "edited 1", "2024-05-01 10:00:00",
+                                 [(1, "وين", "where")])
+    storage.commit_processed_row(2, "first", "translation_1", "وين ساكن", "edited 2", "2024-05-01 10:01:00",
+                                 [(2, "وين", "where")])
+    storage.commit_processed_row(3, "first", "translation_1", "وينك", "edited 3", "2024-05-01 10:02:00",
+                                 [(3, "وين", "where are")])
+    summary = storage.mapping_summary("وين", page_size=-1)
+    assert summary["total_mappings"] == 3
+    assert summary["total_groups"] == 2
+    assert summary["groups"] == [("where", 2, ["وين ساكن", "وين رايح"]), ("where are", 1, ["وينك"])]
+
+
+def test_cache_evicts_least_recently_used_beyond_the_cap():
+    index = TokenMappingIndex(max_entries=2)
+    load = Loader([("where", 1, [])])
+    index.summary("a", load)
+    index.summary("b", load)
+    index.summary("a", load)
+    index.summary("c", load)
+    index.summary("a", load)
+    index.summary("b", load)
+    assert load.calls == ["a", "b", "c", "b"]
+    assert (index.hits, index.misses) == (2, 4)
+
+
+def test_cache_reloads_entries_older_than_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(token_mappings.time, "monotonic", lambda: now[0])
+    index = TokenMappingIndex(ttl=600.0)
+    load = Loader([("where", 1, [])])
+    index.summary("وين", load)
+    now[0] += 599
+    index.summary("وين", load)
+    assert load.calls == ["وين"]
+    load.groups = [("where", 4, [])]
+    now[0] += 2
+    assert index.summary("وين", load)["total_mappings"] == 4
+    assert load.calls == ["وين", "وين"]
+
+
+def test_add_updates_a_cached_entry_in_place():
+    index = TokenMappingIndex(examples=2)
+    load = Loader([("where", 2, ["وين رايح"]), ("where are", 1, [])])
+    index.add("وين", "where", "ignored")
+    index.summary("وين", load)
+    index.add("وين", "where are", "وينك")
+    index.add("وين", "where are", "وينكم")
+    index.add("وين", "where are", "وين انتم")
+    index.add("وين", "where to", None)
+    summary = index.summary("وين", load)
+    assert load.calls == ["وين"]
+    assert summary["total_mappings"] == 7
+    assert summary["groups"] == [("where are", 4, ["وين انتم", "وينكم"]), ("where", 2, ["وين رايح"]),
+                                 ("where to", 1, [])]
+    index.invalidate("وين")
+    index.summary("وين", load)
+    assert load.calls == ["وين", "وين"]
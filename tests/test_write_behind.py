@@ -0,0 +1,94 @@
+import contextlib
+import sqlite3
+
+from annotation_app.annotations import WRITE_OPERATIONS
+from annotation_app.write_behind import WriteBehindWorker, WriteJournal
+
+from conftest import seed_rows
+
+
+def reject_everything(conn, **payload):
+    raise sqlite3.IntegrityError("rejected by the database")
+
+
+@contextlib.contextmanager
+def offline_connection():
+    conn = sqlite3.connect(":memory:")
+    conn.close()
+    yield conn
+
+
+def make_worker(storage, tmp_path, get_connection=None, max_attempts=2):
+    journal = WriteJournal(str(tmp_path / "journal.sqlite3"))
+    operations = dict(WRITE_OPERATIONS, reject_everything=reject_everything)
+    return WriteBehindWorker(journal, get_connection or storage.connection, operations, max_attempts=max_attempts)
+
+
+def processed(conn):
+    return [row[0] for row in conn.execute("SELECT entity_id FROM original_data WHERE processed = 'yes' ORDER BY 1")]
+
+
+def test_entries_are_delivered_in_order_and_removed(storage, tmp_path):
+    seed_rows(storage, 3)
+    worker = make_worker(storage, tmp_path)
+    for entity_id in (1, 2, 3):
+        worker.enqueue("row_status", entity_id, {"entity_id": entity_id, "action": "yes"})
+    assert worker.journal.pending_entity_ids() == {1, 2, 3}
+    assert worker.drain_once() == 3
+    assert worker.stats()["pending"] == 0
+    with storage.connection() as conn:
+        assert processed(conn) == [1, 2, 3]
+
+
+def test_entries_already_applied_are_not_applied_twice(storage, tmp_path, monkeypatch):
+    seed_rows(storage, 1)
+    worker = make_worker(storage, tmp_path)
+    worker.enqueue("annotation", 1, {"entity_id": 1, "annotator_id": "first", "selected_translation": "translation_1",
+                                     "edited_source": "source 1", "edited_translation": "first 1",
+                                     "action": "processed", "datestamp": "2024-05-01 10:00:00"})
+    # The process dies after the cloud COMMIT but before the local delete
+    monkeypatch.setattr(worker.journal, "remove_through", lambda seq: None)
+    assert worker.drain_once() == 1
+    monkeypatch.undo()
+    assert worker.drain_once() == 1
+    with storage.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM annotation").fetchone()[0] == 1
+        assert conn.execute("SELECT annotation_count FROM annotation_progress").fetchone()[0] == 1
+
+
+def test_rejected_entry_is_retried_then_moved_to_dead_letter(storage, tmp_path):
+    seed_rows(storage, 2)
+    worker = make_worker(storage, tmp_path, max_attempts=2)
+    worker.enqueue("row_status", 1, {"entity_id": 1, "action": "yes"})
+    worker.enqueue("reject_everything", 2, {})
+    worker.enqueue("row_status", 2, {"entity_id": 2, "action": "yes"})
+
+    assert worker.drain_once() == 0  # the batch fails: the head is retried on its own
+    assert worker.drain_once() == 1  # entry 1 alone goes through
+    assert worker.drain_once() == 0  # [bad, 2] fails as a batch
+    assert worker.drain_once() == 0  # first rejection of the bad entry
+    assert worker.stats()["dead_letter"] == 0
+    assert worker.drain_once() == 0  # second rejection: set aside
+    assert worker.stats()["dead_letter"] == 1
+    assert worker.drain_once() == 1
+    assert worker.stats() == {"pending": 0, "dead_letter": 1, "delivered": 2,
+                              "last_error": "IntegrityError('rejected by the database')"}
+    with storage.connection() as conn:
+        assert processed(conn) == [1, 2]
+
+
+def test_network_failures_are_retried_without_dead_lettering(storage, tmp_path):
+    seed_rows(storage, 1)
+    connections = [offline_connection]
+    worker = make_worker(storage, tmp_path, get_connection=lambda: connections[0](), max_attempts=2)
+    worker.enqueue("row_status", 1, {"entity_id": 1, "action": "yes"})
+    for _ in range(5):
+        assert worker.drain_once() == 0
+    assert worker.stats()["pending"] == 1
+    assert worker.stats()["dead_letter"] == 0
+    assert worker._retry_wait() == min(worker.retry_delay * 2 ** 4, worker.max_retry_delay)
+
+    connections[0] = storage.connection
+    assert worker.drain_once() == 1
+    with storage.connection() as conn:
+        assert processed(conn) == [1]